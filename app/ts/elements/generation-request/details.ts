@@ -62,6 +62,15 @@ export class GenerationRequestDetails extends HTMLElement {
             return;
         }
 
+        // the list leaves the spec out, so fetch it the first time it's shown
+        if (!this.request.spec && AuthHelper.hasToken() && !EnvHelper.useLocal) {
+            this.vc.show(this.request, (request: Model) => {
+                this.request.spec = request.spec || {images: [], videos: []};
+                this.draw();
+            });
+            return;
+        }
+
         if (this.request.spec) {
             const images = this.request.spec.images;
             if (images && images.length) {
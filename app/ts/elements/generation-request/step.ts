@@ -71,6 +71,8 @@ export class GenerationRequestDetailsStep extends HTMLElement {
             'roll_velocity',
             'iterations',
             'init_iterations',
+            'min_iterations',
+            'convergence_window',
             'upscale',
             'interpolate',
             'epochs',
@@ -1,6 +1,7 @@
 import {CustomElement} from 'custom-elements-ts';
 import {GenerationRequest as Model} from "../models/generation-request";
 import {GenerationRequest} from "./generation-request";
+import {Vc} from "../vc";
 
 @CustomElement({
     tag: 'vc-generation-requests',
@@ -33,5 +34,14 @@ export class GenerationRequests extends HTMLElement {
             this.$root.appendChild($request);
             $request.update(request);
         });
+
+        const vc = Vc.instance;
+        if (vc && vc.hasMore()) {
+            const $more = document.createElement('button');
+            $more.classList.add('more');
+            $more.innerText = 'Load more';
+            $more.addEventListener('click', () => vc.more());
+            this.$root.appendChild($more);
+        }
     }
 }
@@ -7,23 +7,41 @@ export class Manager {
     isLocal = EnvHelper.useLocal
     host = EnvHelper.host
     base_url = '/api/generation-request/'
+    source: EventSource = null
+    pageSize = 50
+    nextCursor: string = null
 
     constructor() {
         this.requests = [];
     }
 
     async fetch(url = '') {
+        const response = await this.request(url);
+        return response.json();
+    }
+
+    async fetchPage(cursor: string = null, limit: number = null) {
+        const params = new URLSearchParams();
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        params.set('limit', String(limit || this.pageSize));
+        const response = await this.request('?' + params.toString());
+        this.nextCursor = response.headers.get('X-Next-Cursor');
+        return response.json();
+    }
+
+    async request(url = '') {
         url = this.host + this.base_url + url;
         if (this.isLocal) {
             url = '/assets/latest.json';
         }
-        const response = await fetch(url, {
+        return fetch(url, {
             headers: {
                 'Authorization': 'Bearer ' + AuthHelper.token,
                 'Content-Type': 'application/json',
             },
         });
-        return response.json();
     }
 
     async post(data: any, url = '') {
@@ -58,12 +76,34 @@ export class Manager {
     }
 
     index(callback: CallableFunction) {
-        this.fetch().then((response) => {
+        // reload as many as are already showing, not just the first page
+        const limit = Math.max(this.requests.length, this.pageSize);
+        this.fetchPage(null, limit).then((response) => {
             this.load(response);
             callback(this.requests);
         });
     }
 
+    more(callback: CallableFunction) {
+        if (!this.nextCursor) {
+            return;
+        }
+        this.fetchPage(this.nextCursor).then((response) => {
+            this.load(this.requests.concat(response));
+            callback(this.requests);
+        });
+    }
+
+    show(id: number, callback: CallableFunction) {
+        this.fetch(String(id)).then((request: GenerationRequest) => {
+            callback(request);
+        });
+    }
+
+    hasMore() {
+        return this.nextCursor !== null;
+    }
+
     create(request: GenerationRequest, callback: CallableFunction) {
         this.post(request).then(() => {
             this.index(callback);
@@ -100,6 +140,42 @@ export class Manager {
         });
     }
 
+    listen(callback: CallableFunction) {
+        this.close();
+        if (this.isLocal || !(window as any).EventSource) {
+            return false;
+        }
+        let url = this.host + this.base_url + 'stream';
+        if (AuthHelper.hasToken()) {
+            url += '?token=' + encodeURIComponent(AuthHelper.token);
+        }
+        this.source = new EventSource(url);
+        this.source.onmessage = (message: MessageEvent) => {
+            callback(JSON.parse(message.data));
+        };
+        return true;
+    }
+
+    close() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+    }
+
+    apply(delta: any): boolean {
+        const request = this.requests.find((request) => request.id === delta.id);
+        if (!request) {
+            return false;
+        }
+        for (const key of Object.keys(delta)) {
+            if (key !== 'event' && key !== 'id') {
+                (request as any)[key] = delta[key];
+            }
+        }
+        return true;
+    }
+
     load(data: GenerationRequest[]) {
         this.requests = data;
     }
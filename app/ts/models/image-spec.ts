@@ -3,6 +3,9 @@ export class ImageSpec {
     styles: string[] = [];
     iterations ?: number;
     upscale ?: boolean;
+    convergence_window ?: number;
+    convergence_threshold ?: number;
+    min_iterations ?: number;
 }
 
 export class VideoStepSpec extends ImageSpec {
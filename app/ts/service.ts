@@ -15,6 +15,30 @@ export class Service {
         });
     }
 
+    more(callback: CallableFunction) {
+        this.manager.more(callback);
+    }
+
+    hasMore() {
+        return this.manager.hasMore();
+    }
+
+    show(request: GenerationRequest, callback: CallableFunction) {
+        this.manager.show(request.id, callback);
+    }
+
+    listen(refresh: CallableFunction, callback: CallableFunction) {
+        return this.manager.listen((delta: any) => {
+            // progress deltas patch the list in place, anything else (a new
+            // request, a result, a status change) means reloading it
+            if (delta.event === 'progress' && this.manager.apply(delta)) {
+                callback(this.manager.requests);
+            } else {
+                refresh();
+            }
+        });
+    }
+
     create(spec: ImageSpec, callback: CallableFunction) {
         const request = {
             spec: {
@@ -22,11 +22,24 @@ export class Vc {
         this.service = new Service();
         this.$requests = document.querySelector('vc-generation-requests');
         if (this.$requests) {
-            this.refreshAndSetTimeout();
-            AuthHelper.listen(this.refresh.bind(this));
+            this.refresh();
+            this.listen();
+            AuthHelper.listen(() => {
+                this.refresh();
+                this.listen();
+            });
         }
     }
 
+    listen() {
+        const listening = this.service.listen(
+            this.refresh.bind(this),
+            this.draw.bind(this)
+        );
+        // no server push available, fall back to polling
+        this.setAutoRefresh(!listening && !EnvHelper.useLocal);
+    }
+
     static get instance() {
         return (global as any).vc;
     }
@@ -66,6 +79,18 @@ export class Vc {
         this.service.refresh(this.draw.bind(this));
     }
 
+    more() {
+        this.service.more(this.draw.bind(this));
+    }
+
+    hasMore() {
+        return this.service.hasMore();
+    }
+
+    show(request: GenerationRequest, callback: CallableFunction) {
+        this.service.show(request, callback);
+    }
+
     cancel(request: GenerationRequest) {
         this.service.cancel(request, this.refresh.bind(this));
     }
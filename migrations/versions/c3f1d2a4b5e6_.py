@@ -0,0 +1,45 @@
+"""generation request listing indexes
+
+Revision ID: c3f1d2a4b5e6
+Revises: a684c982c890
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1d2a4b5e6'
+down_revision = 'a684c982c890'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_generation_request_created_id',
+        'generation_request',
+        ['created', 'id'],
+        unique=False,
+        postgresql_where=sa.text('deleted IS NULL')
+    )
+    op.create_index(
+        'ix_generation_request_published_created_id',
+        'generation_request',
+        ['created', 'id'],
+        unique=False,
+        postgresql_where=sa.text('deleted IS NULL AND published IS NOT NULL')
+    )
+    op.create_index(
+        op.f('ix_generation_result_request_id'),
+        'generation_result',
+        ['request_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_generation_result_request_id'), table_name='generation_result')
+    op.drop_index('ix_generation_request_published_created_id', table_name='generation_request')
+    op.drop_index('ix_generation_request_created_id', table_name='generation_request')
@@ -24,7 +24,11 @@ def create_app():
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"pool_pre_ping": True}
 
     # CORS
-    CORS(app, resources={r"/*": {"origins": "*"}})
+    CORS(
+        app,
+        resources={r"/*": {"origins": "*"}},
+        expose_headers=['X-Next-Cursor']
+    )
 
     # spin everything up
     api.init_app(app)
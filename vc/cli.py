@@ -13,6 +13,14 @@ class CommandLoader:
         'rife': command.RifeCommand,
         'rife_steps': command.RifeStepsCommand,
         'video': command.VideoCommand,
+        'bilateral_benchmark': command.BilateralBenchmarkCommand,
+        'video_benchmark': command.VideoBenchmarkCommand,
+        'vqgan_clip_amp_check': command.VqganClipAmpCheckCommand,
+        'onnx_export': command.OnnxExportCommand,
+        'quantize': command.QuantizeCommand,
+        'depth': command.DepthCommand,
+        'mesh_benchmark': command.MeshBenchmarkCommand,
+        'cutouts_benchmark': command.CutoutsBenchmarkCommand,
     }
 
     @classmethod
@@ -5,3 +5,11 @@ from .esrgan import EsrganCommand
 from .rife import RifeCommand
 from .rife_steps import RifeStepsCommand
 from .video import VideoCommand
+from .bilateral_benchmark import BilateralBenchmarkCommand
+from .video_benchmark import VideoBenchmarkCommand
+from .vqgan_clip_amp_check import VqganClipAmpCheckCommand
+from .onnx_export import OnnxExportCommand
+from .quantize import QuantizeCommand
+from .depth import DepthCommand
+from .mesh_benchmark import MeshBenchmarkCommand
+from .cutouts_benchmark import CutoutsBenchmarkCommand
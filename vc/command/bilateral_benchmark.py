@@ -0,0 +1,88 @@
+from time import time
+
+import numpy as np
+
+from vc.command.base import BaseCommand
+from vc.service.helper.inpainting.bilateral_filtering import (
+    bilateral_filter,
+    bilateral_filter_loop,
+    vis_depth_discontinuity,
+)
+from vc.service.inpainting import InpaintingOptions
+
+
+class BilateralBenchmarkCommand(BaseCommand):
+    description = 'Compares the batched bilateral filter against the per-pixel loop'
+    args = [
+        {
+            'dest': 'backend',
+            'type': str,
+            'help': 'numpy or torch',
+            'default': 'numpy',
+            'nargs': '?',
+        },
+        {
+            'dest': 'sizes',
+            'type': int,
+            'help': 'Square depth map sizes to benchmark',
+            'default': [400, 800],
+            'nargs': '*',
+        },
+    ]
+
+    def handle(self, args):
+        options = InpaintingOptions()
+        for size in args.sizes:
+            depth = self.make_depth(size)
+            discontinuity_map = (
+                sum(vis_depth_discontinuity(depth, options))
+            ).clip(0.0, 1.0)
+
+            start = time()
+            expected = bilateral_filter_loop(
+                depth,
+                options,
+                discontinuity_map=discontinuity_map,
+                window_size=options.filter_size[0]
+            )
+            loop_time = time() - start
+
+            start = time()
+            actual = bilateral_filter(
+                depth,
+                options,
+                discontinuity_map=discontinuity_map,
+                window_size=options.filter_size[0],
+                backend=args.backend
+            )
+            batched_time = time() - start
+
+            if args.backend == 'torch':
+                same = np.allclose(expected, actual)
+            else:
+                same = np.array_equal(expected, actual)
+
+            print('%sx%s: loop %.2fs, batched (%s) %.2fs, %.1fx faster, %s' % (
+                size,
+                size,
+                loop_time,
+                args.backend,
+                batched_time,
+                loop_time / max(batched_time, 1e-9),
+                'identical' if same else 'MISMATCH (max diff %g)' % (
+                    np.abs(expected - actual).max()
+                )
+            ))
+
+    def make_depth(self, size):
+        # smooth background with a few nearer rectangles to create the depth
+        # discontinuities the filter actually has to work on
+        rng = np.random.default_rng(0)
+        ax = np.linspace(0, 1, size)
+        xx, yy = np.meshgrid(ax, ax)
+        depth = 10. + 5. * xx + 2. * yy
+        for _ in range(8):
+            y, x = rng.integers(0, size - size // 4, 2)
+            h, w = rng.integers(size // 16, size // 4, 2)
+            depth[y:y + h, x:x + w] = rng.uniform(1., 5.)
+        return depth + rng.normal(0, 0.01, depth.shape)
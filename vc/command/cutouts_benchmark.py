@@ -0,0 +1,120 @@
+import sys
+from time import time
+
+import torch
+from torch.nn import functional as F
+
+from vc.command.base import BaseCommand
+from vc.service.helper.clip import ClipHelper
+from vc.service.helper.dimensions import DimensionsHelper
+from vc.service.vqgan_clip import VqganClipOptions
+
+
+class CutoutsBenchmarkCommand(BaseCommand):
+    description = 'Compares pooling CLIP cutouts in one roi_align against one at a time'
+    args = [
+        {
+            'dest': 'width',
+            'type': int,
+            'help': 'Image width',
+            'default': DimensionsHelper.width_small(),
+            'nargs': '?',
+        },
+        {
+            'dest': 'height',
+            'type': int,
+            'help': 'Image height',
+            'default': DimensionsHelper.height_small(),
+            'nargs': '?',
+        },
+        {
+            'dest': 'cutn',
+            'type': int,
+            'help': 'Cutouts per image',
+            'default': VqganClipOptions.cutn,
+            'nargs': '?',
+        },
+        {
+            'dest': 'batch_size',
+            'type': int,
+            'help': 'Images optimised together',
+            'default': 1,
+            'nargs': '?',
+        },
+        {
+            'dest': 'repeats',
+            'type': int,
+            'help': 'Iterations to time, each way',
+            'default': 20,
+            'nargs': '?',
+        },
+    ]
+    CUT_SIZE = 224
+
+    def handle(self, args):
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        torch.manual_seed(0)
+        make_cutouts = ClipHelper().make_cutouts([[]], self.CUT_SIZE, args.cutn)
+
+        image = torch.rand(args.batch_size, 3, args.height, args.width, device=device)
+        max_size = min(args.width, args.height)
+        paddingx = min(round(args.width * ClipHelper.padding), args.width)
+        paddingy = min(round(args.height * ClipHelper.padding), args.height)
+        sizes, offsetsx, offsetsy = make_cutouts.sample(
+            args.width,
+            args.height,
+            max_size,
+            paddingx,
+            paddingy,
+            device
+        )
+        yfrom, xfrom = offsetsy + paddingy, offsetsx + paddingx
+
+        def iteration(extract):
+            # as ascend_txt: pad, pool, and backpropagate a loss on the cutouts
+            input = image.clone().requires_grad_()
+            padded = F.pad(input, (paddingx, paddingx, paddingy, paddingy))
+            cutouts = extract(padded)
+            cutouts.square().mean().backward()
+            return cutouts.detach(), input.grad
+
+        results = {}
+        for name, extract in [
+            ('loop', lambda padded: make_cutouts.extract_loop(
+                padded, yfrom, xfrom, sizes
+            )),
+            ('roi_align', lambda padded: make_cutouts.extract(
+                padded, yfrom, xfrom, sizes, max_size
+            )),
+        ]:
+            iteration(extract)
+            self.synchronize(device)
+            start = time()
+            for _ in range(args.repeats):
+                iteration(extract)
+            self.synchronize(device)
+            results[name] = (time() - start) / args.repeats, iteration(extract)
+            print('%s: %.2fms/iteration' % (name, results[name][0] * 1000))
+
+        loop_time, (expected, expected_grad) = results['loop']
+        batched_time, (actual, actual_grad) = results['roi_align']
+        print('roi_align, %s cutouts of %sx%s on %s: %.1fx faster' % (
+            args.cutn * args.batch_size,
+            args.width,
+            args.height,
+            device,
+            loop_time / max(batched_time, 1e-9)
+        ))
+        print('cutouts differ by mean %.2e, max %.2e; gradients by max %.2e' % (
+            (expected - actual).abs().mean().item(),
+            (expected - actual).abs().max().item(),
+            (expected_grad - actual_grad).abs().max().item()
+        ))
+
+        if batched_time >= loop_time:
+            print('FAIL: roi_align is not faster than the loop')
+            sys.exit(1)
+
+    def synchronize(self, device):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
@@ -0,0 +1,89 @@
+import os
+from time import time
+
+from injector import inject
+
+from vc.command.base import BaseCommand
+from vc.service.helper.depth_cache import DepthCache
+from vc.service.helper.frame import Frame
+from vc.service.inpainting import InpaintingService, InpaintingOptions
+
+
+class DepthCommand(BaseCommand):
+    description = 'Estimates MiDaS depth for a dir of frames in batches, filling the depth cache'
+    args = [
+        {
+            'dest': 'frames_dir',
+            'type': str,
+            'help': 'Dir of frames to estimate depth for',
+            'default': 'steps',
+            'nargs': '?',
+        },
+        {
+            'dest': 'output_dir',
+            'type': str,
+            'help': 'Dir to also write .pfm and .png depth maps to',
+            'default': None,
+            'nargs': '?',
+        },
+        {
+            'dest': 'midas_model_type',
+            'type': str,
+            'help': 'MiDaS model type',
+            'default': InpaintingOptions.midas_model_type,
+            'nargs': '?',
+        },
+        {
+            'dest': 'batch_size',
+            'type': int,
+            'help': 'Frames per forward pass, DEPTH_BATCH_SIZE if not given',
+            'default': None,
+            'nargs': '?',
+        },
+    ]
+
+    inpainting: InpaintingService
+
+    @inject
+    def __init__(self, inpainting: InpaintingService):
+        self.inpainting = inpainting
+
+    def handle(self, args):
+        if DepthCache.backing() != 'disk':
+            print('DEPTH_CACHE is not disk, depth maps will not outlive this run')
+
+        paths = [
+            os.path.join(args.frames_dir, filename)
+            for filename in sorted(os.listdir(args.frames_dir))
+            if filename.endswith('.png')
+        ]
+        estimator = self.inpainting.depth_estimator(
+            InpaintingOptions(midas_model_type=args.midas_model_type),
+            batch_size=args.batch_size
+        )
+
+        start = time()
+        for chunk in range(0, len(paths), estimator.batch_size):
+            batch = paths[chunk:chunk + estimator.batch_size]
+            # as inpainting reads them, so the cache keys match
+            images = [Frame.load(path).rgb() for path in batch]
+            depths = estimator.estimate(images)
+            if args.output_dir:
+                for path, depth in zip(batch, depths):
+                    estimator.save(
+                        os.path.join(
+                            args.output_dir,
+                            os.path.splitext(os.path.basename(path))[0]
+                        ),
+                        depth
+                    )
+            print('%s/%s' % (chunk + len(batch), len(paths)))
+
+        elapsed = time() - start
+        print('%s frames in %.1fs (%.2f frames/s), cache hits %s misses %s' % (
+            len(paths),
+            elapsed,
+            len(paths) / elapsed if elapsed else 0,
+            DepthCache.hits,
+            DepthCache.misses
+        ))
@@ -0,0 +1,188 @@
+import copy
+import tracemalloc
+from time import time
+
+import numpy as np
+from injector import inject
+
+from vc.command.base import BaseCommand
+from vc.service.helper.frame import Frame
+from vc.service.helper.inpainting.bilateral_filtering import \
+    sparse_bilateral_filtering
+from vc.service.helper.inpainting.mesh import (
+    calculate_fov,
+    create_mesh,
+    generate_init_node,
+    group_edges,
+    reassign_floating_island,
+    remove_dangling,
+    tear_edges,
+    update_status,
+)
+from vc.service.helper.utils import get_midas_sample
+from vc.service.inpainting import InpaintingService, InpaintingOptions
+
+
+class MeshBenchmarkCommand(BaseCommand):
+    description = 'Compares settling the single layer 3D photo mesh on the LDI arrays against the graph'
+    args = [
+        {
+            'dest': 'input_file',
+            'type': str,
+            'help': 'Frame to build the mesh of',
+            'default': 'output.png',
+            'nargs': '?',
+        },
+        {
+            'dest': 'repeats',
+            'type': int,
+            'help': 'Builds to time, each way',
+            'default': 3,
+            'nargs': '?',
+        },
+    ]
+    MIN_NODE_IN_CC = 200
+
+    inpainting: InpaintingService
+
+    @inject
+    def __init__(self, inpainting: InpaintingService):
+        self.inpainting = inpainting
+
+    def handle(self, args):
+        options = InpaintingOptions(
+            input_file=args.input_file,
+            input_frame=Frame.load(args.input_file),
+            save_output=False,
+        )
+        image = options.input_frame.rgb()
+        disp = self.inpainting.depth_estimator(options).estimate([image])[0]
+        image, depth = self.inpainting.mesh_inputs(options, image, disp)
+        depth = sparse_bilateral_filtering(
+            depth,
+            image,
+            options,
+            num_iter=options.sparse_iter
+        )[1][-1]
+        int_mtx = get_midas_sample(options)['int_mtx']
+
+        # both ways start from the torn single layer LDI write_ply builds
+        LDI, padded_image, padded_depth = create_mesh(
+            depth.astype(np.float64),
+            image,
+            int_mtx,
+            options
+        )
+        LDI = tear_edges(LDI, options.depth_threshold)
+
+        def graph():
+            # the stages write_ply ran on the graph before fill_missing_node
+            ldi = copy.deepcopy(LDI)
+            ldi.remove_small_components(self.MIN_NODE_IN_CC)
+            mesh = calculate_fov(ldi.to_graph())
+            info_on_pix = ldi.info_on_pix()
+            depth = padded_depth.copy()
+            group_edges(mesh, options, padded_image, remove_conflict_ordinal=False)
+            mesh, info_on_pix, depth = reassign_floating_island(
+                mesh,
+                info_on_pix,
+                padded_image,
+                depth
+            )
+            mesh = update_status(mesh, info_on_pix)
+            edge_ccs, mesh, edge_mesh = group_edges(
+                mesh,
+                options,
+                padded_image,
+                remove_conflict_ordinal=True
+            )
+            mesh, info_on_pix, edge_mesh, depth, _ = remove_dangling(
+                mesh,
+                edge_ccs,
+                edge_mesh,
+                info_on_pix,
+                depth
+            )
+            mesh, depth, info_on_pix = update_status(mesh, info_on_pix, depth)
+            edge_ccs, mesh, _ = group_edges(
+                mesh,
+                options,
+                padded_image,
+                remove_conflict_ordinal=True
+            )
+            return mesh, info_on_pix, depth, edge_ccs
+
+        def arrays():
+            return generate_init_node(
+                copy.deepcopy(LDI),
+                options,
+                padded_depth.copy(),
+                self.MIN_NODE_IN_CC
+            )
+
+        kept = copy.deepcopy(LDI).remove_small_components(self.MIN_NODE_IN_CC)
+        print('%s: %sx%s, %s pixels dropped as small islands' % (
+            args.input_file,
+            LDI.noext_W,
+            LDI.noext_H,
+            int((~kept.valid).sum())
+        ))
+        expected, graph_time, graph_peak = self.measure(graph, args.repeats)
+        actual, arrays_time, arrays_peak = self.measure(arrays, args.repeats)
+        for name, elapsed, peak in [
+            ('graph', graph_time, graph_peak),
+            ('arrays', arrays_time, arrays_peak),
+        ]:
+            print('%s: %.2fs, peak %.1f MiB' % (name, elapsed, peak / 2 ** 20))
+        print('arrays: %.1fx faster, %.1f%% of the peak memory' % (
+            graph_time / max(arrays_time, 1e-9),
+            100 * arrays_peak / max(graph_peak, 1)
+        ))
+
+        mismatches = self.compare(expected, actual)
+        print('identical' if not mismatches else 'MISMATCH: %s' % ', '.join(mismatches))
+
+    def measure(self, build, repeats):
+        start = time()
+        for _ in range(repeats):
+            build()
+        elapsed = (time() - start) / repeats
+
+        # traced separately, as tracing slows allocation down
+        tracemalloc.start()
+        result = build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    def compare(self, expected, actual):
+        (expected_mesh, expected_info, expected_depth, expected_ccs) = expected
+        (actual_mesh, actual_info, actual_depth, actual_ccs) = actual
+        mismatches = []
+        if list(expected_mesh.nodes) != list(actual_mesh.nodes):
+            mismatches.append('nodes')
+        elif any(
+            list(expected_mesh.adj[node]) != list(actual_mesh.adj[node])
+            for node in expected_mesh.nodes
+        ):
+            mismatches.append('neighbours')
+        for feat in ('near', 'far', 'disp', 'edge_id'):
+            if any(
+                (feat in expected_mesh.nodes[node], expected_mesh.nodes[node].get(feat))
+                != (feat in actual_mesh.nodes[node], actual_mesh.nodes[node].get(feat))
+                for node in expected_mesh.nodes
+                if node in actual_mesh.nodes
+            ):
+                mismatches.append(feat)
+        if list(expected_info) != list(actual_info) or any(
+            expected_info[key][0][feat] != actual_info[key][0][feat]
+            for key in expected_info
+            if key in actual_info
+            for feat in ('depth', 'disp')
+        ):
+            mismatches.append('info_on_pix')
+        if not np.array_equal(expected_depth, actual_depth):
+            mismatches.append('depth')
+        if expected_ccs != actual_ccs:
+            mismatches.append('edge_ccs')
+        return mismatches
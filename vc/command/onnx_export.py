@@ -0,0 +1,130 @@
+import sys
+
+import numpy as np
+import torch
+from injector import inject
+
+from vc.command.base import BaseCommand
+from vc.service.esrgan import EsrganService, EsrganOptions
+from vc.service.helper.dimensions import DimensionsHelper
+from vc.service.helper.midas import load_depth_model
+from vc.service.helper.onnx_backend import OnnxBackend
+from vc.service.inpainting import InpaintingService, InpaintingOptions
+from vc.service.rife import RifeService, RifeOptions, RifeInference
+
+
+class OnnxExportCommand(BaseCommand):
+    description = 'Exports MiDaS, ESRGAN and RIFE to ONNX and checks them against PyTorch'
+    args = [
+        {
+            'dest': 'models',
+            'type': str,
+            'help': 'Comma separated models to export',
+            'default': 'midas,esrgan,rife',
+            'nargs': '?',
+        },
+        {
+            'dest': 'width',
+            'type': int,
+            'help': 'Frame width to trace at',
+            'default': DimensionsHelper.width_small(),
+            'nargs': '?',
+        },
+        {
+            'dest': 'height',
+            'type': int,
+            'help': 'Frame height to trace at',
+            'default': DimensionsHelper.height_small(),
+            'nargs': '?',
+        },
+        {
+            'dest': 'midas_model_type',
+            'type': str,
+            'help': 'MiDaS model type',
+            'default': InpaintingOptions.midas_model_type,
+            'nargs': '?',
+        },
+        {
+            'dest': 'tolerance',
+            'type': float,
+            'help': 'Largest acceptable absolute difference from PyTorch',
+            'default': 1e-3,
+            'nargs': '?',
+        },
+    ]
+
+    esrgan: EsrganService
+    rife: RifeService
+
+    @inject
+    def __init__(self, esrgan: EsrganService, rife: RifeService):
+        self.esrgan = esrgan
+        self.rife = rife
+
+    def handle(self, args):
+        # fixed inputs, so checks are comparable between exports
+        torch.manual_seed(0)
+        np.random.seed(0)
+
+        failed = []
+        for model in args.models.split(','):
+            name, module, inputs, diff = getattr(self, 'export_%s' % model)(args)
+            ok = diff <= args.tolerance
+            print('%s: wrote %s, max abs diff %.2e (tolerance %.0e) %s' % (
+                model,
+                OnnxBackend.path(name),
+                diff,
+                args.tolerance,
+                'OK' if ok else 'FAIL'
+            ))
+            if not ok:
+                failed.append(model)
+
+        if failed:
+            print('FAIL: %s outside tolerance' % ', '.join(failed))
+            sys.exit(1)
+
+    def export_midas(self, args):
+        model_type = args.midas_model_type
+        model, transform = load_depth_model(
+            InpaintingService.model_paths[model_type],
+            model_type,
+            optimize=False
+        )
+        image = np.random.rand(args.height, args.width, 3)
+        sample = torch.from_numpy(transform({'image': image})['image'])
+        inputs = (sample.unsqueeze(0).to(next(model.parameters()).device),)
+
+        name = 'midas_%s' % model_type
+        # DPT resizes its position embedding with shapes fixed while tracing
+        dynamic_size = not model_type.startswith('dpt')
+        OnnxBackend.export(model, inputs, name, dynamic_size=dynamic_size)
+        return name, model, inputs, OnnxBackend.compare(model, name, inputs)
+
+    def export_esrgan(self, args):
+        options = EsrganOptions(precision='fp32', backend='torch')
+        model = self.esrgan.load_upsampler(options).model
+        inputs = (torch.rand(1, 3, args.height, args.width).to(next(model.parameters()).device),)
+
+        name = self.esrgan.onnx_name(options)
+        OnnxBackend.export(model, inputs, name)
+        return name, model, inputs, OnnxBackend.compare(model, name, inputs)
+
+    def export_rife(self, args):
+        model = RifeInference(self.rife.load_model(RifeOptions.model_dir).flownet)
+        device = next(model.parameters()).device
+
+        def pairs(batch, width, height):
+            frames = torch.rand(2 * batch, 3, height, width)
+            return tuple(self.rife.pad(frames).to(device).chunk(2))
+
+        # warp builds its sampling grid from the traced shape, so the graph
+        # takes batches of any size, such as ESRGAN upscaled frames; check
+        # it at a second shape to be sure none was baked in
+        name = 'rife'
+        inputs = pairs(1, args.width, args.height)
+        OnnxBackend.export(model, inputs, name)
+        return name, model, inputs, max(
+            OnnxBackend.compare(model, name, inputs),
+            OnnxBackend.compare(model, name, pairs(2, args.width * 2, args.height * 2))
+        )
@@ -0,0 +1,184 @@
+import os
+import sys
+from time import time
+
+import numpy as np
+import torch
+from injector import inject
+from torch.nn import functional as F
+
+from CLIP import clip
+from vc.command.base import BaseCommand
+from vc.service.helper.clip import TextEncoder
+from vc.service.helper.frame import Frame
+from vc.service.helper.model_registry import ModelRegistry
+from vc.service.helper.quantization import Quantizer
+from vc.service.inpainting import InpaintingService, InpaintingOptions
+from vc.service.vqgan_clip import VqganClipService, VqganClipOptions
+
+
+class QuantizeCommand(BaseCommand):
+    description = 'Quantises the CLIP text encoder and inpainting networks to int8 and reports accuracy and CPU speed'
+    args = [
+        {
+            'dest': 'frames_dir',
+            'type': str,
+            'help': 'Dir of frames to calibrate and compare inpainting on',
+            'default': 'steps',
+            'nargs': '?',
+        },
+        {
+            'dest': 'frames',
+            'type': int,
+            'help': 'Number of frames to use',
+            'default': 8,
+            'nargs': '?',
+        },
+        {
+            'dest': 'prompts',
+            'type': str,
+            'help': 'Prompts to compare text embeddings on, separated by |',
+            'default': 'a lighthouse on a cliff at dusk|a city street in the rain|'
+                       'an oil painting of a forest|high resolution|unreal engine',
+            'nargs': '?',
+        },
+        {
+            'dest': 'z_shift',
+            'type': float,
+            'help': 'Camera move to inpaint with',
+            'default': 0.05,
+            'nargs': '?',
+        },
+        {
+            'dest': 'repeats',
+            'type': int,
+            'help': 'Text encodes to time',
+            'default': 20,
+            'nargs': '?',
+        },
+    ]
+
+    vqgan_clip: VqganClipService
+    inpainting: InpaintingService
+
+    @inject
+    def __init__(self, vqgan_clip: VqganClipService, inpainting: InpaintingService):
+        self.vqgan_clip = vqgan_clip
+        self.inpainting = inpainting
+
+    def handle(self, args):
+        if torch.cuda.is_available():
+            print('int8 networks only run on CPU, run this with CUDA_VISIBLE_DEVICES=')
+            sys.exit(1)
+
+        self.text_encoder(args)
+        self.inpainting_networks(args)
+
+    def text_encoder(self, args):
+        clip_model = VqganClipOptions.clip_model
+        perceptor = self.vqgan_clip.load_clip(clip_model)
+        fp32 = TextEncoder(perceptor).float().eval()
+        int8 = self.vqgan_clip.load_quantized_text_encoder(perceptor, clip_model)
+        print('text encoder: wrote %s' % self.vqgan_clip.quantized_text_encoder_path(clip_model))
+
+        tokens = clip.tokenize(args.prompts.split('|'))
+        with torch.no_grad():
+            similarity = F.cosine_similarity(fp32(tokens), int8(tokens))
+            fp32_time = self.measure(lambda: fp32(tokens), args.repeats)
+            int8_time = self.measure(lambda: int8(tokens), args.repeats)
+        print('text encoder: cosine similarity min %.4f mean %.4f' % (
+            similarity.min().item(),
+            similarity.mean().item()
+        ))
+        print('text encoder: %.1f -> %.1f prompts/s (%.2fx)' % (
+            len(tokens) / fp32_time,
+            len(tokens) / int8_time,
+            fp32_time / int8_time
+        ))
+
+    def inpainting_networks(self, args):
+        paths = [
+            os.path.join(args.frames_dir, filename)
+            for filename in sorted(os.listdir(args.frames_dir))
+            if filename.endswith('.png')
+        ][:args.frames]
+
+        fp32_frames, fp32_time = self.inpaint(paths, args, quantize=False)
+
+        # record activation ranges on the same frames, then quantise
+        device = torch.device('cpu')
+        options = InpaintingOptions()
+        models = self.inpainting.load_models(options, device)
+        self.inpainting.calibration_models = tuple(
+            Quantizer.prepare_convs(model) for model in models
+        )
+        try:
+            self.inpaint(paths, args, quantize=False)
+            calibrated = self.inpainting.calibration_models
+        finally:
+            self.inpainting.calibration_models = None
+
+        for (key, checkpoint), model in zip(
+            self.inpainting.checkpoints(options),
+            calibrated
+        ):
+            path = Quantizer.path(checkpoint)
+            Quantizer.save(Quantizer.convert(model), path)
+            ModelRegistry.evict(ModelRegistry.key('%s_int8' % key, checkpoint, device))
+            print('inpainting: wrote %s' % path)
+
+        int8_frames, int8_time = self.inpaint(paths, args, quantize=True)
+
+        for path, fp32, int8 in zip(paths, fp32_frames, int8_frames):
+            if fp32 is None or int8 is None:
+                continue
+            frame_psnr, changed_psnr, changed = self.psnr(fp32.rgb(), int8.rgb())
+            print('inpainting: %s psnr %.2f dB, %.2f dB over the %.1f%% pixels int8 changed' % (
+                path,
+                frame_psnr,
+                changed_psnr,
+                changed * 100
+            ))
+        print('inpainting: %.2f -> %.2f s/frame (%.2fx)' % (
+            fp32_time / len(paths),
+            int8_time / len(paths),
+            fp32_time / int8_time
+        ))
+
+    def inpaint(self, paths, args, quantize):
+        frames = []
+        start = time()
+        for path in paths:
+            frames.append(self.inpainting.handle(InpaintingOptions(
+                input_file=path,
+                input_frame=Frame.load(path),
+                z_shift=args.z_shift,
+                save_output=False,
+                quantize=quantize,
+            )))
+        return frames, time() - start
+
+    def psnr(self, expected: np.ndarray, actual: np.ndarray):
+        """Over the whole frame, and over only the pixels that differ.
+
+        Known pixels render the same either way, so the differing ones are
+        where the int8 networks inpainted differently.
+        """
+        error = (expected.astype(np.float64) - actual.astype(np.float64)) ** 2
+        changed = error.max(axis=-1) > 0
+
+        def psnr(mse):
+            return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+        return (
+            psnr(error.mean()),
+            psnr(error[changed].mean() if changed.any() else 0),
+            changed.mean()
+        )
+
+    def measure(self, run, repeats):
+        run()
+        start = time()
+        for _ in range(repeats):
+            run()
+        return (time() - start) / repeats
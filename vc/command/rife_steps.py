@@ -1,6 +1,3 @@
-from os import listdir
-from os.path import isfile, join, splitext
-from shutil import copyfile
 from injector import inject
 
 from vc.command.base import BaseCommand
@@ -24,7 +21,14 @@ class RifeStepsCommand(BaseCommand):
             'help': 'Usteps dir',
             'default': 'usteps',
             'nargs': '?',
-        }
+        },
+        {
+            'dest': 'batch_size',
+            'type': int,
+            'help': 'Frame pairs per forward pass, RIFE_BATCH_SIZE if not given',
+            'default': None,
+            'nargs': '?',
+        },
     ]
 
     rife: RifeService
@@ -36,35 +40,15 @@ class RifeStepsCommand(BaseCommand):
         self.video = video
 
     def handle(self, args):
-        input_files = [
-            f
-            for f
-            in sorted(listdir(args.steps_dir))
-            if isfile(join(args.steps_dir, f))
-        ]
-
-        for file in input_files:
-            num, ext = splitext(file)
-            outnum = int(num) * 2 - 1
-            outfile = join(args.usteps_dir, f'{outnum:04}.png')
-            infile = join(args.steps_dir, file)
-            print('copying', infile, outfile)
-            copyfile(infile, outfile)
-
-            if int(num) > 1:
-                last_outnum = outnum - 2
-                new_outnum = outnum - 1
-                first_file = join(args.usteps_dir, f'{last_outnum:04}.png')
-                second_file = outfile
-                output_file = lambda i: join(args.usteps_dir, f'{i:04}.png'),
-                print('running rife', first_file, second_file, output_file)
-                self.rife.handle(
-                    RifeOptions(
-                        first_file=first_file,
-                        second_file=second_file,
-                        output_file=output_file
-                    )
-                )
+        options = RifeOptions(exp=1)
+        if args.batch_size:
+            options.batch_size = args.batch_size
+        written = self.rife.handle_dir(
+            args.steps_dir,
+            args.usteps_dir,
+            options
+        )
+        print('wrote', written, 'frames to', args.usteps_dir)
 
         self.video.make_unwatermarked_video(
             'debug.mp4',
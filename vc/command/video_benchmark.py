@@ -0,0 +1,129 @@
+import os
+import resource
+import shutil
+import sys
+from time import time
+
+import cv2
+import numpy as np
+from injector import inject
+
+from vc.command.base import BaseCommand
+from vc.service import VideoService
+
+
+class VideoBenchmarkCommand(BaseCommand):
+    description = 'Compares the single-pass encode against two ffmpeg passes'
+    args = [
+        {
+            'dest': 'width',
+            'type': int,
+            'help': 'Frame width, must have a matching watermark asset',
+            'default': 400,
+            'nargs': '?',
+        },
+        {
+            'dest': 'frames',
+            'type': int,
+            'help': 'Number of frames to encode',
+            'default': 250,
+            'nargs': '?',
+        },
+        {
+            'dest': 'steps_dir',
+            'type': str,
+            'help': 'Existing steps dir to encode instead of generated frames',
+            'default': None,
+            'nargs': '?',
+        },
+    ]
+    BENCHMARK_DIR = 'video-benchmark'
+
+    video: VideoService
+
+    @inject
+    def __init__(self, video: VideoService):
+        self.video = video
+
+    def handle(self, args):
+        os.makedirs(self.BENCHMARK_DIR, exist_ok=True)
+        steps_dir = args.steps_dir
+        if steps_dir is None:
+            steps_dir = os.path.join(self.BENCHMARK_DIR, 'steps')
+            self.make_frames(steps_dir, args.width, args.frames)
+
+        print('encoder: %s' % (
+            'h264_nvenc' if self.video.has_nvenc() else 'libx264'
+        ))
+
+        two_pass = self.measure(lambda: (
+            self.video.encode_unwatermarked(
+                self.output('two-pass'),
+                steps_dir
+            ),
+            self.video.encode_watermarked(
+                self.output('two-pass-watermarked'),
+                steps_dir,
+                args.width
+            ),
+        ))
+        single_pass = self.measure(lambda: self.video.encode_videos(
+            self.output('single-pass'),
+            self.output('single-pass-watermarked'),
+            steps_dir,
+            args.width
+        ))
+
+        for name, (wall, cpu) in [
+            ('two passes', two_pass),
+            ('single pass', single_pass),
+        ]:
+            print('%s: wall %.2fs, cpu %.2fs' % (name, wall, cpu))
+        print('single pass: %.1f%% wall, %.1f%% cpu of two passes' % (
+            100 * single_pass[0] / max(two_pass[0], 1e-9),
+            100 * single_pass[1] / max(two_pass[1], 1e-9),
+        ))
+        print('single pass: %.2fx faster wall, %.2fx less cpu' % (
+            two_pass[0] / max(single_pass[0], 1e-9),
+            two_pass[1] / max(single_pass[1], 1e-9),
+        ))
+
+        shutil.rmtree(self.BENCHMARK_DIR)
+
+        # decoding once and splitting the graph has to save both
+        regressed = [
+            metric
+            for metric, single, two in zip(('wall', 'cpu'), single_pass, two_pass)
+            if single >= two
+        ]
+        if regressed:
+            print('FAIL: the single pass is not lower in %s time than two passes' % (
+                ' or '.join(regressed)
+            ))
+            sys.exit(1)
+
+    def output(self, name):
+        return os.path.join(self.BENCHMARK_DIR, '%s.mp4' % name)
+
+    def measure(self, fn):
+        # ffmpeg runs as a child process, so its cpu time only shows up in the
+        # children's usage once it has been waited for
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time()
+        fn()
+        wall = time() - start
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (
+            (after.ru_utime - before.ru_utime)
+            + (after.ru_stime - before.ru_stime)
+        )
+        return wall, cpu
+
+    def make_frames(self, steps_dir, width, frames):
+        os.makedirs(steps_dir, exist_ok=True)
+        rng = np.random.default_rng(0)
+        height = width * 9 // 16 // 2 * 2
+        base = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for i in range(frames):
+            frame = np.roll(base, i * 2, axis=1)
+            cv2.imwrite(os.path.join(steps_dir, '%04d.png' % (i + 1)), frame)
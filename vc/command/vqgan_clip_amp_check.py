@@ -0,0 +1,97 @@
+import os
+import sys
+from time import time
+
+from injector import inject
+
+from vc.command.base import BaseCommand
+from vc.service.vqgan_clip import VqganClipService, VqganClipOptions
+
+
+class VqganClipAmpCheckCommand(BaseCommand):
+    description = 'Compares mixed precision vqgan_clip against fp32 on a fixed seed'
+    args = [
+        {
+            'dest': 'prompt',
+            'type': str,
+            'help': 'Text prompt',
+            'default': 'a lighthouse on a cliff at dusk',
+            'nargs': '?',
+        },
+        {
+            'dest': 'iterations',
+            'type': int,
+            'help': 'Iterations',
+            'default': 200,
+            'nargs': '?',
+        },
+        {
+            'dest': 'tolerance',
+            'type': float,
+            'help': 'Largest acceptable increase in CLIP distance over fp32',
+            'default': 0.02,
+            'nargs': '?',
+        },
+        {
+            'dest': 'amp_dtype',
+            'type': str,
+            'help': 'float16 or bfloat16 (defaults to the device default)',
+            'default': None,
+            'nargs': '?',
+        },
+        {
+            'dest': 'seed',
+            'type': int,
+            'help': 'Seed shared by both runs',
+            'default': 42,
+            'nargs': '?',
+        },
+    ]
+
+    vqgan_clip: VqganClipService
+
+    @inject
+    def __init__(self, vqgan_clip: VqganClipService):
+        self.vqgan_clip = vqgan_clip
+
+    def handle(self, args):
+        results = {}
+        for name, amp in [('fp32', False), ('amp', True)]:
+            output_file = 'amp-check-%s.png' % name
+            options = VqganClipOptions(
+                prompts=args.prompt,
+                max_iterations=args.iterations,
+                init_image=None,
+                output_filename=output_file,
+                seed=args.seed,
+                cudnn_determinism=True,
+                amp=amp,
+                amp_dtype=args.amp_dtype if amp else None,
+                channels_last=amp,
+            )
+            start = time()
+            self.vqgan_clip.handle(options)
+            loss = self.vqgan_clip.stats[0].loss
+            elapsed = time() - start
+            score = self.vqgan_clip.clip_score(output_file, args.prompt)
+            results[name] = loss, score, elapsed
+            os.remove(output_file)
+            print('%s: final loss %.4f, clip distance %.4f, %.2fs' % (
+                name,
+                loss,
+                score,
+                elapsed
+            ))
+
+        _, fp32_score, fp32_time = results['fp32']
+        _, amp_score, amp_time = results['amp']
+        delta = amp_score - fp32_score
+        print('clip distance delta %+.4f (tolerance %.4f), %.2fx faster' % (
+            delta,
+            args.tolerance,
+            fp32_time / max(amp_time, 1e-9)
+        ))
+        if delta > args.tolerance:
+            print('FAIL: amp quality is outside tolerance')
+            sys.exit(1)
+        print('OK')
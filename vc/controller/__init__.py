@@ -1,5 +1,6 @@
 from .generation_request import GenerationRequestController
 from .generation_request import GenerationRequestsController
+from .generation_request import GenerationRequestStreamController
 
 
 def init_app(app):
@@ -1,13 +1,18 @@
-from flask import request
+import json
+from time import time
+
+from flask import Response, request, stream_with_context
 from flask_restplus import fields
 from injector import inject
 from werkzeug.exceptions import NotFound, InternalServerError, BadRequest
 
 from vc.api import api
 from vc.auth import auth
-from vc.exception import NotFoundException, VcException
+from vc.db import db
+from vc.exception import NotFoundException, VcException, InvalidCursorException
 from vc.manager import GenerationRequestManager, UserManager
 from vc.model.generation_request import GenerationRequest
+from vc.service.progress import ProgressService
 from vc.value_object.generation_spec import GenerationSpec
 from .base import BaseController
 
@@ -17,6 +22,7 @@ ns = api.namespace(
 )
 
 private_model = GenerationRequest.private_schema
+private_list_model = GenerationRequest.private_list_schema
 public_model = GenerationRequest.public_schema
 post_model = ns.model('Generation Request', {
     'spec': fields.Nested(GenerationSpec.schema),
@@ -26,23 +32,39 @@ post_model = ns.model('Generation Request', {
 @ns.route('/')
 class GenerationRequestsController(BaseController):
     manager: GenerationRequestManager
+    progress: ProgressService
 
     @inject
     def __init__(
         self,
         user_manager: UserManager,
         manager: GenerationRequestManager,
+        progress: ProgressService,
         *args,
         **kwargs
     ):
         super().__init__(user_manager, *args, **kwargs)
         self.manager = manager
+        self.progress = progress
 
     @auth.login_required(optional=True)
+    @ns.param('cursor', 'X-Next-Cursor of the previous page')
+    @ns.param('limit', 'Page size', type=int)
     def get(self):
-        if auth.current_user():
-            return ns.marshal(self.manager.all(), private_model)
-        return ns.marshal(self.manager.published(), public_model)
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+        try:
+            if auth.current_user():
+                models, next_cursor = self.manager.page_all(cursor, limit)
+                data = ns.marshal(models, private_list_model)
+            else:
+                models, next_cursor = self.manager.page_published(cursor, limit)
+                data = ns.marshal(models, public_model)
+        except InvalidCursorException as e:
+            raise BadRequest(e.message)
+
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return self.progress.apply_many(data), 200, headers
 
     @auth.login_required()
     @ns.marshal_with(private_model)
@@ -50,25 +72,113 @@ class GenerationRequestsController(BaseController):
     def post(self):
         try:
             user = auth.current_user()
-            return self.manager.create(request.json, user)
+            model = self.manager.create(request.json, user)
+            self.progress.publish_status(model.id, 'created')
+            return model
         except VcException as e:
             raise InternalServerError(e.message)
 
 
+@ns.route('/stream')
+class GenerationRequestStreamController(BaseController):
+    # streams are closed now and then so that EventSource reconnects, which
+    # frees the server thread. Anonymous streams see the requests published
+    # when they opened, kept up to date by the publish and unpublish (and
+    # delete) status events rather than the database, so a stream only
+    # holds a Redis connection
+    HEARTBEAT_SECONDS = 15
+    MAX_SECONDS = 300
+    RETRY_MILLISECONDS = 3000
+
+    manager: GenerationRequestManager
+    progress: ProgressService
+
+    @inject
+    def __init__(
+        self,
+        user_manager: UserManager,
+        manager: GenerationRequestManager,
+        progress: ProgressService,
+        *args,
+        **kwargs
+    ):
+        super().__init__(user_manager, *args, **kwargs)
+        self.manager = manager
+        self.progress = progress
+
+    def get(self):
+        # EventSource can't send headers, so the token comes in the query
+        user = self.user_manager.authenticate(request.args.get('token'))
+        if user:
+            visible = None
+            fields = set(private_model.keys())
+        else:
+            visible = set(
+                id_ for id_, in self.manager.published_query().with_entities(
+                    GenerationRequest.id
+                )
+            )
+            fields = set(public_model.keys())
+        # stream_with_context keeps the request context alive for the whole
+        # stream, so hand the connection back to the pool now
+        db.session.remove()
+
+        return Response(
+            stream_with_context(self.stream(visible, fields)),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            }
+        )
+
+    def stream(self, visible, fields):
+        pubsub = self.progress.subscribe()
+        start = time()
+        try:
+            yield 'retry: %s\n\n' % self.RETRY_MILLISECONDS
+            while time() - start < self.MAX_SECONDS:
+                message = pubsub.get_message(timeout=self.HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ': heartbeat\n\n'
+                    continue
+
+                data = json.loads(message['data'])
+                if visible is not None:
+                    status = data.get('status')
+                    if status == 'publish':
+                        visible.add(data['id'])
+                    if data['id'] not in visible:
+                        continue
+                    if status in ('unpublish', 'delete'):
+                        # passed on below, so clients drop it
+                        visible.discard(data['id'])
+                yield 'data: %s\n\n' % json.dumps({
+                    key: value
+                    for key, value in data.items()
+                    if key in ('event', 'status') or key in fields
+                })
+        finally:
+            pubsub.close()
+
+
 @ns.route('/<int:id_>')
 class GenerationRequestController(BaseController):
     manager: GenerationRequestManager
+    progress: ProgressService
 
     @inject
     def __init__(
         self,
         user_manager: UserManager,
         manager: GenerationRequestManager,
+        progress: ProgressService,
         *args,
         **kwargs
     ):
         super().__init__(user_manager, *args, **kwargs)
         self.manager = manager
+        self.progress = progress
 
     @auth.login_required(optional=True)
     def get(self, id_):
@@ -78,8 +188,8 @@ class GenerationRequestController(BaseController):
             raise NotFound(e.message)
 
         if auth.current_user():
-            return ns.marshal(data, private_model)
-        return ns.marshal(data, public_model)
+            return self.progress.apply(ns.marshal(data, private_model))
+        return self.progress.apply(ns.marshal(data, public_model))
 
     @auth.login_required()
     def delete(self, id_):
@@ -97,32 +207,38 @@ class GenerationRequestController(BaseController):
 @ns.route('/<int:id_>/<string:action>')
 class GenerationRequestActionController(BaseController):
     manager: GenerationRequestManager
+    progress: ProgressService
 
     @inject
     def __init__(
         self,
         user_manager: UserManager,
         manager: GenerationRequestManager,
+        progress: ProgressService,
         *args,
         **kwargs
     ):
         super().__init__(user_manager, *args, **kwargs)
         self.manager = manager
+        self.progress = progress
 
     @auth.login_required()
     @ns.marshal_with(private_model)
     def put(self, id_, action: str):
         if action == 'cancel':
-            return self.cancel(id_)
-        if action == 'retry':
-            return self.retry(id_)
-        if action == 'delete':
-            return self.soft_delete(id_)
-        if action == 'publish':
-            return self.publish(id_)
-        if action == 'unpublish':
-            return self.unpublish(id_)
-        raise BadRequest('Unrecognised action: %s' % action)
+            model = self.cancel(id_)
+        elif action == 'retry':
+            model = self.retry(id_)
+        elif action == 'delete':
+            model = self.soft_delete(id_)
+        elif action == 'publish':
+            model = self.publish(id_)
+        elif action == 'unpublish':
+            model = self.unpublish(id_)
+        else:
+            raise BadRequest('Unrecognised action: %s' % action)
+        self.progress.publish_status(id_, action)
+        return model
 
     def cancel(self, id_):
         return self.manager.cancel(id_)
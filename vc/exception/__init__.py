@@ -2,3 +2,4 @@ from .not_found_exception import NotFoundException
 from .not_authenticated_exception import NotAuthenticatedException
 from .vc_exception import VcException
 from .third_party_exception import ThirdPartyException
+from .invalid_cursor_exception import InvalidCursorException
@@ -0,0 +1,8 @@
+from .vc_exception import VcException
+
+
+class InvalidCursorException(VcException):
+    code = 400
+
+    def __init__(self, cursor: str):
+        super().__init__("Invalid cursor: [%s]" % cursor)
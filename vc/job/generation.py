@@ -1,12 +1,16 @@
+import os
 from dacite import from_dict
 from datetime import datetime
+from time import time
 from injector import inject
 
 from vc.manager.generation_result import GenerationResultManager
 from vc.value_object import GenerationSpec
 from vc.manager.generation_request import GenerationRequestManager
 from vc.model.generation_request import GenerationRequest
+from vc.model.generation_result import GenerationResult
 from vc.service.generation import GenerationService
+from vc.service.progress import ProgressService
 from vc.job.base import Job
 from vc.value_object.generation_progress import GenerationProgress
 
@@ -15,22 +19,36 @@ class GenerationJob(Job):
     service: GenerationService
     request_manager: GenerationRequestManager
     result_manager: GenerationResultManager
+    progress: ProgressService
+
+    # progress goes to Redis every step but only to the database this often
+    flush_seconds: float
+    flush_steps: int
+
+    last_flushed: float = 0.
+    steps_unflushed: int = 0
 
     @inject
     def __init__(
         self,
         service: GenerationService,
         request_manager: GenerationRequestManager,
-        result_manager: GenerationResultManager
+        result_manager: GenerationResultManager,
+        progress: ProgressService
     ):
         self.service = service
         self.request_manager = request_manager
         self.result_manager = result_manager
+        self.progress = progress
+        self.flush_seconds = float(os.getenv('PROGRESS_FLUSH_SECONDS', 30))
+        self.flush_steps = int(os.getenv('PROGRESS_FLUSH_STEPS', 50))
 
     def handle(self, id_: int):
         generation_request = self.request_manager.find_or_throw(id_)
 
         self.mark_started(generation_request)
+        self.last_flushed = time()
+        self.steps_unflushed = 0
 
         spec = from_dict(
             data_class=GenerationSpec,
@@ -42,8 +60,23 @@ class GenerationJob(Job):
 
         steps_completed = generation_request.steps_completed or 0
         name = generation_request.name
+
+        # a worker that died between flushes left fresher progress in redis
+        buffered = self.progress.get(generation_request.id)
+        if buffered:
+            steps_completed = max(
+                steps_completed,
+                buffered.get('steps_completed', 0)
+            )
+            name = name or buffered.get('name')
         try:
-            self.service.handle(spec, update_progress, steps_completed, name)
+            self.service.handle(
+                spec,
+                update_progress,
+                steps_completed,
+                name,
+                checkpoint_key='request-%s' % generation_request.id
+            )
             self.mark_completed(generation_request)
         except Exception as e:
             self.mark_failed(generation_request)
@@ -53,15 +86,18 @@ class GenerationJob(Job):
         if not generation_request.started:
             generation_request.started = datetime.now()
             self.request_manager.save(generation_request)
+            self.progress.publish_status(generation_request.id, 'started')
 
     def mark_completed(self, generation_request: GenerationRequest):
         generation_request.completed = datetime.now()
-        self.request_manager.save(generation_request)
+        self.flush(generation_request, terminal=True)
+        self.progress.publish_status(generation_request.id, 'completed')
 
     def mark_failed(self, generation_request: GenerationRequest):
         generation_request.failed = datetime.now()
         generation_request.retried = None
-        self.request_manager.save(generation_request)
+        self.flush(generation_request, terminal=True)
+        self.progress.publish_status(generation_request.id, 'failed')
 
     def update_progress(
         self,
@@ -83,11 +119,38 @@ class GenerationJob(Job):
         if generation_progress.interim_watermarked:
             generation_request.interim_watermarked = generation_progress.interim_watermarked
 
-        if generation_progress.result or generation_progress.result_watermarked:
-            self.result_manager.create({
-                'request_id': generation_request.id,
-                'url': generation_progress.result,
-                'url_watermarked': generation_progress.result_watermarked,
-            })
+        self.progress.put(generation_request.id, generation_progress)
+        self.steps_unflushed += 1
 
+        has_result = (
+            generation_progress.result
+            or generation_progress.result_watermarked
+        )
+        if has_result:
+            self.result_manager.add(GenerationResult(
+                request_id=generation_request.id,
+                url=generation_progress.result,
+                url_watermarked=generation_progress.result_watermarked
+            ))
+
+        if (
+            has_result
+            or self.steps_unflushed >= self.flush_steps
+            or time() - self.last_flushed >= self.flush_seconds
+        ):
+            self.flush(generation_request)
+
+        if has_result:
+            self.progress.publish_status(generation_request.id, 'result')
+
+    def flush(
+        self,
+        generation_request: GenerationRequest,
+        terminal: bool = False
+    ):
         self.request_manager.save(generation_request)
+        self.last_flushed = time()
+        self.steps_unflushed = 0
+        if terminal:
+            # the row is authoritative again
+            self.progress.clear(generation_request.id)
@@ -1,13 +1,18 @@
-from typing import Type
+from datetime import datetime
+from typing import List, Optional, Tuple, Type
 from injector import inject
+from sqlalchemy import tuple_
 
 from vc.db import db
-from vc.exception import NotFoundException
+from vc.exception import NotFoundException, InvalidCursorException
 from vc.event import VcEventDispatcher
 from vc.model.user import User
 
 
 class Manager:
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
     dispatcher: VcEventDispatcher
     model_class: Type[db.Model]
 
@@ -19,7 +24,8 @@ class Manager:
         return self.model_class.query.filter(
             self.model_class.deleted.__eq__(None)
         ).order_by(
-            self.model_class.created.desc()
+            self.model_class.created.desc(),
+            self.model_class.id.desc()
         )
 
     def all(self):
@@ -29,6 +35,44 @@ class Manager:
             db.session.rollback()
             raise e
 
+    def page(
+        self,
+        query,
+        cursor: str = None,
+        limit: int = None
+    ) -> Tuple[List[db.Model], Optional[str]]:
+        """Keyset pagination over a query ordered by (created, id) desc.
+
+        Returns the page and the cursor for the next one, if there is one.
+        """
+        limit = max(1, min(limit or self.PAGE_SIZE, self.MAX_PAGE_SIZE))
+        if cursor:
+            created, id_ = self.decode_cursor(cursor)
+            query = query.filter(
+                tuple_(self.model_class.created, self.model_class.id)
+                < tuple_(created, id_)
+            )
+
+        try:
+            models = query.limit(limit + 1).all()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+        if len(models) <= limit:
+            return models, None
+        return models[:limit], self.encode_cursor(models[limit - 1])
+
+    def encode_cursor(self, model) -> str:
+        return '%s_%s' % (model.created.isoformat(), model.id)
+
+    def decode_cursor(self, cursor: str) -> Tuple[datetime, int]:
+        try:
+            created, id_ = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(created), int(id_)
+        except ValueError:
+            raise InvalidCursorException(cursor)
+
     def find_or_throw(self, id_):
         try:
             model = self.model_class.query.get(id_)
@@ -77,6 +121,10 @@ class Manager:
             db.session.rollback()
             raise e
 
+    def add(self, model):
+        """Stages a model to go out with the next commit."""
+        db.session.add(model)
+
     def save(self, model):
         try:
             db.session.add(model)
@@ -1,5 +1,8 @@
 from datetime import datetime
 
+from sqlalchemy.orm import selectinload
+
+from vc.db import db
 from vc.model.generation_request import GenerationRequest
 from vc.event import GenerationRequestCreatedEvent, GenerationRequestCancelledEvent
 from vc.manager.base import Manager
@@ -21,6 +24,22 @@ class GenerationRequestManager(Manager):
             db.session.rollback()
             raise e
 
+    def page_all(self, cursor: str = None, limit: int = None):
+        return self.page(
+            self.all_query().options(selectinload(self.model_class.results)),
+            cursor,
+            limit
+        )
+
+    def page_published(self, cursor: str = None, limit: int = None):
+        return self.page(
+            self.published_query().options(
+                selectinload(self.model_class.results)
+            ),
+            cursor,
+            limit
+        )
+
     def create(self, request, user: User = None):
         model = super().create(request, user)
 
@@ -8,6 +8,24 @@ from vc.value_object.generation_spec import GenerationSpec
 
 
 class GenerationRequest(db.Model, BaseModel):
+    # keyset pagination walks these backwards, see Manager.page
+    __table_args__ = (
+        db.Index(
+            'ix_generation_request_created_id',
+            'created',
+            'id',
+            postgresql_where=db.text('deleted IS NULL')
+        ),
+        db.Index(
+            'ix_generation_request_published_created_id',
+            'created',
+            'id',
+            postgresql_where=db.text(
+                'deleted IS NULL AND published IS NOT NULL'
+            )
+        ),
+    )
+
     spec = db.Column(db.JSON, nullable=False)
 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -52,6 +70,27 @@ class GenerationRequest(db.Model, BaseModel):
         'results': fields.List(fields.Nested(GenerationResult.public_schema)),
     })
 
+    # as private_schema, without the spec, for listing
+    private_list_schema = api.model('Generation Request List Item', {
+        'id': fields.Integer,
+        'created': fields.DateTime(),
+        'updated': fields.DateTime(),
+        'deleted': fields.DateTime(),
+        'started': fields.DateTime(),
+        'completed': fields.DateTime(),
+        'failed': fields.DateTime(),
+        'cancelled': fields.DateTime(),
+        'retried': fields.DateTime(),
+        'published': fields.DateTime(),
+        'steps_completed': fields.Integer,
+        'steps_total': fields.Integer,
+        'name': fields.String,
+        'preview': fields.String,
+        'interim': fields.String,
+        'interim_watermarked': fields.String,
+        'results': fields.List(fields.Nested(GenerationResult.public_schema)),
+    })
+
     public_schema = api.model('Generation Request', {
         'id': fields.Integer,
         'created': fields.DateTime(),
@@ -9,7 +9,8 @@ class GenerationResult(db.Model, BaseModel):
     request_id = db.Column(
         db.Integer,
         db.ForeignKey('generation_request.id'),
-        nullable=False
+        nullable=False,
+        index=True
     )
 
     url = db.Column(db.String, nullable=True)
@@ -2,6 +2,7 @@ from .job import JobService
 from .provider.api import ApiProvider
 from .queue import QueueService, JobSerializer
 from .file import FileService
+from .progress import ProgressService
 from .vqgan_clip import VqganClipService
 from .inpainting import InpaintingService
 from .esrgan import EsrganService
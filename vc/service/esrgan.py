@@ -1,29 +1,56 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 import cv2
+import torch
 from basicsr.archs.rrdbnet_arch import RRDBNet
 from injector import inject
 
 from vc.service.file import FileService
 from vc.service.helper.dimensions import DimensionsHelper
 from vc.service.helper.esrgan import RealESRGANer
+from vc.service.helper.frame import Frame
+from vc.service.helper.model_registry import ModelRegistry
+from vc.service.helper.onnx_backend import OnnxBackend, OnnxModule
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
 
 
 @dataclass
 class EsrganOptions:
     input_file: str = 'output.png'
+    # used instead of input_file when given
+    input_frame: Optional[Frame] = None
     model_path: str = 'checkpoints/RealESRGAN_x4plus.pth'
     output_file: str = 'output.png'
+    # the output frame is returned either way
+    save_output: bool = True
     netscale: int = 4
     outscale: float = 4
     suffix: str = 'out'
-    tile: int = 0
+    # 0 runs whole frames, -1 picks a tile size from the free GPU memory
+    tile: int = field(default_factory=lambda: int(os.getenv('ESRGAN_TILE', -1)))
     tile_pad: int = 10
+    # tiles per forward pass
+    tile_batch_size: int = field(
+        default_factory=lambda: int(os.getenv('ESRGAN_TILE_BATCH_SIZE', 8))
+    )
     pre_pad: int = 0
+    # forces fp16, as precision='fp16'
     half: bool = False
+    # auto (fp16 on CUDA, fp32 on CPU), fp32, fp16 or bf16
+    precision: str = field(
+        default_factory=lambda: os.getenv('ESRGAN_PRECISION', 'auto')
+    )
     block: int = 23
+    # torch, or onnx for the graph written by the onnx_export command
+    backend: str = field(
+        default_factory=lambda: os.getenv('INFERENCE_BACKEND', 'torch')
+    )
+    # frames per forward pass in handle_frames
+    batch_size: int = field(
+        default_factory=lambda: int(os.getenv('ESRGAN_BATCH_SIZE', 4))
+    )
 
 
 class EsrganService:
@@ -36,26 +63,12 @@ class EsrganService:
         self.file_service = file_service
 
     def handle(self, args: EsrganOptions):
-        model = RRDBNet(
-            num_in_ch=3,
-            num_out_ch=3,
-            num_feat=64,
-            num_block=args.block,
-            num_grow_ch=32,
-            scale=args.netscale
-        )
-
-        upsampler = RealESRGANer(
-            scale=args.netscale,
-            model_path=args.model_path,
-            model=model,
-            tile=args.tile,
-            tile_pad=args.tile_pad,
-            pre_pad=args.pre_pad,
-            half=args.half
-        )
+        upsampler = self.load_upsampler(args)
 
-        img = cv2.imread(args.input_file, cv2.IMREAD_UNCHANGED)
+        if args.input_frame is not None:
+            img = args.input_frame.bgr()
+        else:
+            img = cv2.imread(args.input_file, cv2.IMREAD_UNCHANGED)
 
         h, w = img.shape[0:2]
         if max(h, w) > 1000 and args.netscale == 4:
@@ -70,6 +83,128 @@ class EsrganService:
             dh.log('EsrganService', 'hint: try smaller value for tile', args.tile)
             raise error
 
+        frame = Frame.from_bgr(self.finish(output))
+
+        # Save
+        if args.save_output or os.getenv('DEBUG_FILES'):
+            frame.save(args.output_file)
+
+        if os.getenv('DEBUG_FILES'):
+            self.file_service.put(
+                args.output_file,
+                'esrgan-%s' % (
+                    args.output_file
+                )
+            )
+
+        return frame
+
+    def handle_frames(
+        self,
+        frames: List[Frame],
+        args: EsrganOptions = None
+    ) -> List[Frame]:
+        """Upscales many frames, batch_size same sized frames at a time."""
+        if args is None:
+            args = EsrganOptions()
+        upsampler = self.load_upsampler(args)
+
+        outputs = [None] * len(frames)
+        by_size = {}
+        for i, frame in enumerate(frames):
+            by_size.setdefault((frame.width, frame.height), []).append(i)
+
+        for indexes in by_size.values():
+            for start in range(0, len(indexes), args.batch_size):
+                batch = indexes[start:start + args.batch_size]
+                dh.debug('EsrganService', 'upscaling batch of', len(batch))
+                upscaled = upsampler.enhance_batch(
+                    [frames[i].bgr() for i in batch]
+                )
+                for i, output in zip(batch, upscaled):
+                    outputs[i] = Frame.from_bgr(self.finish(output))
+
+        return outputs
+
+    def load_upsampler(self, args: EsrganOptions) -> RealESRGANer:
+        if args.backend == OnnxBackend.NAME:
+            return self.load_onnx_upsampler(args)
+
+        dtype = self.dtype(args)
+        upsampler = ModelRegistry.get(
+            'esrgan',
+            args.model_path,
+            lambda: RealESRGANer(
+                scale=args.netscale,
+                model_path=args.model_path,
+                model=RRDBNet(
+                    num_in_ch=3,
+                    num_out_ch=3,
+                    num_feat=64,
+                    num_block=args.block,
+                    num_grow_ch=32,
+                    scale=args.netscale
+                ),
+                tile=args.tile,
+                tile_pad=args.tile_pad,
+                pre_pad=args.pre_pad,
+                dtype=dtype,
+                tile_batch_size=args.tile_batch_size
+            ),
+            dtype=dtype
+        )
+        # the resident copy may have been made with other tiling
+        upsampler.tile_size = args.tile
+        upsampler.tile_pad = args.tile_pad
+        upsampler.tile_batch_size = args.tile_batch_size
+        upsampler.pre_pad = args.pre_pad
+        return upsampler
+
+    def load_onnx_upsampler(self, args: EsrganOptions) -> RealESRGANer:
+        def load():
+            # the torch network is only built to be swapped out; pre and
+            # post processing and tiling stay as they are
+            upsampler = RealESRGANer(
+                scale=args.netscale,
+                model_path=args.model_path,
+                model=RRDBNet(
+                    num_in_ch=3,
+                    num_out_ch=3,
+                    num_feat=64,
+                    num_block=args.block,
+                    num_grow_ch=32,
+                    scale=args.netscale
+                ),
+                dtype=torch.float32
+            )
+            upsampler.model = OnnxModule(self.onnx_name(args))
+            return upsampler
+
+        upsampler = ModelRegistry.get(
+            'esrgan_onnx',
+            args.model_path,
+            load,
+            torch.device('cpu')
+        )
+        upsampler.tile_size = args.tile
+        upsampler.tile_pad = args.tile_pad
+        upsampler.tile_batch_size = args.tile_batch_size
+        upsampler.pre_pad = args.pre_pad
+        return upsampler
+
+    def onnx_name(self, args: EsrganOptions) -> str:
+        return 'esrgan_%s' % os.path.splitext(os.path.basename(args.model_path))[0]
+
+    def dtype(self, args: EsrganOptions) -> torch.dtype:
+        if args.half or args.precision == 'fp16':
+            return torch.float16
+        if args.precision == 'bf16':
+            return torch.bfloat16
+        if args.precision == 'auto' and torch.cuda.is_available():
+            return torch.float16
+        return torch.float32
+
+    def finish(self, output):
         # Resize
         width = DimensionsHelper.width_large() + 2 * self.BORDER
         height = DimensionsHelper.height_large() + 2 * self.BORDER
@@ -80,16 +215,8 @@ class EsrganService:
         end = -self.BORDER
         output = output[start:end, start:end]
 
-        # Convert to RGB
-        output = cv2.cvtColor(output, cv2.COLOR_RGBA2RGB)
+        # Drop the alpha channel of RGBA input
+        if output.shape[2] == 4:
+            output = cv2.cvtColor(output, cv2.COLOR_BGRA2BGR)
 
-        # Save
-        cv2.imwrite(args.output_file, output)
-
-        if os.getenv('DEBUG_FILES'):
-            self.file_service.put(
-                args.output_file,
-                'esrgan-%s' % (
-                    args.output_file
-                )
-            )
+        return output
@@ -1,9 +1,13 @@
 from datetime import datetime
+from typing import List
 from injector import inject
 from flask import Flask
 import boto3
+from botocore.exceptions import ClientError
 import os
+from vc.exception import ThirdPartyException
 from vc.service.helper import DiagnosisHelper as dh
+from vc.service.helper.upload_queue import UploadQueue
 
 
 class FileService:
@@ -11,32 +15,91 @@ class FileService:
     client = None  # @todo how to typehint this for the IDE?
     bucket: str
     region: str
+    queue: UploadQueue = None
 
     @inject
     def __init__(self, app: Flask):
         self.client = boto3.client(
             's3',
             aws_access_key_id=app.config.get('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=app.config.get('AWS_SECRET_ACCESS_KEY')
+            aws_secret_access_key=app.config.get('AWS_SECRET_ACCESS_KEY'),
+            # lets a local stand-in such as moto server take the uploads
+            endpoint_url=app.config.get('AWS_ENDPOINT_URL') or None
         )
         self.bucket = app.config.get('AWS_BUCKET_NAME')
         self.region = app.config.get('AWS_BUCKET_REGION')
+        if not app.config.get('SYNC_UPLOADS'):
+            self.queue = UploadQueue(
+                self.upload,
+                workers=int(app.config.get('UPLOAD_WORKERS', 4)),
+                retries=int(app.config.get('UPLOAD_RETRIES', 3))
+            )
 
     def put(self, local_file, filename, now: datetime = None):
+        """Returns the public url straight away; the upload may still be
+        queued, call flush() before relying on it being there."""
+        # url and key have to agree on the timestamp, even across a second
+        now = now or datetime.now()
+        url = self.url(filename, now)
         filename = self.get_filename(filename, now)
-        url = self.URL_PATTERN.format(
+        dh.debug("FileService", "put", os.path.abspath(local_file), url)
+        if self.queue is None:
+            self.upload(local_file, filename)
+        else:
+            self.queue.put(local_file, filename)
+        return url
+
+    def url(self, filename, now: datetime = None):
+        """The url put() gives the same filename, given the same now."""
+        return self.URL_PATTERN.format(
             bucket=self.bucket,
             region=self.region,
-            filename=filename
+            filename=self.get_filename(filename, now)
         )
-        dh.debug("FileService", "put", os.path.abspath(local_file), url)
+
+    def save(self, local_file, key):
+        """Stores a private object under an exact key, e.g. for checkpoints."""
+        dh.debug("FileService", "save", os.path.abspath(local_file), key)
+        if self.queue is None:
+            self.upload(local_file, key, public=False)
+        else:
+            self.queue.put(local_file, key, public=False)
+
+    def fetch(self, key, local_file) -> bool:
+        try:
+            self.client.download_file(self.bucket, key, local_file)
+        except ClientError as e:
+            dh.debug("FileService", "fetch failed", key, e)
+            return False
+        return True
+
+    def delete(self, keys: List[str]):
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    'Objects': [{'Key': key} for key in keys[i:i + 1000]],
+                    'Quiet': True,
+                }
+            )
+
+    def upload(self, local_file, filename, public=True):
         self.client.upload_file(
             local_file,
             self.bucket,
             filename,
-            ExtraArgs={'ACL': 'public-read'}
+            ExtraArgs={'ACL': 'public-read'} if public else None
         )
-        return url
+
+    def flush(self):
+        """Raises when anything queued could not be uploaded, so that urls
+        of files that are not there are never handed on."""
+        if self.queue is None:
+            return
+        failed = self.queue.flush()
+        if failed:
+            dh.log("FileService", "uploads failed", failed)
+            raise ThirdPartyException('Uploads failed: %s' % ', '.join(failed))
 
     def get_filename(self, filename, now: datetime = None):
         if now is None:
@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 from time import time
 from typing import Callable
@@ -13,7 +14,8 @@ from vc.service import (
     FileService,
 )
 from vc.service.helper import DiagnosisHelper as dh
-from vc.service.helper.runner import GenerationRunner
+from vc.service.helper.checkpoint import GenerationCheckpoint
+from vc.service.helper.runner import GenerationRunner, ImageBatchStep
 from vc.value_object import GenerationSpec
 from vc.value_object.generation_progress import GenerationProgress
 
@@ -29,6 +31,9 @@ class GenerationService:
     video: VideoService
     file: FileService
 
+    # how many images of an image spec to optimise together
+    batch_size: int
+
     hpy = None
 
     @inject
@@ -47,19 +52,27 @@ class GenerationService:
         self.rife = rife
         self.video = video
         self.file = file
+        self.batch_size = int(os.getenv('VQGAN_BATCH_SIZE', 1))
 
     def handle(
         self,
         spec: GenerationSpec,
         callback: Callable,
         steps_completed=0,
-        name=None
+        name=None,
+        checkpoint_key: str = None
     ):
         dh.debug('GenerationService', 'starting')
         start = time()
 
         steps_total = self.calculate_total_steps(spec)
 
+        checkpoint = (
+            GenerationCheckpoint(checkpoint_key, self.file)
+            if checkpoint_key
+            else None
+        )
+
         runner = GenerationRunner(
             self.vqgan_clip,
             self.inpainting,
@@ -69,34 +82,100 @@ class GenerationService:
             self.file,
             self.OUTPUT_FILENAME,
             self.STEPS_DIR,
-            name=name
+            name=name,
+            checkpoint=checkpoint
         )
 
-        for step in GenerationRunner.iterate_steps(spec):
-            if step.step <= steps_completed:
-                continue
-
-            steps_completed = step.step
-            result = runner.handle(step)
-            callback(GenerationProgress(
-                steps_completed=steps_completed,
-                steps_total=steps_total,
-                name=runner.generation_name,
-                preview=result.preview,
-                result=result.result,
-                result_watermarked=result.result_watermarked,
-                interim=result.interim,
-                interim_watermarked=result.interim_watermarked
-            ))
-            dh.debug('Completed %s of %s steps (%s%%) for %s in %s' % (
-                steps_completed,
-                steps_total,
-                round(steps_completed / steps_total * 100, 2),
-                runner.generation_name,
-                timedelta(seconds=time() - start)
-            ))
+        if checkpoint is not None and steps_completed:
+            state = checkpoint.load(self.OUTPUT_FILENAME, self.STEPS_DIR)
+            if state is None:
+                dh.log('GenerationService', 'no checkpoint to resume from', checkpoint_key)
+            else:
+                runner.restore(state['runner'])
+                # the checkpoint may be a step ahead of the progress we saved
+                steps_completed = state['step']
+
+        try:
+            self.run_steps(spec, runner, callback, steps_completed, steps_total, start)
+            runner.drain()
+        finally:
+            runner.close()
+            # nothing may still be uploading once the job is reported done
+            self.file.flush()
+
+        if checkpoint is not None:
+            checkpoint.remove()
 
         dh.debug('GenerationService', 'done in', timedelta(seconds=time() - start))
+        dh.debug(
+            'GenerationService',
+            'iterations run', runner.iterations_run,
+            'saved', runner.iterations_saved
+        )
+
+    def run_steps(
+        self,
+        spec: GenerationSpec,
+        runner: GenerationRunner,
+        callback: Callable,
+        steps_completed: int,
+        steps_total: int,
+        start: float
+    ):
+        steps = (
+            step
+            for step in GenerationRunner.iterate_steps(spec)
+            if step.step > steps_completed
+        )
+        for step in GenerationRunner.batch_steps(steps, self.batch_size):
+            if isinstance(step, ImageBatchStep):
+                results = runner.handle_batch(step)
+            else:
+                results = [(step, runner.handle(step))]
+            if any(result.result for _, result in results):
+                # results are persisted as final, so make sure they exist;
+                # a failed upload fails the job before the checkpoint moves
+                # past the step, so a retry produces the result again
+                self.file.flush()
+            # with video frames still in the pipeline the files would be
+            # behind the state, so wait for the next idle moment
+            if runner.checkpoint is not None and runner.idle:
+                runner.checkpoint.save(
+                    step.step,
+                    runner.state(),
+                    self.OUTPUT_FILENAME,
+                    self.STEPS_DIR
+                )
+            for done, result in results:
+                steps_completed = done.step
+                callback(GenerationProgress(
+                    steps_completed=steps_completed,
+                    steps_total=steps_total,
+                    name=runner.generation_name,
+                    preview=result.preview,
+                    result=result.result,
+                    result_watermarked=result.result_watermarked,
+                    interim=result.interim,
+                    interim_watermarked=result.interim_watermarked
+                ))
+                dh.debug('Completed %s of %s steps (%s%%) for %s in %s' % (
+                    steps_completed,
+                    steps_total,
+                    round(steps_completed / steps_total * 100, 2),
+                    runner.generation_name,
+                    timedelta(seconds=time() - start)
+                ))
+
+    def warm_up(self):
+        dh.debug('GenerationService', 'warming up models')
+        start = time()
+        for service in (self.vqgan_clip, self.inpainting):
+            try:
+                service.warm_up()
+            except Exception as e:
+                # the model will be loaded (and fail loudly) on demand instead
+                dh.log('GenerationService', 'warm up failed', service, e)
+        dh.debug('GenerationService', 'warmed up in', timedelta(seconds=time() - start))
 
     def calculate_total_steps(self, spec):
         steps_total = 0
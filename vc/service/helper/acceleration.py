@@ -113,6 +113,25 @@ class Translate:
     def to_tuple(self):
         return self.x, self.y, self.z
 
+    def state(self) -> dict:
+        return {
+            'target': [self.x_target, self.y_target, self.z_target],
+            'position': list(self.to_tuple()),
+            'velocity': list(self.velocity.to_tuple()),
+            'transition': self.transition,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        translate = cls(*state['target'], transition=state['transition'])
+        translate.x, translate.y, translate.z = state['position']
+        (
+            translate.velocity.x,
+            translate.velocity.y,
+            translate.velocity.z
+        ) = state['velocity']
+        return translate
+
     def reset(self):
         self.x = 0.
         self.y = 0.
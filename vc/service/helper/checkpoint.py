@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+from typing import List, Optional
+
+from vc.service.file import FileService
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class GenerationCheckpoint:
+    """Everything needed to pick a generation back up after its last step.
+
+    Kept in a directory per request: the runner state as json, a copy of the
+    current output image, a mirror of the steps dir (copied incrementally, so
+    each step only pays for its new frames) and the VQGAN latent files the
+    service writes while optimising. With CHECKPOINT_S3 set everything is also
+    stored in the bucket, so a job retried on another worker can resume too.
+    """
+    STATE_FILE = 'state.json'
+    OUTPUT_FILE = 'output.png'
+    STEPS_DIR = 'steps'
+    S3_PREFIX = 'checkpoints'
+
+    key: str
+    dir: str
+    file: Optional[FileService]
+
+    def __init__(self, key: str, file: FileService = None):
+        self.key = key
+        self.dir = os.path.join(
+            os.getenv('GENERATION_CHECKPOINT_DIR', 'generation-checkpoints'),
+            key
+        )
+        self.file = file if os.getenv('CHECKPOINT_S3') else None
+        os.makedirs(os.path.join(self.dir, self.STEPS_DIR), exist_ok=True)
+
+    def latent_file(self, name) -> str:
+        return os.path.join(self.dir, 'latent-%s.pt' % name)
+
+    def save(self, step: int, state: dict, output_filename: str, steps_dir: str):
+        changed = []
+
+        output_file = os.path.join(self.dir, self.OUTPUT_FILE)
+        if os.path.isfile(output_filename):
+            shutil.copyfile(output_filename, output_file)
+            changed.append(self.OUTPUT_FILE)
+        elif os.path.isfile(output_file):
+            os.remove(output_file)
+
+        frames = sorted(
+            filename
+            for filename in os.listdir(steps_dir)
+            if os.path.isfile(os.path.join(steps_dir, filename))
+        )
+        changed += self.sync_frames(steps_dir, frames)
+
+        # only the latent of the most recent optimisation is worth keeping
+        latents = sorted(
+            (
+                filename
+                for filename in os.listdir(self.dir)
+                if filename.startswith('latent-')
+                and filename.endswith('.pt')
+            ),
+            key=lambda filename: os.path.getmtime(
+                os.path.join(self.dir, filename)
+            )
+        )
+        for filename in latents[:-1]:
+            os.remove(os.path.join(self.dir, filename))
+        changed += latents[-1:]
+
+        self.write_json(self.STATE_FILE, {
+            'step': step,
+            'runner': state,
+            'output': os.path.isfile(output_file),
+            'frames': frames,
+            'latent': latents[-1] if latents else None,
+        })
+        changed.append(self.STATE_FILE)
+
+        if self.file is not None:
+            for filename in changed:
+                self.file.save(
+                    os.path.join(self.dir, filename),
+                    self.s3_key(filename)
+                )
+
+    def sync_frames(self, steps_dir: str, frames: List[str]) -> List[str]:
+        checkpoint_steps_dir = os.path.join(self.dir, self.STEPS_DIR)
+        for filename in os.listdir(checkpoint_steps_dir):
+            if filename not in frames:
+                os.remove(os.path.join(checkpoint_steps_dir, filename))
+
+        changed = []
+        for filename in frames:
+            source = os.path.join(steps_dir, filename)
+            target = os.path.join(checkpoint_steps_dir, filename)
+            if (
+                os.path.isfile(target)
+                and os.path.getmtime(target) == os.path.getmtime(source)
+            ):
+                continue
+            shutil.copy2(source, target)
+            changed.append(os.path.join(self.STEPS_DIR, filename))
+        return changed
+
+    def load(self, output_filename: str, steps_dir: str) -> Optional[dict]:
+        """Puts the checkpointed files back in place and returns the state."""
+        checkpoint = self.read_json(self.STATE_FILE)
+        if checkpoint is None and self.file is not None:
+            checkpoint = self.fetch_all()
+        if checkpoint is None:
+            return None
+
+        output_file = os.path.join(self.dir, self.OUTPUT_FILE)
+        if checkpoint['output'] and os.path.isfile(output_file):
+            shutil.copyfile(output_file, output_filename)
+        elif os.path.isfile(output_filename):
+            os.remove(output_filename)
+
+        os.makedirs(steps_dir, exist_ok=True)
+        for filename in os.listdir(steps_dir):
+            filepath = os.path.join(steps_dir, filename)
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+        for filename in checkpoint['frames']:
+            source = os.path.join(self.dir, self.STEPS_DIR, filename)
+            if os.path.isfile(source):
+                shutil.copy2(source, os.path.join(steps_dir, filename))
+            else:
+                dh.log('GenerationCheckpoint', 'missing frame', source)
+
+        dh.debug('GenerationCheckpoint', 'loaded', self.key, checkpoint['step'])
+        return checkpoint
+
+    def fetch_all(self) -> Optional[dict]:
+        state_file = os.path.join(self.dir, self.STATE_FILE)
+        if not self.file.fetch(self.s3_key(self.STATE_FILE), state_file):
+            return None
+        checkpoint = self.read_json(self.STATE_FILE)
+
+        filenames = [
+            os.path.join(self.STEPS_DIR, filename)
+            for filename in checkpoint['frames']
+        ]
+        if checkpoint['output']:
+            filenames.append(self.OUTPUT_FILE)
+        if checkpoint['latent']:
+            filenames.append(checkpoint['latent'])
+        for filename in filenames:
+            self.file.fetch(
+                self.s3_key(filename),
+                os.path.join(self.dir, filename)
+            )
+
+        return checkpoint
+
+    def remove(self):
+        if self.file is not None:
+            checkpoint = self.read_json(self.STATE_FILE)
+            if checkpoint is not None:
+                filenames = [self.STATE_FILE, self.OUTPUT_FILE] + [
+                    os.path.join(self.STEPS_DIR, filename)
+                    for filename in checkpoint['frames']
+                ]
+                if checkpoint['latent']:
+                    filenames.append(checkpoint['latent'])
+                self.file.flush()
+                self.file.delete([self.s3_key(f) for f in filenames])
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def s3_key(self, filename: str) -> str:
+        return '/'.join([self.S3_PREFIX, self.key, filename])
+
+    def write_json(self, filename: str, data: dict):
+        path = os.path.join(self.dir, filename)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def read_json(self, filename: str) -> Optional[dict]:
+        path = os.path.join(self.dir, filename)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
@@ -4,6 +4,7 @@ import kornia.augmentation as K
 import torch
 from torch import nn
 from torch.nn import functional as F
+from torchvision.ops import roi_align
 
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
 
@@ -222,15 +223,9 @@ class MakeCutouts(nn.Module):
         self.noise_fac = 0.1
         # self.noise_fac = False
 
-        # Pooling
-        self.av_pool = nn.AdaptiveAvgPool2d((self.cut_size, self.cut_size))
-        self.max_pool = nn.AdaptiveMaxPool2d((self.cut_size, self.cut_size))
 
     def forward(self, input):
         # based on https://github.com/sportsracer48/pytti
-        cutouts = []
-        offsets = []
-        sizes = []
         _, _, side_y, side_x = input.shape
         max_size = min(side_x, side_y)
         paddingx = min(round(side_x * self.clip_helper.padding), side_x)
@@ -241,60 +236,24 @@ class MakeCutouts(nn.Module):
             mode='constant'  # 'reflect', 'replicate', 'circular', 'constant'
         )
 
-        master_offsetx_max = side_x - max_size + 1
-        master_offsety_max = side_y - max_size + 1
-        master_offsetx = int(0.5 * (master_offsetx_max + 2 * paddingx) - paddingx)
-        master_offsety = int(0.5 * (master_offsety_max + 2 * paddingy) - paddingy)
-
-        i = 0
-        while i < self.cutn:
-            if i % 2 == 0 and self.USE_MASTER_CUTOUT:
-                size = max_size
-                offsetx = master_offsetx
-                offsety = master_offsety
-            else:
-                while True:
-                    xrandc = torch.rand([])
-                    yrandc = torch.rand([])
-                    size = int(
-                        max_size * (
-                            torch
-                                .zeros(1, )
-                                .normal_(mean=.8, std=.3)
-                                .clip(self.cut_size / max_size, 1.)
-                                    ** self.cut_pow
-                        )
-                    )
-                    offsetx_max = side_x - size + 1
-                    offsety_max = side_y - size + 1
-
-                    offsetx = int(xrandc * (offsetx_max + 2 * paddingx) - paddingx)
-                    offsety = int(yrandc * (offsety_max + 2 * paddingy) - paddingy)
-                    if not self.USE_MASTER_CUTOUT:
-                        break
-
-                    # if centre outside circle inscribed in master cutout, use it
-                    if math.hypot(offsetx, offsety) > size * 0.5:
-                        break
-
-            xfrom, xto = paddingx + offsetx, paddingx + offsetx + size
-            yfrom, yto = paddingy + offsety, paddingy + offsety + size
-
-            cutout = input[:, :, yfrom:yto, xfrom:xto]
-
-            cutouts.append(self.av_pool(cutout))
-            offsets.append(torch.as_tensor(
-                [[offsetx / side_x, offsety / side_y]]
-            ).to(self.device))
-            sizes.append(torch.as_tensor(
-                [[size / side_x, size / side_y]]
-            ).to(self.device))
-
-            i += 1
+        sizes, offsetsx, offsetsy = self.sample(
+            side_x,
+            side_y,
+            max_size,
+            paddingx,
+            paddingy,
+            input.device
+        )
 
-        cutouts = self.augs(torch.cat(cutouts, dim=0))
-        offsets = torch.cat(offsets)
-        sizes = torch.cat(sizes)
+        cutouts = self.augs(self.extract(
+            input,
+            offsetsy + paddingy,
+            offsetsx + paddingx,
+            sizes,
+            max_size
+        ))
+        offsets = torch.stack([offsetsx / side_x, offsetsy / side_y], dim=1)
+        sizes = torch.stack([sizes / side_x, sizes / side_y], dim=1)
 
         if self.noise_fac:
             facs = cutouts.new_empty(
@@ -302,16 +261,154 @@ class MakeCutouts(nn.Module):
             ).uniform_(0,self.noise_fac)
             cutouts = cutouts + facs * torch.randn_like(cutouts)
 
-        return cutouts, offsets, sizes
+        return cutouts, offsets.float(), sizes.float()
+
+    def sample(self, side_x, side_y, max_size, paddingx, paddingy, device):
+        """Draws the size and top left corner of every cutout at once.
+
+        Every other cutout is the centred master cutout; the rest are
+        redrawn, in bulk, until their corner lies outside the circle of the
+        master cutout's radius, as the old per-cutout rejection loop did.
+        """
+        sizes = torch.empty(self.cutn, dtype=torch.long, device=device)
+        offsetsx = torch.empty_like(sizes)
+        offsetsy = torch.empty_like(sizes)
+        pending = torch.ones(self.cutn, dtype=torch.bool, device=device)
+
+        if self.USE_MASTER_CUTOUT:
+            master = torch.arange(self.cutn, device=device) % 2 == 0
+            sizes[master] = max_size
+            offsetsx[master] = int(
+                0.5 * (side_x - max_size + 1 + 2 * paddingx) - paddingx
+            )
+            offsetsy[master] = int(
+                0.5 * (side_y - max_size + 1 + 2 * paddingy) - paddingy
+            )
+            pending &= ~master
+
+        while True:
+            indices = pending.nonzero().squeeze(1)
+            n = len(indices)
+            if n == 0:
+                break
+
+            xrandc = torch.rand(n, device=device)
+            yrandc = torch.rand(n, device=device)
+            size = (
+                max_size * (
+                    torch
+                        .empty(n, device=device)
+                        .normal_(mean=.8, std=.3)
+                        .clip(self.cut_size / max_size, 1.)
+                            ** self.cut_pow
+                )
+            ).long()
+
+            # int() truncates towards zero, even for the negative offsets
+            offsetx = torch.trunc(
+                xrandc * (side_x - size + 1 + 2 * paddingx) - paddingx
+            ).long()
+            offsety = torch.trunc(
+                yrandc * (side_y - size + 1 + 2 * paddingy) - paddingy
+            ).long()
+
+            if self.USE_MASTER_CUTOUT:
+                # if centre outside circle inscribed in master cutout, use it
+                accepted = torch.hypot(
+                    offsetx.float(),
+                    offsety.float()
+                ) > size * 0.5
+            else:
+                accepted = torch.ones_like(pending[indices])
+
+            indices = indices[accepted]
+            sizes[indices] = size[accepted]
+            offsetsx[indices] = offsetx[accepted]
+            offsetsy[indices] = offsety[accepted]
+            pending[indices] = False
+
+        return sizes, offsetsx, offsetsy
+
+    def extract(self, input, yfrom, xfrom, sizes, max_size):
+        """Pools every cutout down to cut_size in one roi_align, in the input dtype.
+
+        Each output pixel averages a grid of bilinear samples over its
+        share of the cutout, enough of them to cover every pixel of the
+        largest cutouts. A cutout that many times cut_size comes out as the
+        old per-cutout AdaptiveAvgPool2d (extract_loop) made it; others are
+        box filtered rather than pooled over its overlapping bins.
+        """
+        n, b = len(sizes), input.shape[0]
+        # cutout-major, as concatenating per-cutout batches used to give
+        batch = torch.arange(b, device=input.device).repeat(n)
+        sizes = sizes.repeat_interleave(b)
+        xfrom = xfrom.repeat_interleave(b)
+        yfrom = yfrom.repeat_interleave(b)
+        # without aligned, samples sit on integer coordinates when boxes
+        # start half a pixel early
+        boxes = torch.stack([
+            batch,
+            xfrom - .5,
+            yfrom - .5,
+            xfrom + sizes - .5,
+            yfrom + sizes - .5,
+        ], dim=1).to(input.dtype)
+        return roi_align(
+            input,
+            boxes,
+            self.cut_size,
+            aligned=False,
+            sampling_ratio=math.ceil(max_size / self.cut_size)
+        )
+
+    def extract_loop(self, input, yfrom, xfrom, sizes):
+        """Average pools one cutout at a time, as before extract; for comparison."""
+        return torch.cat([
+            F.adaptive_avg_pool2d(
+                input[:, :, y:y + size, x:x + size],
+                self.cut_size
+            )
+            for y, x, size in zip(yfrom.tolist(), xfrom.tolist(), sizes.tolist())
+        ])
 
     # not used (get a random number with a normal distribution)
     def randc(self, min=0., max=1., mean=0.5, sd=0.5):
         return float(np.clip(np.random.normal(mean, sd), min, max))
 
 
+class TextEncoder(nn.Module):
+    """The text half of a CLIP model, to quantise apart from the image half.
+
+    The image encoder is backpropagated through while optimising, which
+    quantised layers do not support; the text encoder only ever runs
+    forward.
+    """
+
+    def __init__(self, perceptor):
+        super().__init__()
+        self.token_embedding = perceptor.token_embedding
+        self.positional_embedding = perceptor.positional_embedding
+        self.transformer = perceptor.transformer
+        self.ln_final = perceptor.ln_final
+        self.text_projection = perceptor.text_projection
+
+    def forward(self, text):
+        x = self.token_embedding(text).float()
+        x = x + self.positional_embedding.float()
+        x = x.permute(1, 0, 2)
+        x = self.transformer(x)
+        x = x.permute(1, 0, 2)
+        x = self.ln_final(x)
+        return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ self.text_projection.float()
+
+
 class ClipHelper:
     padding = 0.25
 
+    # the kornia augmentation stack is costly to build, and make_cutouts is
+    # asked for the same one on every iteration
+    cutouts = {}
+
     def replace_grad(self, *args, **kwargs):
         return ReplaceGrad.apply(*args, **kwargs)
 
@@ -322,4 +419,18 @@ class ClipHelper:
         return MaskingPrompt(self, embed, weight, stop, ground, text)
 
     def make_cutouts(self, augments, cut_size, cutn, cut_pow=1.):
-        return MakeCutouts(self, augments, cut_size, cutn, cut_pow)
+        key = (
+            tuple(tuple(items) for items in augments),
+            cut_size,
+            cutn,
+            cut_pow
+        )
+        if key not in self.cutouts:
+            self.cutouts[key] = MakeCutouts(
+                self,
+                augments,
+                cut_size,
+                cutn,
+                cut_pow
+            )
+        return self.cutouts[key]
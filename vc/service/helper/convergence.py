@@ -0,0 +1,48 @@
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class IterationStats:
+    iterations: int
+    max_iterations: int
+    converged: bool = False
+    loss: float = None
+
+    @property
+    def saved(self) -> int:
+        return self.max_iterations - self.iterations
+
+
+class ConvergencePolicy:
+    """Tells when the loss of an optimisation has stopped improving.
+
+    Compares the mean loss of the last window iterations with the mean of the
+    window before it. Once at least min_iterations have run and the relative
+    improvement between the two is below threshold, the latent has converged.
+    Means over a window smooth out the noise the random cutouts add to every
+    single loss.
+    """
+    window: int
+    threshold: float
+    min_iterations: int
+    losses: deque
+
+    def __init__(self, window: int, threshold: float, min_iterations: int = 0):
+        self.window = window
+        self.threshold = threshold
+        self.min_iterations = min_iterations
+        self.losses = deque(maxlen=2 * window)
+
+    def converged(self, i: int, loss: float) -> bool:
+        """Records the loss of iteration i."""
+        self.losses.append(loss)
+        if i + 1 < self.min_iterations or len(self.losses) < 2 * self.window:
+            return False
+
+        losses = list(self.losses)
+        previous = sum(losses[:self.window]) / self.window
+        current = sum(losses[self.window:]) / self.window
+        if previous == 0:
+            return True
+        return (previous - current) / abs(previous) < self.threshold
@@ -0,0 +1,111 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class DepthCache:
+    """Process-wide cache of MiDaS depth maps, keyed by image content and model.
+
+    Retries, reruns over a steps dir and debug runs all estimate depth for
+    byte-identical frames, which is then a hash away. Entries are evicted
+    least recently used first. With DEPTH_CACHE=disk misses are also looked
+    up in (and written back to) .npy files under DEPTH_CACHE_DIR, which are
+    memory mapped rather than read, so they are shared between workers and
+    survive restarts. Cached maps are read-only; copy one to change it.
+    """
+    entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+    hits: int = 0
+    misses: int = 0
+
+    @classmethod
+    def lookup(cls, image: np.ndarray, model_type: str) -> Optional[np.ndarray]:
+        """The cached depth map of image, or None to estimate and put it."""
+        key = cls.key(image, model_type)
+
+        if key in cls.entries:
+            cls.entries.move_to_end(key)
+            cls.hits += 1
+            return cls.entries[key]
+
+        cls.misses += 1
+        depth = cls.load(key)
+        if depth is not None:
+            dh.debug('DepthCache', 'loaded', key)
+            cls.remember(key, depth)
+        return depth
+
+    @classmethod
+    def put(cls, image: np.ndarray, model_type: str, depth: np.ndarray) -> np.ndarray:
+        key = cls.key(image, model_type)
+        depth = np.array(depth, dtype=np.float32)
+        depth.setflags(write=False)
+        cls.store(key, depth)
+        cls.remember(key, depth)
+        return depth
+
+    @classmethod
+    def remember(cls, key: str, depth: np.ndarray):
+        cls.entries[key] = depth
+        cls.entries.move_to_end(key)
+        while len(cls.entries) > cls.size():
+            cls.entries.popitem(last=False)
+
+    @classmethod
+    def size(cls) -> int:
+        # read when used, as .env is loaded after this is imported
+        return int(os.getenv('DEPTH_CACHE_SIZE', 64))
+
+    @classmethod
+    def backing(cls) -> str:
+        return os.getenv('DEPTH_CACHE', '')
+
+    @classmethod
+    def directory(cls) -> str:
+        return os.getenv('DEPTH_CACHE_DIR', 'depth-cache')
+
+    @classmethod
+    def clear(cls):
+        cls.entries.clear()
+        cls.hits = cls.misses = 0
+
+    @classmethod
+    def key(cls, image: np.ndarray, model_type: str) -> str:
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha1(image.data)
+        digest.update(('%s %s %s' % (image.shape, image.dtype, model_type)).encode('utf-8'))
+        return digest.hexdigest()
+
+    @classmethod
+    def path(cls, key: str) -> str:
+        return os.path.join(cls.directory(), '%s.npy' % key)
+
+    @classmethod
+    def load(cls, key: str) -> Optional[np.ndarray]:
+        if cls.backing() != 'disk':
+            return None
+        try:
+            path = cls.path(key)
+            if os.path.isfile(path):
+                return np.load(path, mmap_mode='r')
+        except Exception as e:
+            # a cache, so a broken entry only costs an estimate
+            dh.log('DepthCache', 'load failed', key, e)
+        return None
+
+    @classmethod
+    def store(cls, key: str, depth: np.ndarray):
+        if cls.backing() != 'disk':
+            return
+        try:
+            os.makedirs(cls.directory(), exist_ok=True)
+            path = cls.path(key)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, depth)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            dh.log('DepthCache', 'store failed', key, e)
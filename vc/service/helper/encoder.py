@@ -0,0 +1,183 @@
+import os
+import shutil
+import subprocess
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class EncoderSession:
+    """A long-lived ffmpeg encode fed raw frames over a pipe.
+
+    Frames are encoded exactly once, into a run of MPEG-TS segments per
+    output. Cutting closes the current segment, after which everything
+    encoded so far can be stitched into an mp4 by stream copy, so interim
+    videos never re-encode old frames.
+
+    The output size is fixed when the session is opened, and picks the
+    watermark; frames of any other size (not upscaled, or rounded down by
+    VQGAN) are resized to it. ffmpeg's stderr goes to a log per segment,
+    which is raised with when ffmpeg fails.
+    """
+    WATERMARK_FILE = 'app/assets/watermark-%s.png'
+    OUTPUTS = ['unwatermarked', 'watermarked']
+
+    work_dir: str
+    framerate: int
+    encode_args: List[str]
+    size: tuple
+    frames_written: int = 0
+    segments: Dict[str, List[str]]
+    process: subprocess.Popen = None
+
+    log_file: str = None
+
+    def __init__(
+        self,
+        work_dir: str,
+        framerate: int,
+        encode_args: List[str],
+        width: int,
+        height: int
+    ):
+        self.work_dir = work_dir
+        self.framerate = framerate
+        self.encode_args = encode_args
+        self.size = width, height
+        self.segments = {output: [] for output in self.OUTPUTS}
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def write(self, frame: np.ndarray):
+        """Encodes one BGR uint8 frame."""
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(
+                frame,
+                self.size,
+                interpolation=(
+                    cv2.INTER_AREA
+                    if frame.shape[1] > self.size[0]
+                    else cv2.INTER_CUBIC
+                )
+            )
+
+        if self.process is None:
+            self.start_segment()
+
+        try:
+            self.process.stdin.write(
+                np.ascontiguousarray(frame[..., :3]).tobytes()
+            )
+        except BrokenPipeError:
+            # ffmpeg exited, its log says why
+            self.process.wait()
+            self.fail()
+        self.frames_written += 1
+
+    def write_file(self, path: str):
+        self.write(cv2.imread(path, cv2.IMREAD_COLOR))
+
+    def start_segment(self):
+        # one process decodes the piped frames once and splits them into the
+        # plain and the watermarked encode
+        width, height = self.size
+        watermark_file = self.WATERMARK_FILE % width
+        if not os.path.isfile(watermark_file):
+            raise FileNotFoundError(
+                '%s is missing, videos %s wide cannot be watermarked' % (
+                    watermark_file,
+                    width
+                )
+            )
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', '%sx%s' % (width, height),
+            '-framerate', str(self.framerate),
+            '-i', '-',
+            '-i', watermark_file,
+            '-filter_complex', ';'.join([
+                '[0:v]split=2[unwatermarked][overlaid]',
+                '[overlaid][1:v]overlay=0:0[watermarked]',
+            ]),
+        ]
+        for output in self.OUTPUTS:
+            segment = os.path.join(
+                self.work_dir,
+                '%s-%04d.ts' % (output, len(self.segments[output]) + 1)
+            )
+            cmd += ['-map', '[%s]' % output] + self.encode_args + [
+                '-f', 'mpegts', segment
+            ]
+            self.segments[output].append(segment)
+        self.log_file = os.path.join(
+            self.work_dir,
+            'ffmpeg-%04d.log' % len(self.segments[self.OUTPUTS[0]])
+        )
+        dh.debug('EncoderSession', 'running', ' '.join(cmd))
+        with open(self.log_file, 'wb') as log:
+            self.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=log
+            )
+
+    def fail(self):
+        process = self.process
+        self.process = None
+        with open(self.log_file, 'rb') as log:
+            # the banner and per frame stats come first, the error last
+            stderr = log.read().decode('utf-8', 'replace')[-2000:]
+        dh.log('EncoderSession', 'ffmpeg failed', process.returncode, stderr)
+        raise RuntimeError(
+            'ffmpeg exited with %s:\n%s' % (process.returncode, stderr)
+        )
+
+    def cut(self):
+        """Finishes the segments currently being written."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            self.fail()
+        self.process = None
+
+    def concat(self, output: str, output_file: str):
+        """Stitches the finished segments of one output into an mp4."""
+        self.cut()
+        segments = self.segments[output]
+        if not segments:
+            return None
+        list_file = os.path.join(self.work_dir, '%s.txt' % output)
+        with open(list_file, 'w') as f:
+            for segment in segments:
+                f.write("file '%s'\n" % os.path.abspath(segment))
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_file,
+            '-c', 'copy',
+            output_file,
+        ]
+        dh.debug('EncoderSession', 'running', ' '.join(cmd))
+        subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        return output_file
+
+    def close(self, remove: bool = True):
+        try:
+            self.cut()
+        finally:
+            if remove and os.path.isdir(self.work_dir):
+                shutil.rmtree(self.work_dir)
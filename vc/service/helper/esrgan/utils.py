@@ -12,13 +12,28 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 class RealESRGANer:
-    def __init__(self, scale, model_path, model=None, tile=0, tile_pad=10, pre_pad=10, half=False):
+    # rough number of output sized activations alive at once per channel
+    # of RRDBNet, used to guess how much of the image fits in memory
+    ACTIVATIONS_PER_PIXEL = 64 * 4
+    # share of the free device memory an automatic tile may use
+    MEMORY_FRACTION = 0.5
+    MIN_TILE = 64
+
+    def __init__(self, scale, model_path, model=None, tile=0, tile_pad=10, pre_pad=10, half=False,
+                 dtype=None, tile_batch_size=8):
+        """tile=0 runs the whole image at once, tile=-1 picks a tile size
+        from the free device memory. dtype overrides half, e.g. with
+        torch.bfloat16 on CPU."""
         self.scale = scale
         self.tile_size = tile
         self.tile_pad = tile_pad
+        self.tile_batch_size = tile_batch_size
         self.pre_pad = pre_pad
         self.mod_scale = None
-        self.half = half
+        if dtype is None:
+            dtype = torch.float16 if half else torch.float32
+        self.dtype = dtype
+        self.half = dtype == torch.float16
 
         # initialize model
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -40,15 +55,14 @@ class RealESRGANer:
             keyname = 'params'
         model.load_state_dict(loadnet[keyname], strict=True)
         model.eval()
-        self.model = model.to(self.device)
-        if self.half:
-            self.model = self.model.half()
+        self.model = model.to(self.device, self.dtype)
 
     def pre_process(self, img):
         img = torch.from_numpy(np.transpose(img, (2, 0, 1))).float()
-        self.img = img.unsqueeze(0).to(self.device)
-        if self.half:
-            self.img = self.img.half()
+        self.pre_process_tensor(img.unsqueeze(0))
+
+    def pre_process_tensor(self, img):
+        self.img = img.to(self.device, self.dtype)
 
         # pre_pad
         if self.pre_pad != 0:
@@ -70,67 +84,63 @@ class RealESRGANer:
     def process(self):
         self.output = self.model(self.img)
 
-    def tile_process(self):
-        """Modified from: https://github.com/ata4/esrgan-launcher
+    def run(self):
+        tile_size = self.tile_size
+        if tile_size < 0:
+            batch, _, height, width = self.img.shape
+            tile_size = self.auto_tile_size(batch, height, width)
+        if tile_size > 0:
+            self.tile_process(tile_size)
+        else:
+            self.process()
+
+    def auto_tile_size(self, batch, height, width):
+        """0 if the whole batch fits in memory, else the largest tile that does."""
+        if self.device.type != 'cuda':
+            return 0
+        free, _ = torch.cuda.mem_get_info(self.device)
+        budget = free * self.MEMORY_FRACTION
+        per_pixel = self.ACTIVATIONS_PER_PIXEL * self.scale ** 2 * self.img.element_size()
+        if batch * height * width * per_pixel <= budget:
+            return 0
+        # tile_batch_size tiles, each with its padding, are run at once
+        side = int(math.sqrt(budget / per_pixel / self.tile_batch_size)) - 2 * self.tile_pad
+        return max(self.MIN_TILE, side // 8 * 8)
+
+    def tile_process(self, tile_size=None):
+        """Cuts the images into equal tiles and upscales tile_batch_size at a time.
+
+        The images are padded by replicating their edges, so that every tile
+        including its tile_pad of context has the same size and tiles from
+        anywhere in the batch can be stacked.
         """
+        tile = tile_size or self.tile_size
+        pad = self.tile_pad
+        scale = self.scale
         batch, channel, height, width = self.img.shape
-        output_height = height * self.scale
-        output_width = width * self.scale
-        output_shape = (batch, channel, output_height, output_width)
-
-        # start with black image
-        self.output = self.img.new_zeros(output_shape)
-        tiles_x = math.ceil(width / self.tile_size)
-        tiles_y = math.ceil(height / self.tile_size)
-
-        # loop over all tiles
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                # extract tile from input image
-                ofs_x = x * self.tile_size
-                ofs_y = y * self.tile_size
-                # input tile area on total image
-                input_start_x = ofs_x
-                input_end_x = min(ofs_x + self.tile_size, width)
-                input_start_y = ofs_y
-                input_end_y = min(ofs_y + self.tile_size, height)
-
-                # input tile area on total image with padding
-                input_start_x_pad = max(input_start_x - self.tile_pad, 0)
-                input_end_x_pad = min(input_end_x + self.tile_pad, width)
-                input_start_y_pad = max(input_start_y - self.tile_pad, 0)
-                input_end_y_pad = min(input_end_y + self.tile_pad, height)
-
-                # input tile dimensions
-                input_tile_width = input_end_x - input_start_x
-                input_tile_height = input_end_y - input_start_y
-                tile_idx = y * tiles_x + x + 1
-                input_tile = self.img[:, :, input_start_y_pad:input_end_y_pad, input_start_x_pad:input_end_x_pad]
-
-                # upscale tile
-                try:
-                    with torch.no_grad():
-                        output_tile = self.model(input_tile)
-                except Exception as error:
-                    print('Error', error)
-                print(f'\tTile {tile_idx}/{tiles_x * tiles_y}')
-
-                # output tile area on total image
-                output_start_x = input_start_x * self.scale
-                output_end_x = input_end_x * self.scale
-                output_start_y = input_start_y * self.scale
-                output_end_y = input_end_y * self.scale
-
-                # output tile area without padding
-                output_start_x_tile = (input_start_x - input_start_x_pad) * self.scale
-                output_end_x_tile = output_start_x_tile + input_tile_width * self.scale
-                output_start_y_tile = (input_start_y - input_start_y_pad) * self.scale
-                output_end_y_tile = output_start_y_tile + input_tile_height * self.scale
-
-                # put tile into output image
-                self.output[:, :, output_start_y:output_end_y,
-                            output_start_x:output_end_x] = output_tile[:, :, output_start_y_tile:output_end_y_tile,
-                                                                       output_start_x_tile:output_end_x_tile]
+        tiles_x = math.ceil(width / tile)
+        tiles_y = math.ceil(height / tile)
+
+        img = F.pad(self.img, (
+            pad, pad + tiles_x * tile - width,
+            pad, pad + tiles_y * tile - height
+        ), 'replicate')
+        size = tile + 2 * pad
+        tiles = img.unfold(2, size, tile).unfold(3, size, tile)
+        tiles = tiles.permute(0, 2, 3, 1, 4, 5).reshape(-1, channel, size, size)
+
+        outputs = []
+        for start in range(0, len(tiles), self.tile_batch_size):
+            outputs.append(self.model(tiles[start:start + self.tile_batch_size]))
+        output = torch.cat(outputs)
+
+        # drop the padding of each tile and put them back together
+        output = output[:, :, pad * scale:(pad + tile) * scale, pad * scale:(pad + tile) * scale]
+        output = output.reshape(batch, tiles_y, tiles_x, channel, tile * scale, tile * scale)
+        output = output.permute(0, 3, 1, 4, 2, 5).reshape(
+            batch, channel, tiles_y * tile * scale, tiles_x * tile * scale
+        )
+        self.output = output[:, :, :height * scale, :width * scale]
 
     def post_process(self):
         # remove extra pad
@@ -170,10 +180,7 @@ class RealESRGANer:
 
         # ------------------- process image (without the alpha channel) ------------------- #
         self.pre_process(img)
-        if self.tile_size > 0:
-            self.tile_process()
-        else:
-            self.process()
+        self.run()
         output_img = self.post_process()
         output_img = output_img.data.squeeze().float().cpu().clamp_(0, 1).numpy()
         output_img = np.transpose(output_img[[2, 1, 0], :, :], (1, 2, 0))
@@ -184,10 +191,7 @@ class RealESRGANer:
         if img_mode == 'RGBA':
             if alpha_upsampler == 'realesrgan':
                 self.pre_process(alpha)
-                if self.tile_size > 0:
-                    self.tile_process()
-                else:
-                    self.process()
+                self.run()
                 output_alpha = self.post_process()
                 output_alpha = output_alpha.data.squeeze().float().cpu().clamp_(0, 1).numpy()
                 output_alpha = np.transpose(output_alpha[[2, 1, 0], :, :], (1, 2, 0))
@@ -216,6 +220,21 @@ class RealESRGANer:
         return output, img_mode
 
 
+    @torch.no_grad()
+    def enhance_batch(self, imgs):
+        """Upscales same sized uint8 BGR images in one forward pass.
+
+        Returns uint8 BGR images at the model scale; there is no outscale or
+        alpha handling here, unlike enhance.
+        """
+        batch = torch.from_numpy(np.stack(imgs)[..., [2, 1, 0]].copy())
+        self.pre_process_tensor(batch.permute(0, 3, 1, 2).float().div(255))
+        self.run()
+        output = self.post_process().float().clamp_(0, 1)
+        output = output[:, [2, 1, 0]].permute(0, 2, 3, 1).mul(255).round()
+        return list(output.byte().cpu().numpy())
+
+
 def load_file_from_url(url, model_dir=None, progress=True, file_name=None):
     """Ref:https://github.com/1adrianb/face-alignment/blob/master/face_alignment/utils.py
     """
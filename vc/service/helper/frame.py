@@ -0,0 +1,97 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+
+class Frame:
+    """The current image, handed from one pipeline stage to the next.
+
+    Stages each want the image in their own form: VQGAN a float tensor on the
+    device, inpainting and MiDaS an RGB array, ESRGAN and the encoder a BGR
+    one. A frame is created from whichever form a stage produced and converts
+    lazily, keeping each form once made, so chaining stages never goes
+    through a PNG. Files are only written by save(), where one is wanted.
+    """
+    path: Optional[str] = None
+
+    def __init__(
+        self,
+        rgb: np.ndarray = None,
+        tensor: torch.Tensor = None,
+        path: str = None
+    ):
+        self._rgb = rgb
+        self._tensor = tensor
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> 'Frame':
+        return cls(
+            rgb=np.asarray(Image.open(path).convert('RGB')),
+            path=path
+        )
+
+    @classmethod
+    def from_rgb(cls, rgb: np.ndarray) -> 'Frame':
+        """From an HxWx3 (or 4, alpha is dropped) uint8 RGB array."""
+        return cls(rgb=np.ascontiguousarray(rgb[..., :3]))
+
+    @classmethod
+    def from_bgr(cls, bgr: np.ndarray) -> 'Frame':
+        return cls(rgb=cv2.cvtColor(bgr[..., :3], cv2.COLOR_BGR2RGB))
+
+    @classmethod
+    def from_tensor(cls, tensor: torch.Tensor) -> 'Frame':
+        """From a 3xHxW float tensor in [0, 1], left on its device."""
+        return cls(tensor=tensor.detach())
+
+    @property
+    def width(self) -> int:
+        if self._rgb is not None:
+            return self._rgb.shape[1]
+        return self._tensor.shape[-1]
+
+    @property
+    def height(self) -> int:
+        if self._rgb is not None:
+            return self._rgb.shape[0]
+        return self._tensor.shape[-2]
+
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            # truncates like torchvision's to_pil_image, so saved frames
+            # match what the service used to write
+            self._rgb = (
+                self._tensor.float().clamp(0, 1).mul(255).byte()
+                .permute(1, 2, 0).cpu().numpy()
+            )
+        return self._rgb
+
+    def bgr(self) -> np.ndarray:
+        return cv2.cvtColor(self.rgb(), cv2.COLOR_RGB2BGR)
+
+    def tensor(self, device: torch.device = None) -> torch.Tensor:
+        if self._tensor is None:
+            self._tensor = torch.from_numpy(self.rgb()).permute(2, 0, 1).float().div(255)
+        if device is not None and self._tensor.device != device:
+            self._tensor = self._tensor.to(device)
+        return self._tensor
+
+    def pil(self) -> Image.Image:
+        return Image.fromarray(self.rgb())
+
+    def save(self, path: str, **kwargs) -> str:
+        """Writes the frame out; kwargs are passed on to PIL."""
+        self.pil().save(path, **kwargs)
+        self.path = path
+        return path
+
+    def __repr__(self):
+        return 'Frame(%sx%s%s)' % (
+            self.width,
+            self.height,
+            ', %s' % self.path if self.path else ''
+        )
@@ -45,7 +45,8 @@ def sparse_bilateral_filtering(
             args,
             discontinuity_map=discontinuity_map,
             mask=mask,
-            window_size=window_size
+            window_size=window_size,
+            backend=getattr(args, 'bilateral_backend', 'numpy')
         )
 
     return save_images, save_depths
@@ -111,13 +112,15 @@ def vis_depth_discontinuity(
         return [u_over, b_over, l_over, r_over]
 
 
-def bilateral_filter(
+def bilateral_filter_loop(
     depth,
     args,
     discontinuity_map=None,
     mask=None,
     window_size=False
 ):
+    """Reference per-pixel implementation, kept for benchmarking against
+    bilateral_filter."""
     sigma_s = args.sigma_s
     sigma_r = args.sigma_r
     if window_size == False:
@@ -240,6 +243,132 @@ def bilateral_filter(
     return output
 
 
+def bilateral_filter(
+    depth,
+    args,
+    discontinuity_map=None,
+    mask=None,
+    window_size=False,
+    backend='numpy',
+    chunk_size=65536
+):
+    """Weighted-median filter over every window_size x window_size patch.
+
+    Produces the same output as bilateral_filter_loop, but gathers all the
+    patches that need filtering and sorts, accumulates and searches them in
+    batches of chunk_size pixels. backend='torch' runs the batches on the
+    active device.
+    """
+    sigma_s = args.sigma_s
+    sigma_r = args.sigma_r
+    if window_size == False:
+        window_size = args.filter_size
+    midpt = window_size // 2
+    ax = np.arange(-midpt, midpt + 1.)
+    xx, yy = np.meshgrid(ax, ax)
+    spatial_term = np.exp(-(xx ** 2 + yy ** 2) / (2. * sigma_s ** 2)).ravel()
+
+    # padding
+    depth = depth[1:-1, 1:-1]
+    depth = np.pad(depth, ((1, 1), (1, 1)), 'edge')
+    pad_depth = np.pad(depth, (midpt, midpt), 'edge')
+    output = depth.copy()
+    window = [window_size, window_size]
+
+    pad_depth_patches = rolling_window(pad_depth, window, [1, 1])
+    pH, pW = pad_depth_patches.shape[:2]
+
+    # work out which pixels are filtered at all
+    todo = np.ones((pH, pW), dtype=bool)
+    if discontinuity_map is not None:
+        discontinuity_map = discontinuity_map[1:-1, 1:-1]
+        discontinuity_map = np.pad(discontinuity_map, ((1, 1), (1, 1)), 'edge')
+        pad_discontinuity_map = np.pad(
+            discontinuity_map,
+            (midpt, midpt),
+            'edge'
+        )
+        pad_discontinuity_hole = 1 - pad_discontinuity_map
+        pad_discontinuity_patches = rolling_window(
+            pad_discontinuity_map,
+            window,
+            [1, 1]
+        )
+        pad_discontinuity_hole_patches = rolling_window(
+            pad_discontinuity_hole,
+            window,
+            [1, 1]
+        )
+        todo &= pad_discontinuity_patches.any(axis=(2, 3))
+        if mask is not None:
+            todo &= mask[:pH, :pW] != 0
+            pad_mask = np.pad(mask, (midpt, midpt), 'constant')
+            pad_mask_patches = rolling_window(pad_mask, window, [1, 1])
+
+    rows, cols = np.nonzero(todo)
+    for start in range(0, len(rows), chunk_size):
+        r = rows[start:start + chunk_size]
+        c = cols[start:start + chunk_size]
+        depth_patches = pad_depth_patches[r, c].reshape(len(r), -1)
+        if discontinuity_map is not None:
+            coef = pad_discontinuity_hole_patches[r, c].reshape(
+                len(r),
+                -1
+            ).astype(np.float32)
+            if mask is not None:
+                coef = coef * pad_mask_patches[r, c].reshape(len(r), -1)
+        else:
+            patch_midpts = depth_patches[:, window_size ** 2 // 2, None]
+            coef = spatial_term * np.exp(
+                -(depth_patches - patch_midpts) ** 2 / (2. * sigma_r ** 2)
+            )
+
+        if backend == 'torch':
+            output[r, c] = _weighted_median_torch(depth_patches, coef)
+        else:
+            output[r, c] = _weighted_median(depth_patches, coef)
+
+    return output
+
+
+def _weighted_median(depth_patches, coef):
+    n, k = depth_patches.shape
+    midpts = depth_patches[:, k // 2]
+    empty = coef.max(axis=1) == 0
+    coef = coef / np.where(empty, 1, coef.sum(axis=1))[:, None].astype(coef.dtype)
+
+    depth_order = depth_patches.argsort(axis=1)
+    sorted_depth = np.take_along_axis(depth_patches, depth_order, axis=1)
+    cum_coef = np.cumsum(np.take_along_axis(coef, depth_order, axis=1), axis=1)
+
+    # == np.digitize(0.5, cum_coef) for each (non-decreasing) row
+    ind = np.minimum((cum_coef <= 0.5).sum(axis=1), k - 1)
+    medians = sorted_depth[np.arange(n), ind]
+
+    return np.where(empty, midpts, medians)
+
+
+def _weighted_median_torch(depth_patches, coef):
+    import torch
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    depth_patches = torch.from_numpy(np.ascontiguousarray(depth_patches)).to(device)
+    coef = torch.from_numpy(np.ascontiguousarray(coef)).to(device)
+
+    n, k = depth_patches.shape
+    midpts = depth_patches[:, k // 2]
+    empty = coef.max(dim=1).values == 0
+    sums = torch.where(empty, torch.ones_like(coef[:, 0]), coef.sum(dim=1))
+    coef = coef / sums[:, None]
+
+    sorted_depth, depth_order = depth_patches.sort(dim=1)
+    cum_coef = torch.gather(coef, 1, depth_order).cumsum(dim=1)
+    ind = (cum_coef <= 0.5).sum(dim=1).clamp(max=k - 1)
+    medians = sorted_depth.gather(1, ind[:, None]).squeeze(1)
+
+    return torch.where(empty, midpts, medians).cpu().numpy()
+
+
 def rolling_window(a, window, strides):
     assert len(a.shape) == len(window) == len(
         strides
@@ -0,0 +1,967 @@
+import copy
+
+import cv2
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    import cynetworkx as netx
+except ImportError:
+    import networkx as netx
+
+from vc.service.helper.inpainting.mesh_tools import relabel_node
+
+# the order update_status looks at the cross neighbours of a pixel in
+CROSS = ((1, 0), (-1, 0), (0, -1), (0, 1))
+
+
+def shift(a, dx, dy):
+    """a at every pixel offset by (dx, dy), zero past the image border."""
+    H, W = a.shape
+    shifted = np.zeros_like(a)
+    shifted[max(-dx, 0):H - max(dx, 0), max(-dy, 0):W - max(dy, 0)] = \
+        a[max(dx, 0):H + min(dx, 0), max(dy, 0):W + min(dy, 0)]
+    return shifted
+
+
+class LayeredDepthImage:
+    """Array-backed layered depth image.
+
+    Holds one value per pixel and layer for depth, colour and disparity, plus
+    boolean masks for the right/down neighbour connections, so that building
+    the initial mesh, tearing it at depth discontinuities, dropping small
+    islands, grouping depth edges, reassigning floating islands and
+    reconnecting dangling edge pixels all work on arrays. Arrays are indexed
+    in un-padded pixel coordinates; graph nodes are offset by the
+    extrapolation border.
+
+    The mesh keeps one node per pixel until fill_missing_node, so to_graph()
+    only materialises the networkx graph once the second grouping of depth
+    edges is done. Nodes and connections are numbered in the order they were
+    (re)created, so it comes out in the node and neighbour order the graph
+    stages would have left, which the later stages depend on.
+    """
+
+    def __init__(self, depth, image, int_mtx, extrapolation_thickness):
+        H, W = depth.shape[:2]
+        self.noext_H, self.noext_W = H, W
+        self.hoffset = self.woffset = extrapolation_thickness
+        self.H = H + 2 * extrapolation_thickness
+        self.W = W + 2 * extrapolation_thickness
+        self.cam_param = int_mtx
+
+        # every pixel starts out on the first layer
+        self.layer = np.zeros((H, W), dtype=np.int8)
+        self.depth = -depth
+        self.color = image
+        self.disp = 1. / (-depth)
+        # the disparity info_on_pix holds, which not every stage updates
+        self.info_disp = self.disp.copy()
+        self.valid = np.ones((H, W), dtype=bool)
+
+        # right[x, y]: (x, y) -- (x, y + 1); down[x, y]: (x, y) -- (x + 1, y)
+        self.right = np.zeros((H, W), dtype=bool)
+        self.right[:, :-1] = True
+        self.down = np.zeros((H, W), dtype=bool)
+        self.down[:-1, :] = True
+
+        # nodes are created row-major, each followed by its down and right
+        # connection. Relabelling a node re-creates it and its connections
+        # at the back, as networkx does; order keeps where info_on_pix has it
+        index = np.arange(H * W).reshape(H, W)
+        self.order = index.copy()
+        self.node_seq = index.copy()
+        self.down_seq = 2 * index
+        self.right_seq = 2 * index + 1
+        self.seq = 2 * H * W - 1
+
+        # how many torn edges each pixel sits on the near/far side of
+        self.near_count = np.zeros((H, W), dtype=np.int32)
+        self.far_count = np.zeros((H, W), dtype=np.int32)
+
+        # whether a node has a near/far/edge_id attribute at all, as the
+        # graph stages tell a missing one apart from one set to None
+        self.has_near = np.zeros((H, W), dtype=bool)
+        self.has_far = np.zeros((H, W), dtype=bool)
+        self.has_edge_id = np.zeros((H, W), dtype=bool)
+        # cross neighbours update_status found nearer/farther, as bits in
+        # CROSS order; None until it first runs
+        self.near = None
+        self.far = None
+        # depth edge of each pixel from group_edges, -1 for none
+        self.edge_id = np.full((H, W), -1, dtype=np.int64)
+
+    def tear_edges(self, threshold):
+        H, W = self.noext_H, self.noext_W
+        depth, disp = self.depth, self.disp
+
+        right_torn = np.zeros((H, W), dtype=bool)
+        right_torn[:, :-1] = self.right[:, :-1] & (
+            np.abs(disp[:, :-1] - disp[:, 1:]) > threshold
+        )
+        down_torn = np.zeros((H, W), dtype=bool)
+        down_torn[:-1, :] = self.down[:-1, :] & (
+            np.abs(disp[:-1, :] - disp[1:, :]) > threshold
+        )
+
+        # the pixel closer to the camera is "near"; on a tie the second one
+        first_near = np.zeros((H, W), dtype=bool)
+        first_near[:, :-1] = np.abs(depth[:, :-1]) < np.abs(depth[:, 1:])
+        self.count_torn(right_torn, first_near, (0, 1))
+        first_near = np.zeros((H, W), dtype=bool)
+        first_near[:-1, :] = np.abs(depth[:-1, :]) < np.abs(depth[1:, :])
+        self.count_torn(down_torn, first_near, (1, 0))
+        self.has_near = self.near_count > 0
+        self.has_far = self.far_count > 0
+
+        # a connection with torn connections either side of it is dangling
+        right_dangling = np.zeros((H, W), dtype=bool)
+        right_dangling[1:-1, :-1] = (
+            right_torn[:-2, :-1]
+            & right_torn[2:, :-1]
+            & ~right_torn[1:-1, :-1]
+        )
+        down_dangling = np.zeros((H, W), dtype=bool)
+        down_dangling[:-1, 1:-1] = (
+            down_torn[:-1, :-2]
+            & down_torn[:-1, 2:]
+            & ~down_torn[:-1, 1:-1]
+        )
+
+        self.right &= ~(right_torn | right_dangling)
+        self.down &= ~(down_torn | down_dangling)
+
+        return self
+
+    def count_torn(self, torn, first_near, offset):
+        dx, dy = offset
+        H, W = torn.shape
+        xs, ys = np.nonzero(torn)
+        near = first_near[xs, ys]
+        nx = np.where(near, xs, xs + dx)
+        ny = np.where(near, ys, ys + dy)
+        fx = np.where(near, xs + dx, xs)
+        fy = np.where(near, ys + dy, ys)
+        np.add.at(self.far_count, (nx, ny), 1)
+        np.add.at(self.near_count, (fx, fy), 1)
+
+    def connected_components(self):
+        H, W = self.noext_H, self.noext_W
+        index = np.arange(H * W).reshape(H, W)
+        right = self.right & self.valid
+        right[:, :-1] &= self.valid[:, 1:]
+        down = self.down & self.valid
+        down[:-1, :] &= self.valid[1:, :]
+        rows = np.concatenate([index[right], index[down]])
+        cols = np.concatenate([index[right] + 1, index[down] + W])
+        adjacency = coo_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+            shape=(H * W, H * W)
+        )
+        _, labels = connected_components(adjacency, directed=False)
+        labels = labels.reshape(H, W)
+        labels[~self.valid] = -1
+        return labels
+
+    def remove_small_components(self, min_node_in_cc):
+        labels = self.connected_components()
+        sizes = np.bincount(labels[self.valid])
+        small = self.valid.copy()
+        small[self.valid] = sizes[labels[self.valid]] < min_node_in_cc
+
+        self.valid &= ~small
+        self.right[:, :-1] &= self.valid[:, :-1] & self.valid[:, 1:]
+        self.right[:, -1] = False
+        self.down[:-1, :] &= self.valid[:-1, :] & self.valid[1:, :]
+        self.down[-1, :] = False
+
+        return self
+
+    def connections(self, dx, dy):
+        """Whether each pixel is connected to its cross neighbour at (dx, dy)."""
+        if dx == 0:
+            return self.right if dy > 0 else shift(self.right, 0, -1)
+        return self.down if dx > 0 else shift(self.down, -1, 0)
+
+    def update_status(self, depth=None):
+        """Finds the nearer and farther cross neighbours of each node, as mesh.update_status.
+
+        Clears the depth edge ids. When given the padded depth map, it is
+        synced with the node depths in place.
+        """
+        H, W = self.noext_H, self.noext_W
+        self.edge_id[:] = -1
+        self.near = np.zeros((H, W), dtype=np.uint8)
+        self.far = np.zeros((H, W), dtype=np.uint8)
+
+        magnitude = np.abs(self.depth)
+        for bit, (dx, dy) in enumerate(CROSS):
+            torn = (
+                self.valid
+                & shift(self.valid, dx, dy)
+                & ~self.connections(dx, dy)
+            )
+            nearer = magnitude > shift(magnitude, dx, dy)
+            self.near |= (torn & nearer).astype(np.uint8) << bit
+            self.far |= (torn & ~nearer).astype(np.uint8) << bit
+        self.has_near |= self.near > 0
+        self.has_far |= self.far > 0
+
+        if depth is not None:
+            xs, ys = np.nonzero(self.valid)
+            px, py = xs + self.hoffset, ys + self.woffset
+            stale = depth[px, py] != np.abs(self.depth[xs, ys])
+            xs, ys, px, py = xs[stale], ys[stale], px[stale], py[stale]
+            self.info_disp[xs, ys] = 1. / self.depth[xs, ys]
+            depth[px, py] = np.abs(self.depth[xs, ys])
+
+        return self
+
+    def group_edges(self, threshold, remove_conflict_ordinal=False):
+        """Groups the discontinuity pixels into depth edges, as mesh.group_edges.
+
+        Returns the depth edges and the graph of discontinuity pixels they
+        are the connected components of, built in the order mesh.group_edges
+        builds it. Only for the single layer mesh, where no pixel has
+        must_connect; remove_conflict_ordinal needs update_status to have run.
+        """
+        H, W = self.noext_H, self.noext_W
+        discont_graph = netx.Graph()
+        if H < 3 or W < 3:
+            return [], discont_graph
+
+        right, down = self.right, self.down
+        degree = right.astype(np.int8) + down
+        degree[:, 1:] += right[:, :-1]
+        degree[1:, :] += down[:-1, :]
+        low = self.valid & (degree < 4)
+
+        def at(a, dx, dy):
+            # a at every inner pixel offset by (dx, dy)
+            return a[1 + dx:H - 1 + dx, 1 + dy:W - 1 + dy]
+
+        def connected(dx, dy, ox=0, oy=0):
+            # (x + ox, y + oy) -- (x + ox + dx, y + oy + dy)
+            if dx == 0:
+                return at(right, ox, oy + min(dy, 0))
+            return at(down, ox + min(dx, 0), oy)
+
+        def created(dx, dy, ox=0, oy=0):
+            # when that connection was created
+            if dx == 0:
+                return at(self.right_seq, ox, oy + min(dy, 0))
+            return at(self.down_seq, ox + min(dx, 0), oy)
+
+        def shares(bits, dx, dy):
+            # the pixel and its diagonal (dx, dy) list a common cross
+            # neighbour in bits
+            def lists(ox, oy, ex, ey):
+                bit = CROSS.index((ex, ey))
+                return ((at(bits, ox, oy) >> bit) & 1).astype(bool)
+
+            return (
+                (lists(0, 0, dx, 0) & lists(dx, dy, 0, -dy))
+                | (lists(0, 0, 0, dy) & lists(dx, dy, -dx, 0))
+            )
+
+        # pixels off the image border with a torn connection
+        node = at(low, 0, 0)
+        index = np.arange(H * W).reshape(H, W)
+        events = []
+
+        def add(edge, phase, dx, dy, order=0, rank=0):
+            # discont_graph gains the pixel at (dx, dy) and its connection to
+            # node, in node order, then phase, anchor rank and order
+            events.append(np.stack([
+                at(self.node_seq, 0, 0)[edge],
+                np.full(np.count_nonzero(edge), phase),
+                np.broadcast_to(rank, edge.shape)[edge],
+                np.broadcast_to(order, edge.shape)[edge],
+                at(index, 0, 0)[edge],
+                at(index, dx, dy)[edge],
+            ]))
+
+        add(node, 0, 0, 0)
+        for dx, dy in CROSS:
+            add(
+                node & connected(dx, dy) & at(low, dx, dy),
+                1,
+                dx,
+                dy,
+                created(dx, dy)
+            )
+
+        inverse = np.abs(1. / self.depth)
+        anchored = {}
+        for dx in (1, -1):
+            for dy in (1, -1):
+                # reached through a fully connected cross neighbour, and not
+                # next to a discontinuous one it is connected to
+                invalid = (
+                    (connected(dx, 0) & at(low, dx, 0) & connected(0, dy, dx, 0))
+                    | (connected(0, dy) & at(low, 0, dy) & connected(dx, 0, 0, dy))
+                )
+                close = ~(at(inverse, 0, 0) - at(inverse, dx, dy) > threshold)
+                if self.near is not None:
+                    close |= shares(self.far, dx, dy) & shares(self.near, dx, dy)
+                joins = node & at(low, dx, dy) & ~invalid & close
+                anchored[(dx, dy)] = (
+                    joins & connected(dx, 0) & (at(degree, dx, 0) == 4),
+                    joins & connected(0, dy) & (at(degree, 0, dy) == 4),
+                )
+
+        # mesh.group_edges goes through the anchors of a pixel as a set, so
+        # where diagonals join through more than one, the set orders them
+        used = {ne: np.zeros(node.shape, dtype=np.int8) for ne in CROSS}
+        for (dx, dy), (first, second) in anchored.items():
+            used[(dx, 0)] |= first
+            used[(0, dy)] |= second
+        rank = {ne: np.zeros(node.shape, dtype=np.int64) for ne in CROSS}
+        for x, y in zip(*np.nonzero(sum(used.values()) > 1)):
+            key = self.node_key(x + 1, y + 1, self.depth[x + 1, y + 1])
+            anchors = set()
+            for ne in self.neighbors(key):
+                if len(self.neighbors(ne)) == 4:
+                    anchors.add(ne)
+            for i, ne in enumerate(anchors):
+                rank[(ne[0] - key[0], ne[1] - key[1])][x, y] = i
+        for (dx, dy), (first, second) in anchored.items():
+            add(first, 2, dx, dy, created(0, dy, dx, 0), rank[(dx, 0)])
+            add(second, 2, dx, dy, created(dx, 0, 0, dy), rank[(0, dy)])
+
+        events = np.concatenate(events, axis=1)
+        events = events[:, np.lexsort(events[3::-1])]
+        nodes = self.node_keys(*np.divmod(events[4], W))
+        others = self.node_keys(*np.divmod(events[5], W))
+        for node_key, other, own in zip(nodes, others, events[4] == events[5]):
+            if own:
+                discont_graph.add_node(node_key)
+            else:
+                discont_graph.add_edge(other, node_key)
+
+        discont_ccs = [*netx.connected_components(discont_graph)]
+
+        if remove_conflict_ordinal:
+            feats = {
+                'near': (self.near, self.has_near),
+                'far': (self.far, self.has_far),
+            }
+
+            def key_exist(node, feat):
+                return feats[feat][0][self.pixel(node)] > 0
+
+            def pop(node, feat):
+                for a in feats[feat]:
+                    a[self.pixel(node)] = 0
+
+            new_discont_ccs = []
+            for discont_cc in discont_ccs:
+                near_flag = False
+                far_flag = False
+                for discont_node in discont_cc:
+                    near_flag = True if key_exist(discont_node, 'far') else near_flag
+                    far_flag = True if key_exist(discont_node, 'near') else far_flag
+                    if far_flag and near_flag:
+                        break
+                if not (far_flag and near_flag):
+                    new_discont_ccs.append(discont_cc)
+                    continue
+
+                for discont_node in discont_cc:
+                    discont_graph.nodes[discont_node]['ordinal'] = np.sum(
+                        np.array([
+                            key_exist(discont_node, 'far'),
+                            key_exist(discont_node, 'near')
+                        ]) * np.array([-1, 1])
+                    )
+                remove_nodes, remove_edges = [], []
+                for discont_node in discont_cc:
+                    ordinal_relation = np.sum([
+                        discont_graph.nodes[xx]['ordinal']
+                        for xx in discont_graph.neighbors(discont_node)
+                    ])
+                    near_side = discont_graph.nodes[discont_node]['ordinal'] <= 0
+                    if abs(ordinal_relation) < len(
+                        [*discont_graph.neighbors(discont_node)]
+                    ):
+                        remove_nodes.append(discont_node)
+                        for ne_node in discont_graph.neighbors(discont_node):
+                            remove_flag = (
+                                (near_side and not key_exist(ne_node, 'far'))
+                                or (not near_side and not key_exist(ne_node, 'near'))
+                            )
+                            remove_edges += [
+                                (discont_node, ne_node)
+                            ] if remove_flag else []
+                    elif near_side and key_exist(discont_node, 'near'):
+                        pop(discont_node, 'near')
+                    elif not near_side and key_exist(discont_node, 'far'):
+                        pop(discont_node, 'far')
+                discont_graph.remove_edges_from(remove_edges)
+                sub_mesh = discont_graph.subgraph(list(discont_cc)).copy()
+                for sub_discont_cc in netx.connected_components(sub_mesh):
+                    sub_discont_nodes = list(sub_discont_cc)
+                    if (
+                        len(sub_discont_nodes) == 1
+                        and sub_discont_nodes[0] in remove_nodes
+                        and key_exist(sub_discont_nodes[0], 'far')
+                    ):
+                        pop(sub_discont_nodes[0], 'far')
+                    new_discont_ccs.append(sub_discont_cc)
+            discont_ccs = new_discont_ccs
+
+        for edge_id, edge_cc in enumerate(discont_ccs):
+            for node in edge_cc:
+                self.edge_id[self.pixel(node)] = edge_id
+                self.has_edge_id[self.pixel(node)] = True
+
+        return discont_ccs, discont_graph
+
+    def reassign_floating_island(self, depth):
+        """Fills in the pixels dropped as small islands, as mesh.reassign_floating_island.
+
+        Each island takes its depth from the depth edge it borders most,
+        propagated inwards. depth is the padded depth map, updated in place.
+        """
+        H, W = self.noext_H, self.noext_W
+        lost = np.zeros((self.H, self.W), dtype=np.uint8)
+        lost[self.hoffset:self.hoffset + H, self.woffset:self.woffset + W] = ~self.valid
+        # labelled at the padded size, so islands come in the same order
+        _, labels = cv2.connectedComponents(lost, connectivity=4)
+        labels = labels[self.hoffset:self.hoffset + H, self.woffset:self.woffset + W]
+
+        pixels = np.flatnonzero(labels)
+        pixels = pixels[np.argsort(labels.flat[pixels], kind='stable')]
+        counts = np.bincount(labels.flat[pixels])[1:]
+
+        def cross(x, y):
+            return (x + 1, y), (x - 1, y), (x, y - 1), (x, y + 1)
+
+        for island in np.split(pixels, np.cumsum(counts)[:-1]):
+            island = list(zip(*np.unravel_index(island, (H, W))))
+            island = [(int(x), int(y)) for x, y in island]
+
+            surr_edge_ids = {}
+            for x, y in island:
+                for nx, ny in cross(x, y):
+                    if (
+                        0 <= nx < H and 0 <= ny < W
+                        and self.valid[nx, ny]
+                        and self.edge_id[nx, ny] >= 0
+                    ):
+                        surr_edge_ids.setdefault(
+                            self.edge_id[nx, ny], []
+                        ).append((nx, ny))
+            if not surr_edge_ids:
+                continue
+
+            edge_pixels = sorted(
+                surr_edge_ids.values(),
+                key=len,
+                reverse=True
+            )[0]
+            known = {(x, y): self.depth[x, y] for x, y in edge_pixels}
+            while island:
+                remaining = []
+                for x, y in island:
+                    real_nes = [ne for ne in cross(x, y) if ne in known]
+                    if not real_nes:
+                        remaining.append((x, y))
+                        continue
+                    reassign_depth = np.mean([known[ne] for ne in real_nes])
+                    known[(x, y)] = reassign_depth
+                    depth[x + self.hoffset, y + self.woffset] = -reassign_depth
+
+                    # a new node without near, far or edge_id, connected
+                    # after everything else
+                    self.valid[x, y] = True
+                    self.depth[x, y] = reassign_depth
+                    self.disp[x, y] = self.info_disp[x, y] = 1. / reassign_depth
+                    self.has_near[x, y] = self.has_far[x, y] = False
+                    self.has_edge_id[x, y] = False
+                    self.order[x, y] = self.node_seq[x, y] = self.next_seq()
+                    for nx, ny in real_nes:
+                        mask, seq, at = self.connection(x, y, nx - x, ny - y)
+                        mask[at] = True
+                        seq[at] = self.next_seq()
+                if len(remaining) == len(island):
+                    # nothing left borders a known depth
+                    break
+                island = remaining
+
+        return self
+
+    def remove_dangling(self, edge_ccs, edge_mesh, depth):
+        """Reconnects dangling depth edge pixels, as mesh.remove_dangling.
+
+        Takes the depth edges and their graph from group_edges and updates
+        both along with the arrays; depth is the padded depth map, updated in
+        place. Only pixels on single pixel or dangling depth edges are
+        visited, so this follows mesh.remove_dangling node by node, quirks
+        included.
+        """
+        node_count = np.count_nonzero(self.valid)
+
+        def existing(xys):
+            return [
+                node
+                for node in (self.node_at(x, y) for x, y in xys)
+                if node is not None
+            ]
+
+        def eight(hx, hy):
+            return [
+                (hx + 1, hy),
+                (hx - 1, hy),
+                (hx, hy + 1),
+                (hx, hy - 1),
+                (hx + 1, hy + 1),
+                (hx - 1, hy - 1),
+                (hx - 1, hy + 1),
+                (hx + 1, hy - 1)
+            ]
+
+        tmp_edge_ccs = copy.deepcopy(edge_ccs)
+        for edge_cc_id, valid_edge_cc in enumerate(tmp_edge_ccs):
+            if len(valid_edge_cc) > 1 or len(valid_edge_cc) == 0:
+                continue
+            single_edge_node = [*valid_edge_cc][0]
+            hx, hy, hz = single_edge_node
+            eight_nes = set(existing(eight(hx, hy)))
+            four_nes = existing(eight(hx, hy)[:4])
+            ccs = netx.connected_components(self.subgraph(eight_nes, node_count))
+            four_ccs = []
+            for cc_id, _cc in enumerate(ccs):
+                four_ccs.append(set())
+                for cc_node in _cc:
+                    if abs(cc_node[0] - hx) + abs(cc_node[1] - hy) < 2:
+                        four_ccs[cc_id].add(cc_node)
+            largest_cc = sorted(
+                four_ccs,
+                key=lambda x: (len(x), -np.sum([abs(xx[2] - hz) for xx in x]))
+            )[-1]
+            if len(largest_cc) < 2:
+                for ne in four_nes:
+                    self.connect(single_edge_node, ne)
+            else:
+                self.disconnect(single_edge_node)
+                new_depth = np.mean([xx[2] for xx in largest_cc])
+                new_node = (hx, hy, new_depth)
+                # as refresh_node, which only leaves edge_mesh behind
+                self.relabel(single_edge_node, new_depth)
+                self.info_disp[self.pixel(new_node)] = 1. / new_depth
+                edge_ccs[edge_cc_id] = {new_node}
+                for ne in largest_cc:
+                    self.connect(new_node, ne)
+
+        mark = np.zeros((self.H, self.W))
+        bord_up, bord_down = self.hoffset, self.hoffset + self.noext_H
+        bord_left, bord_right = self.woffset, self.woffset + self.noext_W
+        for edge_cc in edge_ccs:
+            for edge_node in edge_cc:
+                if not (
+                    bord_up <= edge_node[0] < bord_down - 1
+                    and bord_left <= edge_node[1] < bord_right - 1
+                ):
+                    continue
+
+                neighbors = self.neighbors(edge_node)
+                if len(neighbors) >= 3:
+                    continue
+                elif len(neighbors) <= 1:
+                    mark[edge_node[0], edge_node[1]] += len(neighbors) + 1
+                else:
+                    dan_ne_node_a, dan_ne_node_b = neighbors
+                    if abs(dan_ne_node_a[0] - dan_ne_node_b[0]) > 1 or \
+                        abs(dan_ne_node_a[1] - dan_ne_node_b[1]) > 1:
+                        mark[edge_node[0], edge_node[1]] += 3
+
+        conn_0_nodes = existing(zip(*np.where(mark == 1)))
+        conn_1_nodes = existing(zip(*np.where(mark == 2)))
+
+        for node in conn_0_nodes:
+            hx, hy = node[0], node[1]
+            four_nes = existing(eight(hx, hy)[:4])
+            re_depth = {'value': 0, 'count': 0}
+            for ne in four_nes:
+                self.connect(node, ne)
+                # mesh.remove_dangling averages whichever cc_node the single
+                # pixel edges above went through last
+                re_depth['value'] += cc_node[2]
+                re_depth['count'] += 1.
+            re_depth = re_depth['value'] / re_depth['count']
+            self.update_info(edge_mesh, node, re_depth)
+            depth[node[0], node[1]] = abs(re_depth)
+            mark[node[0], node[1]] = 0
+
+        for node in conn_1_nodes:
+            hx, hy = node[0], node[1]
+            eight_nes = set(existing(eight(hx, hy)))
+            self_nes = set([
+                ne2
+                for ne1 in self.neighbors(node)
+                for ne2 in self.neighbors(ne1)
+                if ne2 in eight_nes
+            ])
+            eight_nes = [*(eight_nes - self_nes)]
+            ccs = netx.connected_components(self.subgraph(eight_nes, node_count))
+            largest_cc = sorted(
+                ccs,
+                key=lambda x: (
+                    len(x),
+                    -np.sum([
+                        abs(xx[0] - node[0]) + abs(xx[1] - node[1])
+                        for xx in x
+                    ])
+                )
+            )[-1]
+
+            self.disconnect(node)
+            re_depth = {'value': 0, 'count': 0}
+            for cc_node in largest_cc:
+                if cc_node[0] == node[0] and cc_node[1] == node[1]:
+                    continue
+                re_depth['value'] += cc_node[2]
+                re_depth['count'] += 1.
+                if abs(cc_node[0] - node[0]) + abs(cc_node[1] - node[1]) < 2:
+                    self.connect(cc_node, node)
+            try:
+                re_depth = re_depth['value'] / re_depth['count']
+            except ZeroDivisionError:
+                re_depth = node[2]
+
+            renode = (node[0], node[1], re_depth)
+            self.update_info(edge_mesh, node, re_depth)
+            depth[node[0], node[1]] = abs(re_depth)
+            mark[node[0], node[1]] = 0
+            self.recursive_add_edge(edge_mesh, renode, mark)
+
+        conn_2_nodes = [
+            node
+            for node in existing(zip(*np.where(mark == 3)))
+            if len(self.neighbors(node)) == 2
+        ]
+        sub_mesh = self.subgraph(conn_2_nodes, node_count)
+        ccs = netx.connected_components(sub_mesh)
+        for cc in ccs:
+            candidate_nodes = [xx for xx in cc if sub_mesh.degree(xx) == 1]
+            for node in candidate_nodes:
+                if not self.has_node(node):
+                    continue
+                ne_node = [xx for xx in self.neighbors(node) if xx not in cc][0]
+                hx, hy = node[0], node[1]
+                eight_nes = set([
+                    xx for xx in existing(eight(hx, hy)) if xx not in cc
+                ])
+                ne_ccs = netx.connected_components(
+                    self.subgraph(eight_nes, node_count)
+                )
+                try:
+                    ne_cc = [ne_cc for ne_cc in ne_ccs if ne_node in ne_cc][0]
+                except IndexError:
+                    # as mesh.remove_dangling, the previous ne_cc stays
+                    pass
+                largest_cc = [
+                    xx
+                    for xx in ne_cc
+                    if abs(xx[0] - node[0]) + abs(xx[1] - node[1]) == 1
+                ]
+                self.disconnect(node)
+                re_depth = {'value': 0, 'count': 0}
+                for cc_node in largest_cc:
+                    re_depth['value'] += cc_node[2]
+                    re_depth['count'] += 1.
+                    self.connect(cc_node, node)
+                try:
+                    re_depth = re_depth['value'] / re_depth['count']
+                except ZeroDivisionError:
+                    re_depth = node[2]
+                renode = (node[0], node[1], re_depth)
+                self.update_info(edge_mesh, node, re_depth)
+                depth[node[0], node[1]] = abs(re_depth)
+                mark[node[0], node[1]] = 0
+                self.recursive_add_edge(edge_mesh, renode, mark)
+                break
+            if len(cc) == 1:
+                node = [node for node in cc][0]
+                hx, hy = node[0], node[1]
+                nine_nes = set(existing([(hx, hy)] + eight(hx, hy)))
+                ne_ccs = netx.connected_components(
+                    self.subgraph(nine_nes, node_count)
+                )
+                for ne_cc in ne_ccs:
+                    if node in ne_cc:
+                        re_depth = {'value': 0, 'count': 0}
+                        for ne in ne_cc:
+                            if abs(ne[0] - node[0]) + abs(ne[1] - node[1]) == 1:
+                                self.connect(node, ne)
+                                re_depth['value'] += ne[2]
+                                re_depth['count'] += 1.
+                        re_depth = re_depth['value'] / re_depth['count']
+                        self.update_info(edge_mesh, node, re_depth)
+                        depth[node[0], node[1]] = abs(re_depth)
+                        mark[node[0], node[1]] = 0
+
+        return self
+
+    def recursive_add_edge(self, edge_mesh, cur_node, mark):
+        """Reconnects the dangling pixels along the depth edge, as mesh_tools.recursive_add_edge."""
+        ne_nodes = [(x[0], x[1]) for x in edge_mesh.neighbors(cur_node)]
+        for node_xy in ne_nodes:
+            node = self.node_at(*node_xy)
+            if mark[node[0], node[1]] != 3:
+                continue
+            mark[node[0], node[1]] = 0
+            self.disconnect(node)
+            self.build_connection(cur_node, node)
+            re_info = dict(depth=0, count=0)
+            for re_ne in self.neighbors(node):
+                re_info['depth'] += re_ne[2]
+                re_info['count'] += 1.
+            try:
+                re_depth = re_info['depth'] / re_info['count']
+            except ZeroDivisionError:
+                re_depth = node[2]
+            re_node = (node_xy[0], node_xy[1], re_depth)
+            self.update_info(edge_mesh, node, re_depth)
+            self.recursive_add_edge(edge_mesh, re_node, mark)
+
+    def build_connection(self, cur_node, dst_node):
+        """As mesh_tools.build_connection."""
+        if (abs(cur_node[0] - dst_node[0]) + abs(cur_node[1] - dst_node[1])) < 2:
+            self.connect(cur_node, dst_node)
+        if abs(cur_node[0] - dst_node[0]) > 1 or abs(cur_node[1] - dst_node[1]) > 1:
+            return
+        for ne_node in self.neighbors(cur_node):
+            if self.has_edge(ne_node, dst_node) or ne_node == dst_node:
+                continue
+            self.build_connection(ne_node, dst_node)
+
+    def update_info(self, edge_mesh, node, depth):
+        """Moves node to depth here and in edge_mesh, as mesh_tools.update_info."""
+        self.relabel(node, depth)
+        relabel_node(edge_mesh, edge_mesh.nodes, node, (node[0], node[1], depth))
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def pixel(self, node):
+        return node[0] - self.hoffset, node[1] - self.woffset
+
+    def node_at(self, x, y):
+        """The node at padded (x, y), or None, as info_on_pix.get((x, y))."""
+        x, y = x - self.hoffset, y - self.woffset
+        if 0 <= x < self.noext_H and 0 <= y < self.noext_W and self.valid[x, y]:
+            return self.node_key(x, y, self.depth[x, y])
+        return None
+
+    def has_node(self, node):
+        x, y = self.pixel(node)
+        return bool(
+            0 <= x < self.noext_H and 0 <= y < self.noext_W
+            and self.valid[x, y]
+            and self.depth[x, y] == node[2]
+        )
+
+    def connection(self, x, y, dx, dy):
+        """The mask and sequence numbers holding (x, y) -- (x + dx, y + dy), and where."""
+        if dx:
+            return self.down, self.down_seq, (min(x, x + dx), y)
+        return self.right, self.right_seq, (x, min(y, y + dy))
+
+    def neighbors(self, node):
+        """The nodes connected to node, in the order networkx would list them."""
+        x, y = self.pixel(node)
+        found = []
+        for dx, dy in CROSS:
+            if 0 <= x + dx < self.noext_H and 0 <= y + dy < self.noext_W:
+                mask, seq, at = self.connection(x, y, dx, dy)
+                if mask[at]:
+                    found.append((
+                        seq[at],
+                        self.node_key(x + dx, y + dy, self.depth[x + dx, y + dy])
+                    ))
+        return [ne for _, ne in sorted(found, key=lambda ne: ne[0])]
+
+    def has_edge(self, node, ne):
+        (x, y), (nx, ny) = self.pixel(node), self.pixel(ne)
+        if not (
+            self.has_node(node)
+            and self.has_node(ne)
+            and abs(nx - x) + abs(ny - y) == 1
+        ):
+            return False
+        mask, _, at = self.connection(x, y, nx - x, ny - y)
+        return bool(mask[at])
+
+    def connect(self, node, ne):
+        """Connects two cross neighbours, as networkx's add_edge would order it."""
+        (x, y), (nx, ny) = self.pixel(node), self.pixel(ne)
+        mask, seq, at = self.connection(x, y, nx - x, ny - y)
+        if not mask[at]:
+            mask[at] = True
+            seq[at] = self.next_seq()
+
+    def disconnect(self, node):
+        x, y = self.pixel(node)
+        for dx, dy in CROSS:
+            if 0 <= x + dx < self.noext_H and 0 <= y + dy < self.noext_W:
+                mask, _, at = self.connection(x, y, dx, dy)
+                mask[at] = False
+
+    def relabel(self, node, depth):
+        """Moves node to depth, as relabel_node re-creates it and its connections."""
+        if depth == node[2]:
+            return
+        x, y = self.pixel(node)
+        self.node_seq[x, y] = self.next_seq()
+        for ne in self.neighbors(node):
+            (nx, ny) = self.pixel(ne)
+            _, seq, at = self.connection(x, y, nx - x, ny - y)
+            seq[at] = self.next_seq()
+        self.depth[x, y] = depth
+
+    def subgraph(self, nodes, node_count):
+        """What mesh.subgraph(nodes).copy() would be, without the attributes.
+
+        networkx goes through the wanted nodes as a set, unless they are
+        half the mesh or more, and connected_components finds them in that
+        order; node_count is the number of nodes in the mesh.
+        """
+        shown = set(node for node in nodes if self.has_node(node))
+        if 2 * len(shown) < node_count:
+            order = list(shown)
+        else:
+            order = sorted(shown, key=lambda node: self.node_seq[self.pixel(node)])
+        sub_mesh = netx.Graph()
+        sub_mesh.add_nodes_from(order)
+        sub_mesh.add_edges_from(
+            (node, ne)
+            for node in order
+            for ne in self.neighbors(node)
+            if ne in shown
+        )
+        return sub_mesh
+
+    def graph_attributes(self):
+        H, W = self.noext_H, self.noext_W
+        cam_param_pix = self.cam_param * np.array([[W], [H], [1.]])
+        return {
+            'H': self.H,
+            'W': self.W,
+            'noext_H': H,
+            'noext_W': W,
+            'cam_param': self.cam_param,
+            'cam_param_pix': cam_param_pix,
+            'cam_param_pix_inv': np.linalg.inv(cam_param_pix),
+            'hoffset': self.hoffset,
+            'woffset': self.woffset,
+            'bord_up': self.hoffset,
+            'bord_down': self.hoffset + H,
+            'bord_left': self.woffset,
+            'bord_right': self.woffset + W,
+        }
+
+    def node_keys(self, xs, ys):
+        # keep the numpy scalars for depth: downstream code relies on numpy
+        # division semantics when it takes 1 / depth
+        return list(zip(
+            (xs + self.hoffset).tolist(),
+            (ys + self.woffset).tolist(),
+            self.depth[xs, ys]
+        ))
+
+    def to_graph(self):
+        H, W = self.noext_H, self.noext_W
+        xs, ys = np.nonzero(self.valid)
+        order = np.argsort(self.node_seq[xs, ys], kind='stable')
+        xs, ys = xs[order], ys[order]
+        keys = self.node_keys(xs, ys)
+
+        def cross_neighbours(bits, count, x, y):
+            if bits is None:
+                # before update_status, as the per-edge bookkeeping left it:
+                # an empty list for an odd count, None for an even one
+                return [] if count[x, y] % 2 else None
+            return [
+                self.node_key(x + dx, y + dy, self.depth[x + dx, y + dy])
+                for bit, (dx, dy) in enumerate(CROSS)
+                if bits[x, y] >> bit & 1
+            ] or None
+
+        def node_attributes(x, y):
+            attributes = {
+                'color': self.color[x, y],
+                'disp': self.disp[x, y],
+                'synthesis': False,
+                'cc_id': set(),
+            }
+            if self.has_near[x, y]:
+                attributes['near'] = cross_neighbours(
+                    self.near,
+                    self.near_count,
+                    x,
+                    y
+                )
+            if self.has_far[x, y]:
+                attributes['far'] = cross_neighbours(
+                    self.far,
+                    self.far_count,
+                    x,
+                    y
+                )
+            if self.has_edge_id[x, y]:
+                edge_id = self.edge_id[x, y]
+                attributes['edge_id'] = int(edge_id) if edge_id >= 0 else None
+            return attributes
+
+        mesh = netx.Graph(**self.graph_attributes())
+        mesh.add_nodes_from(
+            (key, node_attributes(x, y))
+            for key, x, y in zip(keys, xs.tolist(), ys.tolist())
+        )
+
+        # add the connections in the order they were created, which is the
+        # order each node lists its neighbours in
+        node_index = np.full((H, W), -1, dtype=np.int64)
+        node_index[xs, ys] = np.arange(len(keys))
+        right = self.right & self.valid
+        right[:, :-1] &= self.valid[:, 1:]
+        down = self.down & self.valid
+        down[:-1, :] &= self.valid[1:, :]
+        rxs, rys = np.nonzero(right)
+        dxs, dys = np.nonzero(down)
+        sources = np.concatenate([node_index[rxs, rys + 1], node_index[dxs + 1, dys]])
+        targets = np.concatenate([node_index[rxs, rys], node_index[dxs, dys]])
+        created = np.argsort(
+            np.concatenate([self.right_seq[rxs, rys], self.down_seq[dxs, dys]]),
+            kind='stable'
+        )
+        mesh.add_edges_from(
+            (keys[a], keys[b])
+            for a, b in zip(
+                sources[created].tolist(),
+                targets[created].tolist()
+            )
+        )
+
+        return mesh
+
+    def node_key(self, x, y, depth):
+        return x + self.hoffset, y + self.woffset, depth
+
+    def info_on_pix(self):
+        xs, ys = np.nonzero(self.valid)
+        order = np.argsort(self.order[xs, ys], kind='stable')
+        xs, ys = xs[order], ys[order]
+        return {
+            (x + self.hoffset, y + self.woffset): [{
+                'depth': self.depth[x, y],
+                'color': self.color[x, y],
+                'synthesis': False,
+                'disp': self.info_disp[x, y],
+            }]
+            for x, y in zip(xs.tolist(), ys.tolist())
+        }
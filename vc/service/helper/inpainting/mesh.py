@@ -32,6 +32,7 @@ from vc.service.helper.utils import (
     clean_far_edge,
 )
 from vc.service.helper.utils import create_placeholder, refresh_node
+from vc.service.helper.inpainting.ldi import LayeredDepthImage
 from vc.service.helper.inpainting.mesh_tools import (
     get_depth_from_maps,
     get_map_from_ccs,
@@ -59,38 +60,12 @@ from vc.service.helper.inpainting.mesh_tools import (
 # @todo put all in class and clean up
 
 def create_mesh(depth, image, int_mtx, args):
-    H, W, C = image.shape
-    ext_H, ext_W = H + 2 * args.extrapolation_thickness, W + 2 * args.extrapolation_thickness
-    LDI = netx.Graph(H=ext_H, W=ext_W, noext_H=H, noext_W=W, cam_param=int_mtx)
-    xy2depth = {}
-    int_mtx_pix = int_mtx * np.array([[W], [H], [1.]])
-    LDI.graph['cam_param_pix'], LDI.graph[
-        'cam_param_pix_inv'] = int_mtx_pix, np.linalg.inv(int_mtx_pix)
-    disp = 1. / (-depth)
-    LDI.graph['hoffset'], LDI.graph[
-        'woffset'] = args.extrapolation_thickness, args.extrapolation_thickness
-    LDI.graph['bord_up'], LDI.graph['bord_down'] = LDI.graph['hoffset'] + 0, \
-                                                   LDI.graph['hoffset'] + H
-    LDI.graph['bord_left'], LDI.graph['bord_right'] = LDI.graph['woffset'] + 0, \
-                                                      LDI.graph['woffset'] + W
-    for idx in range(H):
-        for idy in range(W):
-            x, y = idx + LDI.graph['hoffset'], idy + LDI.graph['woffset']
-            LDI.add_node(
-                (x, y, -depth[idx, idy]),
-                color=image[idx, idy],
-                disp=disp[idx, idy],
-                synthesis=False,
-                cc_id=set()
-            )
-            xy2depth[(x, y)] = [-depth[idx, idy]]
-    for x, y, d in LDI.nodes:
-        two_nes = [ne for ne in [(x + 1, y), (x, y + 1)] if
-                   ne[0] < LDI.graph['bord_down'] and ne[1] < LDI.graph[
-                       'bord_right']]
-        [LDI.add_edge((ne[0], ne[1], xy2depth[ne][0]), (x, y, d)) for ne in
-         two_nes]
-    LDI = calculate_fov(LDI)
+    LDI = LayeredDepthImage(
+        depth,
+        image,
+        int_mtx,
+        args.extrapolation_thickness
+    )
     image = np.pad(
         image,
         pad_width=((args.extrapolation_thickness, args.extrapolation_thickness),
@@ -107,78 +82,11 @@ def create_mesh(depth, image, int_mtx, args):
         mode='constant'
     )
 
-    return LDI, xy2depth, image, depth
-
-
-def tear_edges(mesh, threshold=0.00025, xy2depth=None):
-    remove_edge_list = []
-    remove_horizon, remove_vertical = np.zeros(
-        (2, mesh.graph['H'], mesh.graph['W'])
-    )
-    mesh_nodes = mesh.nodes
-    for edge in mesh.edges:
-        if abs(
-            mesh_nodes[edge[0]]['disp'] - mesh_nodes[edge[1]]['disp']
-        ) > threshold:
-            remove_edge_list.append((edge[0], edge[1]))
-
-            near, far = edge if abs(edge[0][2]) < abs(edge[1][2]) else edge[
-                                                                       ::-1]
-
-            mesh_nodes[far]['near'] = [] if mesh_nodes[far].get(
-                'near'
-            ) is None else mesh_nodes[far]['near'].append(near)
-            mesh_nodes[near]['far'] = [] if mesh_nodes[near].get(
-                'far'
-            ) is None else mesh_nodes[near]['far'].append(far)
-
-            if near[0] == far[0]:
-                remove_horizon[near[0], np.minimum(near[1], far[1])] = 1
-            elif near[1] == far[1]:
-                remove_vertical[np.minimum(near[0], far[0]), near[1]] = 1
-    mesh.remove_edges_from(remove_edge_list)
-
-    remove_edge_list = []
-
-    dang_horizon = np.where(
-        np.roll(remove_horizon, 1, 0) + np.roll(
-            remove_horizon,
-            -1,
-            0
-        ) - remove_horizon == 2
-    )
-    dang_vertical = np.where(
-        np.roll(remove_vertical, 1, 1) + np.roll(
-            remove_vertical,
-            -1,
-            1
-        ) - remove_vertical == 2
-    )
+    return LDI, image, depth
 
-    horizon_condition = lambda x, y: mesh.graph['bord_up'] + 1 <= x < \
-                                     mesh.graph['bord_down'] - 1
-    vertical_condition = lambda x, y: mesh.graph['bord_left'] + 1 <= y < \
-                                      mesh.graph['bord_right'] - 1
 
-    prjto3d = lambda x, y: (x, y, xy2depth[(x, y)][0])
-
-    node_existence = lambda x, y: mesh.has_node(prjto3d(x, y))
-
-    for x, y in zip(dang_horizon[0], dang_horizon[1]):
-        if horizon_condition(x, y) and node_existence(x, y) and node_existence(
-            x,
-            y + 1
-        ):
-            remove_edge_list.append((prjto3d(x, y), prjto3d(x, y + 1)))
-    for x, y in zip(dang_vertical[0], dang_vertical[1]):
-        if vertical_condition(x, y) and node_existence(x, y) and node_existence(
-            x + 1,
-            y
-        ):
-            remove_edge_list.append((prjto3d(x, y), prjto3d(x + 1, y)))
-    mesh.remove_edges_from(remove_edge_list)
-
-    return mesh
+def tear_edges(LDI: LayeredDepthImage, threshold=0.00025):
+    return LDI.tear_edges(threshold)
 
 
 def calculate_fov(mesh):
@@ -257,49 +165,28 @@ def reproject_3d_int(sx, sy, z, mesh):
     return point_3d
 
 
-def generate_init_node(mesh, args, min_node_in_cc):
-    mesh_nodes = mesh.nodes
-
-    info_on_pix = {}
-
-    ccs = sorted(netx.connected_components(mesh), key=len, reverse=True)
-    remove_nodes = []
-
-    for cc in ccs:
-
-        remove_flag = True if len(cc) < min_node_in_cc else False
-        if remove_flag is False:
-            for (nx, ny, nd) in cc:
-                info_on_pix[(nx, ny)] = [{
-                    'depth': nd,
-                    'color': mesh_nodes[(nx, ny, nd)][
-                        'color'],
-                    'synthesis': False,
-                    'disp': mesh_nodes[(nx, ny, nd)][
-                        'disp']
-                }]
-        else:
-            [remove_nodes.append((nx, ny, nd)) for (nx, ny, nd) in cc]
-
-    for node in remove_nodes:
-        far_nodes = [] if mesh_nodes[node].get('far') is None else \
-            mesh_nodes[node]['far']
-        for far_node in far_nodes:
-            if mesh.has_node(far_node) and mesh_nodes[far_node].get(
-                'near'
-            ) is not None and node in mesh_nodes[far_node]['near']:
-                mesh_nodes[far_node]['near'].remove(node)
-        near_nodes = [] if mesh_nodes[node].get('near') is None else \
-            mesh_nodes[node]['near']
-        for near_node in near_nodes:
-            if mesh.has_node(near_node) and mesh_nodes[near_node].get(
-                'far'
-            ) is not None and node in mesh_nodes[near_node]['far']:
-                mesh_nodes[near_node]['far'].remove(node)
-
-    [mesh.remove_node(node) for node in remove_nodes]
+def generate_init_node(LDI: LayeredDepthImage, args, depth, min_node_in_cc):
+    LDI.remove_small_components(min_node_in_cc)
+    # the first grouping of depth edges only decides which edge each
+    # floating island joins
+    LDI.group_edges(args.depth_threshold)
+    LDI.reassign_floating_island(depth)
+    # the mesh keeps one node per pixel until fill_missing_node adds layers,
+    # so the graph is only built once the depth edges are settled
+    LDI.update_status()
+    edge_ccs, edge_mesh = LDI.group_edges(
+        args.depth_threshold,
+        remove_conflict_ordinal=True
+    )
+    LDI.remove_dangling(edge_ccs, edge_mesh, depth)
+    LDI.update_status(depth)
+    edge_ccs, _ = LDI.group_edges(
+        args.depth_threshold,
+        remove_conflict_ordinal=True
+    )
+    mesh = calculate_fov(LDI.to_graph())
 
-    return mesh, info_on_pix
+    return mesh, LDI.info_on_pix(), depth, edge_ccs
 
 
 def get_neighbors(mesh, node):
@@ -310,15 +197,9 @@ def generate_face(mesh, info_on_pix, args):
     H, W = mesh.graph['H'], mesh.graph['W']
     str_faces = []
     num_node = len(mesh.nodes)
-    ply_flag = args.save_ply
 
-    def out_fmt(input, cur_id_b, cur_id_self, cur_id_a, ply_flag):
-        if ply_flag:
-            input.append(
-                ' '.join(['3', cur_id_b, cur_id_self, cur_id_a]) + '\n'
-            )
-        else:
-            input.append([cur_id_b, cur_id_self, cur_id_a])
+    def out_fmt(input, cur_id_b, cur_id_self, cur_id_a):
+        input.append([cur_id_b, cur_id_self, cur_id_a])
 
     mesh_nodes = mesh.nodes
     for node in mesh_nodes:
@@ -342,16 +223,16 @@ def generate_face(mesh, info_on_pix, args):
                     four_dir_nes['down'].append(store_tuple)
         for node_a, cur_id_a in four_dir_nes['up']:
             for node_b, cur_id_b in four_dir_nes['right']:
-                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a, ply_flag)
+                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a)
         for node_a, cur_id_a in four_dir_nes['right']:
             for node_b, cur_id_b in four_dir_nes['down']:
-                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a, ply_flag)
+                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a)
         for node_a, cur_id_a in four_dir_nes['down']:
             for node_b, cur_id_b in four_dir_nes['left']:
-                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a, ply_flag)
+                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a)
         for node_a, cur_id_a in four_dir_nes['left']:
             for node_b, cur_id_b in four_dir_nes['up']:
-                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a, ply_flag)
+                out_fmt(str_faces, cur_id_b, cur_id_self, cur_id_a)
 
     return str_faces
 
@@ -2932,58 +2813,21 @@ def write_ply(
     depth_feat_model
 ):
     depth = depth.astype(np.float64)
-    input_mesh, xy2depth, image, depth = create_mesh(
+    LDI, image, depth = create_mesh(
         depth,
         image,
         int_mtx,
         args
     )
 
-    input_mesh = tear_edges(input_mesh, args.depth_threshold, xy2depth)
-    input_mesh, info_on_pix = generate_init_node(
-        input_mesh,
+    LDI = tear_edges(LDI, args.depth_threshold)
+    input_mesh, info_on_pix, depth, edge_ccs = generate_init_node(
+        LDI,
         args,
+        depth,
         min_node_in_cc=200
     )
-    edge_ccs, input_mesh, edge_mesh = group_edges(
-        input_mesh,
-        args,
-        image,
-        remove_conflict_ordinal=False
-    )
-
-    input_mesh, info_on_pix, depth = reassign_floating_island(
-        input_mesh,
-        info_on_pix,
-        image,
-        depth
-    )
-    input_mesh = update_status(input_mesh, info_on_pix)
-    edge_ccs, input_mesh, edge_mesh = group_edges(
-        input_mesh,
-        args,
-        image,
-        remove_conflict_ordinal=True
-    )
-    input_mesh, info_on_pix, edge_mesh, depth, aft_mark = remove_dangling(
-        input_mesh,
-        edge_ccs,
-        edge_mesh,
-        info_on_pix,
-        depth
-    )
-
-    input_mesh, depth, info_on_pix = update_status(
-        input_mesh,
-        info_on_pix,
-        depth
-    )
-    edge_ccs, input_mesh, edge_mesh = group_edges(
-        input_mesh,
-        args,
-        image,
-        remove_conflict_ordinal=True
-    )
+    del LDI
 
     mesh, info_on_pix, depth = fill_missing_node(
         input_mesh,
@@ -3311,13 +3155,8 @@ def write_ply(
     input_mesh.graph['H'] = input_mesh.graph['noext_H']
     input_mesh.graph['W'] = input_mesh.graph['noext_W']
 
-    ply_flag = args.save_ply
-    if ply_flag:
-        node_str_list = []
-    else:
-        node_str_color = []
-        node_str_point = []
-    out_fmt = lambda x, x_flag: str(x) if x_flag else x
+    points = []
+    colors = []
 
     k_00, k_02, k_11, k_12 = \
         input_mesh.graph['cam_param_pix_inv'][0, 0], \
@@ -3331,142 +3170,185 @@ def write_ply(
             pix_depth = pix_info['depth'] if pix_info.get(
                 'real_depth'
             ) is None else pix_info['real_depth']
-            str_pt = [out_fmt(x, ply_flag) for x in reproject_3d_int_detail(
+            point = reproject_3d_int_detail(
                 pix_xy[0], pix_xy[1], pix_depth,
                 k_00, k_02, k_11, k_12, w_offset, h_offset
-            )]
+            )
             if input_mesh.has_node(
                 (pix_xy[0], pix_xy[1], pix_info['depth'])
             ) is False:
                 return False
             if pix_info.get('overlap_number') is not None:
-                str_color = [out_fmt(x, ply_flag) for x in (
-                    pix_info['color'] / pix_info['overlap_number']).astype(
-                    np.uint8
-                ).tolist()]
+                color = (
+                    pix_info['color'] / pix_info['overlap_number']
+                ).astype(np.uint8).tolist()
             else:
-                str_color = [out_fmt(x, ply_flag) for x in
-                             pix_info['color'].tolist()]
+                color = pix_info['color'].tolist()
             if pix_info.get('edge_occlusion'):
-                str_color.append(out_fmt(4, ply_flag))
+                color.append(4)
             else:
                 if pix_info.get('inpaint_id') is None:
-                    str_color.append(out_fmt(1, ply_flag))
+                    color.append(1)
                 else:
-                    str_color.append(
-                        out_fmt(pix_info.get('inpaint_id') + 1, ply_flag)
-                    )
+                    color.append(pix_info.get('inpaint_id') + 1)
             if pix_info.get('modified_border') or pix_info.get(
                 'ext_pixel'
             ):
-                if len(str_color) == 4:
-                    str_color[-1] = out_fmt(5, ply_flag)
+                if len(color) == 4:
+                    color[-1] = 5
                 else:
-                    str_color.append(out_fmt(5, ply_flag))
+                    color.append(5)
             pix_info['cur_id'] = vertex_id
             input_mesh.nodes[(pix_xy[0], pix_xy[1], pix_info['depth'])][
-                'cur_id'] = out_fmt(vertex_id, ply_flag)
+                'cur_id'] = vertex_id
             vertex_id += 1
-            if ply_flag:
-                node_str_list.append(
-                    ' '.join(str_pt) + ' ' + ' '.join(str_color) + '\n'
-                )
-            else:
-                node_str_color.append(str_color)
-                node_str_point.append(str_pt)
+            points.append(point)
+            colors.append(color)
+
+    height = int(input_mesh.graph['H'])
+    width = int(input_mesh.graph['W'])
+    hFov = float(input_mesh.graph['hFov'])
+    vFov = float(input_mesh.graph['vFov'])
+    verts = np.array(points, dtype=np.float32).reshape(-1, 3)
+    colors = np.array(colors, dtype=np.float32).reshape(-1, 4)
+    faces = np.array(
+        generate_face(input_mesh, info_on_pix, args),
+        dtype=np.int32
+    ).reshape(-1, 3)
 
-    str_faces = generate_face(input_mesh, info_on_pix, args)
     if args.save_ply:
         print("Writing mesh file %s ..." % ply_name)
-        with open(ply_name, 'w') as ply_fi:
-            ply_fi.write('ply\n' + 'format ascii 1.0\n')
-            ply_fi.write('comment H ' + str(int(input_mesh.graph['H'])) + '\n')
-            ply_fi.write('comment W ' + str(int(input_mesh.graph['W'])) + '\n')
-            ply_fi.write(
-                'comment hFov ' + str(float(input_mesh.graph['hFov'])) + '\n'
-            )
-            ply_fi.write(
-                'comment vFov ' + str(float(input_mesh.graph['vFov'])) + '\n'
-            )
-            ply_fi.write('element vertex ' + str(len(node_str_list)) + '\n')
-            ply_fi.write(
-                'property float x\n' + \
-                'property float y\n' + \
-                'property float z\n' + \
-                'property uchar red\n' + \
-                'property uchar green\n' + \
-                'property uchar blue\n' + \
-                'property uchar alpha\n'
-            )
-            ply_fi.write('element face ' + str(len(str_faces)) + '\n')
-            ply_fi.write('property list uchar int vertex_index\n')
-            ply_fi.write('end_header\n')
-            ply_fi.writelines(node_str_list)
-            ply_fi.writelines(str_faces)
-        ply_fi.close()
-        return input_mesh
-    else:
-        height = int(input_mesh.graph['H'])
-        width = int(input_mesh.graph['W'])
-        hFov = input_mesh.graph['hFov']
-        vFov = input_mesh.graph['vFov']
-        node_str_color = np.array(node_str_color).astype(np.float32)
-        node_str_color[..., :3] = node_str_color[..., :3] / 255.
-        node_str_point = np.array(node_str_point)
-        str_faces = np.array(str_faces)
-
-        return node_str_point, node_str_color, str_faces, height, width, hFov, vFov
+        write_binary_ply(ply_name, verts, colors, faces, height, width, hFov, vFov)
+
+    colors[..., :3] = colors[..., :3] / 255.
+
+    return verts, colors, faces, height, width, hFov, vFov
+
+
+PLY_VERTEX_DTYPE = np.dtype([
+    ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+    ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ('alpha', 'u1'),
+])
+PLY_FACE_DTYPE = np.dtype([
+    ('count', 'u1'),
+    ('vertex_index', '<i4', (3,)),
+])
+
+
+def write_binary_ply(ply_name, verts, colors, faces, height, width, hFov, vFov):
+    vertex_data = np.empty(len(verts), dtype=PLY_VERTEX_DTYPE)
+    vertex_data['x'], vertex_data['y'], vertex_data['z'] = verts.T
+    rgba = np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+    vertex_data['red'], vertex_data['green'], vertex_data['blue'], \
+        vertex_data['alpha'] = rgba.T
+
+    face_data = np.empty(len(faces), dtype=PLY_FACE_DTYPE)
+    face_data['count'] = 3
+    face_data['vertex_index'] = faces
+
+    header = ''.join([
+        'ply\n',
+        'format binary_little_endian 1.0\n',
+        'comment H %d\n' % height,
+        'comment W %d\n' % width,
+        'comment hFov %r\n' % hFov,
+        'comment vFov %r\n' % vFov,
+        'element vertex %d\n' % len(vertex_data),
+        'property float x\n',
+        'property float y\n',
+        'property float z\n',
+        'property uchar red\n',
+        'property uchar green\n',
+        'property uchar blue\n',
+        'property uchar alpha\n',
+        'element face %d\n' % len(face_data),
+        'property list uchar int vertex_index\n',
+        'end_header\n',
+    ])
+    with open(ply_name, 'wb') as ply_fi:
+        ply_fi.write(header.encode('ascii'))
+        vertex_data.tofile(ply_fi)
+        face_data.tofile(ply_fi)
 
 
 def read_ply(mesh_fi):
-    ply_fi = open(mesh_fi, 'r')
     Height = None
     Width = None
     hFov = None
     vFov = None
     num_vertex = -1
-    while True:
-        line = ply_fi.readline().split('\n')[0]
-        if line.startswith('element vertex'):
-            num_vertex = int(line.split(' ')[-1])
-        elif line.startswith('element face'):
-            num_face = int(line.split(' ')[-1])
-        elif line.startswith('comment'):
-            if line.split(' ')[1] == 'H':
-                Height = int(line.split(' ')[-1].split('\n')[0])
-            if line.split(' ')[1] == 'W':
-                Width = int(line.split(' ')[-1].split('\n')[0])
-            if line.split(' ')[1] == 'hFov':
-                hFov = float(line.split(' ')[-1].split('\n')[0])
-            if line.split(' ')[1] == 'vFov':
-                vFov = float(line.split(' ')[-1].split('\n')[0])
-        elif line.startswith('end_header'):
-            break
-    contents = ply_fi.readlines()
-    vertex_infos = contents[:num_vertex]
-    face_infos = contents[num_vertex:]
-    verts = []
-    colors = []
-    faces = []
-    for v_info in vertex_infos:
-        str_info = [float(v) for v in v_info.split('\n')[0].split(' ')]
-        if len(str_info) == 6:
-            vx, vy, vz, r, g, b = str_info
-        else:
-            vx, vy, vz, r, g, b, hi = str_info
-        verts.append([vx, vy, vz])
-        colors.append([r, g, b, hi])
-    verts = np.array(verts)
-    try:
-        colors = np.array(colors)
+    num_face = -1
+    binary = False
+    with open(mesh_fi, 'rb') as ply_fi:
+        while True:
+            line = ply_fi.readline().decode('ascii').split('\n')[0]
+            if line.startswith('format'):
+                binary = 'binary_little_endian' in line
+            elif line.startswith('element vertex'):
+                num_vertex = int(line.split(' ')[-1])
+            elif line.startswith('element face'):
+                num_face = int(line.split(' ')[-1])
+            elif line.startswith('comment'):
+                if line.split(' ')[1] == 'H':
+                    Height = int(line.split(' ')[-1])
+                if line.split(' ')[1] == 'W':
+                    Width = int(line.split(' ')[-1])
+                if line.split(' ')[1] == 'hFov':
+                    hFov = float(line.split(' ')[-1])
+                if line.split(' ')[1] == 'vFov':
+                    vFov = float(line.split(' ')[-1])
+            elif line.startswith('end_header'):
+                break
+        header_length = ply_fi.tell()
+
+    if binary:
+        vertex_data = np.memmap(
+            mesh_fi,
+            dtype=PLY_VERTEX_DTYPE,
+            mode='r',
+            offset=header_length,
+            shape=(num_vertex,)
+        )
+        face_data = np.memmap(
+            mesh_fi,
+            dtype=PLY_FACE_DTYPE,
+            mode='r',
+            offset=header_length + num_vertex * PLY_VERTEX_DTYPE.itemsize,
+            shape=(num_face,)
+        )
+        verts = np.stack(
+            [vertex_data['x'], vertex_data['y'], vertex_data['z']],
+            axis=-1
+        )
+        colors = np.stack(
+            [
+                vertex_data['red'],
+                vertex_data['green'],
+                vertex_data['blue'],
+                vertex_data['alpha']
+            ],
+            axis=-1
+        ).astype(np.float32)
         colors[..., :3] = colors[..., :3] / 255.
-    except:
-        pass
+        faces = np.array(face_data['vertex_index'])
+
+        return verts, colors, faces, Height, Width, hFov, vFov
 
-    for f_info in face_infos:
-        _, v1, v2, v3 = [int(f) for f in f_info.split('\n')[0].split(' ')]
-        faces.append([v1, v2, v3])
-    faces = np.array(faces)
+    # legacy ASCII meshes
+    with open(mesh_fi, 'r') as ply_fi:
+        ply_fi.seek(header_length)
+        contents = ply_fi.readlines()
+    vertex_infos = np.array(
+        [v_info.split() for v_info in contents[:num_vertex]],
+        dtype=np.float64
+    )
+    verts = vertex_infos[:, :3]
+    colors = vertex_infos[:, 3:].astype(np.float32)
+    colors[..., :3] = colors[..., :3] / 255.
+    faces = np.array(
+        [f_info.split() for f_info in contents[num_vertex:]],
+        dtype=np.int32
+    )[:, 1:]
 
     return verts, colors, faces, Height, Width, hFov, vFov
 
@@ -3744,12 +3626,15 @@ def output_3d_photo_dynamic(
         img = img[o_t:H_c - o_b, o_l:W_c - o_r]
         img = cv2.resize(img, (W_c, H_c), interpolation=cv2.INTER_CUBIC)
 
-    path = args.output_filename
-    if output_dir:
-        path = os.path.join(output_dir, path)
-    print("mesh.py", "Writing Inpainting output frame:", os.path.abspath(path))
+    if args.save_output:
+        path = args.output_filename
+        if output_dir:
+            path = os.path.join(output_dir, path)
+        print("mesh.py", "Writing Inpainting output frame:", os.path.abspath(path))
 
-    write_png(path, img)
+        write_png(path, img)
+
+    return img
 
 
 def output_3d_photo(
@@ -3867,9 +3752,12 @@ def output_3d_photo(
         img = img[o_t:H_c - o_b, o_l:W_c - o_r]
         img = cv2.resize(img, (W_c, H_c), interpolation=cv2.INTER_CUBIC)
 
-    path = args.output_filename
-    if output_dir:
-        path = os.path.join(output_dir, path)
-    print("mesh.py:", "Writing Inpainting output frame:", os.path.abspath(path))
+    if args.save_output:
+        path = args.output_filename
+        if output_dir:
+            path = os.path.join(output_dir, path)
+        print("mesh.py:", "Writing Inpainting output frame:", os.path.abspath(path))
+
+        write_png(path, img)
 
-    write_png(path, img)
+    return img
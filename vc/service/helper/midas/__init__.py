@@ -1 +1 @@
-from .run import run_depth
+from .run import run_depth, load_depth_model, DepthEstimator
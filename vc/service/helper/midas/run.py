@@ -1,8 +1,10 @@
 """Compute depth maps for images in the input folder.
 """
 import os
+from typing import List, Union
 
 import cv2
+import numpy as np
 import torch
 from torchvision.transforms import Compose
 
@@ -11,27 +13,49 @@ from .midas.midas_net import MidasNet
 from .midas.midas_net_custom import MidasNet_small
 from .midas.transforms import Resize, NormalizeImage, PrepareForNet
 from .utils import read_image, write_depth
+from vc.service.helper.depth_cache import DepthCache
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
+from vc.service.helper.model_registry import ModelRegistry
+from vc.service.helper.onnx_backend import OnnxBackend, OnnxModule
 
 
-def run_depth(
-    input_path,
-    output_path,
-    model_path,
-    model_type="dpt_large",
-    optimize=True
-):
-    """Run MonoDepthNN to compute depth maps.
+def load_depth_model(model_path, model_type="dpt_large", optimize=True, backend='torch'):
+    """Load (or fetch the resident copy of) a MiDaS network and its transform.
 
     Args:
-        input_path (str): path to input folder
-        output_path (str): path to output folder
         model_path (str): path to saved model
+        model_type (str): one of dpt_large, dpt_hybrid, midas_v21, midas_v21_small
+        optimize (bool): use half precision and channels last on CUDA
+        backend (str): torch, or onnx for the graph exported by onnx_export
+
+    Returns:
+        tuple: (model, transform)
     """
-    dh.debug('midas', "initialize")
+    if backend == OnnxBackend.NAME:
+        return ModelRegistry.get(
+            'midas_%s_onnx' % model_type,
+            model_path,
+            lambda: (OnnxModule('midas_%s' % model_type), depth_transform(model_type)),
+            torch.device('cpu')
+        )
 
-    # select device
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = (
+        torch.float16
+        if optimize and device == torch.device("cuda")
+        else torch.float32
+    )
+    return ModelRegistry.get(
+        'midas_%s' % model_type,
+        model_path,
+        lambda: _load_depth_model(model_path, model_type, optimize, device),
+        device,
+        dtype
+    )
+
+
+def _load_depth_model(model_path, model_type, optimize, device):
+    dh.debug('midas', "initialize")
     dh.debug('midas', "device", device)
 
     # load network
@@ -41,37 +65,58 @@ def run_depth(
             backbone="vitl16_384",
             non_negative=True
         )
-        net_w, net_h = 384, 384
-        resize_mode = "minimal"
-        normalization = NormalizeImage(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
     elif model_type == "dpt_hybrid": #DPT-Hybrid
         model = DPTDepthModel(
             path=model_path,
             backbone="vitb_rn50_384",
             non_negative=True
         )
+    elif model_type == "midas_v21":
+        model = MidasNet(model_path, non_negative=True)
+    elif model_type == "midas_v21_small":
+        model = MidasNet_small(model_path, features=64, backbone="efficientnet_lite3", exportable=True, non_negative=True, blocks={'expand': True})
+    else:
+        dh.debug('midas', f"model_type '{model_type}' not implemented, use: --model_type large")
+        assert False
+
+    transform = depth_transform(model_type)
+
+    model.eval()
+    
+    if optimize==True:
+        # rand_example = torch.rand(1, 3, net_h, net_w)
+        # model(rand_example)
+        # traced_script_module = torch.jit.trace(model, rand_example)
+        # model = traced_script_module
+    
+        if device == torch.device("cuda"):
+            model = model.to(memory_format=torch.channels_last)  
+            model = model.half()
+
+    model.to(device)
+
+    return model, transform
+
+
+def depth_transform(model_type):
+    if model_type in ("dpt_large", "dpt_hybrid"):
         net_w, net_h = 384, 384
         resize_mode = "minimal"
         normalization = NormalizeImage(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
     elif model_type == "midas_v21":
-        model = MidasNet(model_path, non_negative=True)
         net_w, net_h = 384, 384
         resize_mode = "upper_bound"
         normalization = NormalizeImage(
             mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
         )
-    elif model_type == "midas_v21_small":
-        model = MidasNet_small(model_path, features=64, backbone="efficientnet_lite3", exportable=True, non_negative=True, blocks={'expand': True})
+    else:
         net_w, net_h = 256, 256
         resize_mode="upper_bound"
         normalization = NormalizeImage(
             mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
         )
-    else:
-        dh.debug('midas', f"model_type '{model_type}' not implemented, use: --model_type large")
-        assert False
-    
-    transform = Compose(
+
+    return Compose(
         [
             Resize(
                 net_w,
@@ -87,54 +132,139 @@ def run_depth(
         ]
     )
 
-    model.eval()
-    
-    if optimize==True:
-        # rand_example = torch.rand(1, 3, net_h, net_w)
-        # model(rand_example)
-        # traced_script_module = torch.jit.trace(model, rand_example)
-        # model = traced_script_module
-    
-        if device == torch.device("cuda"):
-            model = model.to(memory_format=torch.channels_last)  
-            model = model.half()
 
-    model.to(device)
+class DepthEstimator:
+    """Estimates MiDaS depth for many images at once.
+
+    The network and its transform stay resident in the ModelRegistry. Images
+    whose depth is in the DepthCache are not run again; the rest are grouped
+    by their shape after the transform resizes them, and each group goes
+    through the network batch_size at a time, in half precision and channels
+    last on CUDA when optimize is set.
+    """
+    model_type: str
+    optimize: bool
+    backend: str
+    batch_size: int
+    device: torch.device
 
-    # create output folder
-    os.makedirs(output_path, exist_ok=True)
+    def __init__(
+        self,
+        model_path: str,
+        model_type: str = 'dpt_large',
+        optimize: bool = True,
+        backend: str = 'torch',
+        batch_size: int = None
+    ):
+        self.model_type = model_type
+        self.backend = backend
+        self.batch_size = batch_size or int(os.getenv('DEPTH_BATCH_SIZE', 4))
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if backend == OnnxBackend.NAME:
+            self.device = torch.device('cpu')
+            optimize = False
+        self.optimize = optimize and self.device.type == 'cuda'
+        self.model, self.transform = load_depth_model(
+            model_path,
+            model_type,
+            optimize,
+            backend
+        )
 
-    dh.debug('midas', 'processing', input_path)
+    def estimate(self, images: List[Union[str, np.ndarray]]) -> List[np.ndarray]:
+        """Read-only float32 depth maps, each at the size of its image.
+
+        Images are paths, RGB uint8 arrays or RGB float arrays in [0, 1].
+        """
+        images = [read_image(image) if isinstance(image, str) else image for image in images]
+        depths = [DepthCache.lookup(image, self.model_type) for image in images]
+
+        groups = {}
+        for i, image in enumerate(images):
+            if depths[i] is not None:
+                continue
+            sample = self.transform({'image': self.normalise(image)})['image']
+            groups.setdefault(sample.shape, []).append((i, sample))
+
+        for shape, samples in groups.items():
+            for start in range(0, len(samples), self.batch_size):
+                batch = samples[start:start + self.batch_size]
+                dh.debug('DepthEstimator', 'estimating batch of', len(batch), shape)
+                predictions = self.forward(np.stack([sample for _, sample in batch]))
+                for (i, _), prediction in zip(batch, predictions):
+                    depths[i] = DepthCache.put(
+                        images[i],
+                        self.model_type,
+                        self.resize(prediction, images[i].shape[:2])
+                    )
 
-    # input
-
-    img = read_image(input_path)
-    img_input = transform({"image": img})["image"]
-
-    # compute
-    with torch.no_grad():
-        sample = torch.from_numpy(img_input).to(device).unsqueeze(0)
-        if optimize and device == torch.device("cuda"):
-            sample = sample.to(memory_format=torch.channels_last)
-            sample = sample.half()
-        prediction = model.forward(sample)
-        prediction = (
-            torch.nn.functional.interpolate(
-                prediction.unsqueeze(1),
-                size=img.shape[:2],
-                mode="bicubic",
+        return depths
+
+    def forward(self, samples: np.ndarray) -> torch.Tensor:
+        with torch.no_grad():
+            batch = torch.from_numpy(samples).to(self.device)
+            if self.optimize:
+                batch = batch.to(memory_format=torch.channels_last).half()
+            return self.model.forward(batch).float()
+
+    def resize(self, prediction: torch.Tensor, size) -> np.ndarray:
+        with torch.no_grad():
+            return torch.nn.functional.interpolate(
+                prediction[None, None],
+                size=size,
+                mode='bicubic',
                 align_corners=False,
-            )
-            .squeeze()
-            .cpu()
-            .numpy()
-        )
+            ).squeeze().cpu().numpy()
+
+    @staticmethod
+    def normalise(image: np.ndarray) -> np.ndarray:
+        if image.dtype == np.uint8:
+            return image / 255.0
+        return image
+
+    @staticmethod
+    def save(path: str, depth: np.ndarray):
+        """Writes the .pfm and 16-bit .png of a depth map; path has no extension."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write_depth(path, depth, bits=2)
+
+
+def run_depth(
+    input_path,
+    output_path,
+    model_path,
+    model_type="dpt_large",
+    optimize=True,
+    image=None,
+    backend='torch',
+    save=False
+):
+    """Run MonoDepthNN to compute a depth map, or fetch it from the DepthCache.
+
+    Args:
+        input_path (str): path to input image
+        output_path (str): path to output folder
+        model_path (str): path to saved model
+        image (array): RGB uint8 image to use instead of reading input_path,
+            which then only names the output
+        backend (str): torch, or onnx to run the exported graph on CPU
+        save (bool): also write the .pfm and .png visualisation to output_path
+
+    Returns:
+        array: read-only float32 depth map at the size of the image
+    """
+    dh.debug('midas', 'processing', input_path)
+
+    estimator = DepthEstimator(model_path, model_type, optimize, backend)
+    prediction = estimator.estimate([input_path if image is None else image])[0]
 
     # output
-    filename = os.path.join(
-        output_path, os.path.splitext(os.path.basename(input_path))[0]
-    )
-    dh.debug('midas', 'writing', os.path.abspath(filename))
-    write_depth(filename, prediction, bits=2)
+    if save:
+        filename = os.path.join(
+            output_path, os.path.splitext(os.path.basename(input_path))[0]
+        )
+        dh.debug('midas', 'writing', os.path.abspath(filename))
+        estimator.save(filename, prediction)
 
     dh.debug('midas', "finished")
+    return prediction
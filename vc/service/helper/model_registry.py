@@ -0,0 +1,136 @@
+import gc
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import torch
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+@dataclass(frozen=True)
+class ModelKey:
+    model_type: str
+    path: str
+    device: str
+    dtype: str = 'float32'
+
+
+@dataclass
+class ModelEntry:
+    model: Any
+    size: int
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded networks.
+
+    The worker is a non-forking SimpleWorker, so anything we keep here lives
+    for as long as the worker does and is shared by every GenerationRunner step
+    of every job. Models are loaded lazily on first use and evicted least
+    recently used first once the memory budget is exceeded.
+    """
+    entries: 'OrderedDict[ModelKey, ModelEntry]' = OrderedDict()
+
+    @classmethod
+    def key(
+        cls,
+        model_type: str,
+        path: str,
+        device: torch.device = None,
+        dtype: torch.dtype = torch.float32
+    ) -> ModelKey:
+        if device is None:
+            device = cls.device()
+        return ModelKey(
+            model_type=model_type,
+            path=path or '',
+            device=str(device),
+            dtype=str(dtype).replace('torch.', '')
+        )
+
+    @classmethod
+    def get(
+        cls,
+        model_type: str,
+        path: str,
+        loader: Callable[[], Any],
+        device: torch.device = None,
+        dtype: torch.dtype = torch.float32
+    ):
+        key = cls.key(model_type, path, device, dtype)
+
+        if key in cls.entries:
+            cls.entries.move_to_end(key)
+            return cls.entries[key].model
+
+        dh.debug('ModelRegistry', 'loading', key)
+        model = loader()
+        size = cls.size_of(model)
+        cls.entries[key] = ModelEntry(model=model, size=size)
+        dh.debug('ModelRegistry', 'loaded', key, size, 'bytes')
+        cls.enforce_budget(keep=key)
+        return model
+
+    @classmethod
+    def has(cls, key: ModelKey) -> bool:
+        return key in cls.entries
+
+    @classmethod
+    def evict(cls, key: ModelKey):
+        entry = cls.entries.pop(key, None)
+        if entry is None:
+            return
+        dh.debug('ModelRegistry', 'evicting', key)
+        del entry
+        gc.collect()
+        torch.cuda.empty_cache()
+
+    @classmethod
+    def clear(cls):
+        for key in list(cls.entries.keys()):
+            cls.evict(key)
+
+    @classmethod
+    def memory_budget(cls) -> int:
+        # read when used, as the worker imports this before loading .env
+        return int(os.getenv('MODEL_MEMORY_BUDGET_MB', 12 * 1024)) * 1024 ** 2
+
+    @classmethod
+    def total_size(cls) -> int:
+        return sum(entry.size for entry in cls.entries.values())
+
+    @classmethod
+    def enforce_budget(cls, keep: ModelKey = None):
+        while cls.total_size() > cls.memory_budget():
+            lru = next(
+                (key for key in cls.entries.keys() if key != keep),
+                None
+            )
+            if lru is None:
+                dh.log(
+                    'ModelRegistry',
+                    'model exceeds memory budget on its own',
+                    keep
+                )
+                return
+            cls.evict(lru)
+
+    @classmethod
+    def size_of(cls, model) -> int:
+        if isinstance(model, torch.nn.Module):
+            return sum(
+                t.numel() * t.element_size()
+                for t in [*model.parameters(), *model.buffers()]
+            )
+        if isinstance(model, (list, tuple)):
+            return sum(cls.size_of(m) for m in model)
+        for attr in ('model', 'flownet'):
+            if isinstance(getattr(model, attr, None), torch.nn.Module):
+                return cls.size_of(getattr(model, attr))
+        return 0
+
+    @staticmethod
+    def device() -> torch.device:
+        return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -0,0 +1,179 @@
+import os
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+from vc.service.helper.model_registry import ModelRegistry
+
+
+class OnnxBackend:
+    """Runs exported networks under onnxruntime, for CPU-only workers.
+
+    The onnx_export command writes one graph per network to ONNX_DIR.
+    Sessions are loaded lazily and kept resident in the ModelRegistry like
+    any other model, with ONNX_THREADS intra-op threads (0 leaves it to
+    onnxruntime)
+    and every graph optimisation enabled. onnxruntime is only imported once
+    a session is wanted, so workers on the torch backend do not need it.
+    """
+    NAME = 'onnx'
+    OPSET = 16
+
+    @classmethod
+    def directory(cls) -> str:
+        # read when used, as .env is loaded after this is imported
+        return os.getenv('ONNX_DIR', 'checkpoints/onnx')
+
+    @classmethod
+    def path(cls, name: str) -> str:
+        return os.path.join(cls.directory(), '%s.onnx' % name)
+
+    @classmethod
+    def export(
+        cls,
+        module: torch.nn.Module,
+        inputs: Tuple[torch.Tensor, ...],
+        name: str,
+        dynamic_batch: bool = True,
+        dynamic_size: bool = True
+    ) -> str:
+        """Exports module as traced on inputs.
+
+        Graphs that bake in shapes while tracing (such as DPT's resized
+        position embeddings) have to be exported without dynamic axes, and
+        then only run at the shape of the inputs given here.
+        """
+        os.makedirs(cls.directory(), exist_ok=True)
+        path = cls.path(name)
+        input_names = ['input%s' % i for i in range(len(inputs))]
+        dynamic_axes = {}
+        for input_name in input_names:
+            axes = {}
+            if dynamic_batch:
+                axes[0] = 'batch'
+            if dynamic_size:
+                axes[2] = 'height'
+                axes[3] = 'width'
+            dynamic_axes[input_name] = axes
+        if dynamic_batch:
+            dynamic_axes['output'] = {0: 'batch'}
+
+        dh.debug('OnnxBackend', 'exporting', name, [i.shape for i in inputs])
+        with torch.no_grad():
+            torch.onnx.export(
+                module,
+                inputs,
+                path + '.tmp',
+                opset_version=cls.OPSET,
+                input_names=input_names,
+                output_names=['output'],
+                dynamic_axes=dynamic_axes,
+                do_constant_folding=True
+            )
+        os.replace(path + '.tmp', path)
+
+        # a session of the previous export would be stale now
+        ModelRegistry.evict(ModelRegistry.key('onnx', path, torch.device('cpu')))
+        return path
+
+    @classmethod
+    def session(cls, name: str):
+        path = cls.path(name)
+        return ModelRegistry.get(
+            'onnx',
+            path,
+            lambda: cls.load_session(path),
+            torch.device('cpu')
+        )
+
+    @classmethod
+    def load_session(cls, path: str):
+        import onnxruntime
+
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                '%s is missing, run the onnx_export command first' % path
+            )
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        options.inter_op_num_threads = 1
+        threads = int(os.getenv('ONNX_THREADS', 0))
+        if threads:
+            options.intra_op_num_threads = threads
+        dh.debug('OnnxBackend', 'loading', path, 'threads', threads)
+        return onnxruntime.InferenceSession(
+            path,
+            options,
+            providers=['CPUExecutionProvider']
+        )
+
+    @classmethod
+    def compare(
+        cls,
+        module: torch.nn.Module,
+        name: str,
+        inputs: Tuple[torch.Tensor, ...]
+    ) -> float:
+        """The largest absolute difference between module and its graph."""
+        with torch.no_grad():
+            expected = module(*inputs).float()
+        actual = OnnxModule(name)(*inputs)
+        return (expected - actual.to(expected.device)).abs().max().item()
+
+
+class OnnxModule:
+    """Stands in for the torch module an exported graph was made from.
+
+    Takes and returns float tensors, which are moved to and from the CPU for
+    onnxruntime. A batch larger than a graph with a fixed batch size takes
+    is run in pieces.
+    """
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+        self.session = OnnxBackend.session(name)
+        self.inputs = self.session.get_inputs()
+
+    def __call__(self, *inputs: torch.Tensor) -> torch.Tensor:
+        device = inputs[0].device
+        arrays = [i.detach().float().cpu().numpy() for i in inputs]
+
+        batch = self.inputs[0].shape[0]
+        if isinstance(batch, int) and arrays[0].shape[0] != batch:
+            output = np.concatenate([
+                self.run([array[start:start + batch] for array in arrays])
+                for start in range(0, arrays[0].shape[0], batch)
+            ])
+        else:
+            output = self.run(arrays)
+
+        return torch.from_numpy(output).to(device)
+
+    forward = __call__
+
+    def accepts(self, *inputs) -> bool:
+        """Whether the graph takes inputs of these shapes, batch aside."""
+        return all(
+            not isinstance(expected, int) or expected == actual
+            for graph_input, array in zip(self.inputs, inputs)
+            for expected, actual in zip(graph_input.shape[1:], array.shape[1:])
+        )
+
+    def run(self, arrays: List[np.ndarray]) -> np.ndarray:
+        if not self.accepts(*arrays):
+            raise RuntimeError(
+                '%s was exported for %s, got %s; export it again at this size' % (
+                    self.name,
+                    [graph_input.shape for graph_input in self.inputs],
+                    [array.shape for array in arrays]
+                )
+            )
+        return self.session.run(None, {
+            graph_input.name: array
+            for graph_input, array in zip(self.inputs, arrays)
+        })[0]
@@ -0,0 +1,97 @@
+import queue
+import threading
+from typing import Any, Callable, List, Optional
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class Pipeline:
+    """Runs a fixed series of stages over items in the background.
+
+    Every stage has its own thread with a bounded queue in front of it, so
+    an item moves on as soon as a stage is done with it, and a slow stage
+    pushes back on put() instead of letting items pile up in memory. Each
+    stage sees the items in the order they were put, which is the only
+    dependency between items a stage may rely on. The first error raised
+    by a stage is re-raised by every later put() or drain(), and items
+    behind it are dropped.
+    """
+    STOP = object()
+
+    stages: List[Callable[[Any], Any]]
+    queues: List[queue.Queue]
+    threads: List[threading.Thread]
+    pending: int
+    condition: threading.Condition
+    error: Optional[BaseException]
+
+    def __init__(self, stages: List[Callable[[Any], Any]], depth: int = 2):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=depth) for _ in stages]
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.error = None
+        self.threads = [
+            threading.Thread(
+                target=self.run,
+                args=(i,),
+                name='pipeline-%s' % i,
+                daemon=True
+            )
+            for i in range(len(stages))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        self.raise_error()
+        with self.condition:
+            self.pending += 1
+        self.queues[0].put(item)
+
+    def run(self, i: int):
+        stage = self.stages[i]
+        while True:
+            item = self.queues[i].get()
+            if item is self.STOP:
+                if i + 1 < len(self.stages):
+                    self.queues[i + 1].put(self.STOP)
+                return
+
+            if self.error is None:
+                try:
+                    item = stage(item)
+                except BaseException as e:
+                    dh.log('Pipeline', 'stage failed', stage, e)
+                    self.error = e
+
+            if self.error is None and i + 1 < len(self.stages):
+                self.queues[i + 1].put(item)
+            else:
+                self.done()
+
+    def done(self):
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify_all()
+
+    @property
+    def idle(self) -> bool:
+        return self.pending == 0
+
+    def drain(self):
+        """Blocks until every item put so far went through every stage."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+        self.queues[0].put(self.STOP)
+        for thread in self.threads:
+            thread.join()
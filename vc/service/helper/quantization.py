@@ -0,0 +1,100 @@
+import copy
+import os
+
+import torch
+from torch import nn
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class Int8Conv(nn.Module):
+    """A conv run in int8, between quantising its input and dequantising its output.
+
+    Keeps the float bias around, as PartialConv reads it off its conv.
+    """
+
+    def __init__(self, conv: nn.Module):
+        super().__init__()
+        self.quant = torch.quantization.QuantStub()
+        self.conv = conv
+        self.dequant = torch.quantization.DeQuantStub()
+        self.bias = conv.bias
+
+    def forward(self, x):
+        return self.dequant(self.conv(self.quant(x)))
+
+
+class Quantizer:
+    """Int8 variants of networks, for CPU workers.
+
+    Transformers get dynamic quantisation of their Linear layers, which needs
+    no calibration. Dynamic quantisation does not cover convs, so conv nets
+    have each conv wrapped in an Int8Conv and are statically quantised from
+    activation ranges observed on calibration inputs; everything between
+    the convs (partial conv masks, norms, upsampling) stays in float.
+    Quantised models are saved next to their checkpoint, as whole modules.
+    """
+    SUFFIX = '.int8.pt'
+    CONVS = (nn.Conv2d, nn.ConvTranspose2d)
+    # the all ones mask convs of PartialConv only count valid pixels
+    SKIP = ('mask_conv',)
+
+    @classmethod
+    def path(cls, checkpoint: str) -> str:
+        return os.path.splitext(checkpoint)[0] + cls.SUFFIX
+
+    @classmethod
+    def load(cls, path: str) -> nn.Module:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                '%s is missing, run the quantize command first' % path
+            )
+        dh.debug('Quantizer', 'loading', path)
+        return torch.load(path, map_location='cpu').eval()
+
+    @classmethod
+    def save(cls, model: nn.Module, path: str):
+        torch.save(model, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        dh.debug('Quantizer', 'saved', path)
+
+    @classmethod
+    def quantize_linear(cls, model: nn.Module) -> nn.Module:
+        return torch.quantization.quantize_dynamic(
+            copy.deepcopy(model).cpu().float().eval(),
+            {nn.Linear},
+            dtype=torch.qint8
+        )
+
+    @classmethod
+    def prepare_convs(cls, model: nn.Module) -> nn.Module:
+        """A float copy of model that records activation ranges as it runs."""
+        model = copy.deepcopy(model).cpu().float().eval()
+        for module in model.modules():
+            if hasattr(module, 'weight_orig'):
+                # fold the spectral norm into the weight it would compute
+                nn.utils.remove_spectral_norm(module)
+
+        activation = torch.quantization.HistogramObserver.with_args(reduce_range=True)
+        for parent in list(model.modules()):
+            for name, child in list(parent.named_children()):
+                if not isinstance(child, cls.CONVS) or name in cls.SKIP:
+                    continue
+                wrapper = Int8Conv(child)
+                wrapper.qconfig = torch.quantization.QConfig(
+                    activation=activation,
+                    # transposed convs only take per tensor weights
+                    weight=(
+                        torch.quantization.default_weight_observer
+                        if isinstance(child, nn.ConvTranspose2d)
+                        else torch.quantization.default_per_channel_weight_observer
+                    )
+                )
+                setattr(parent, name, wrapper)
+
+        torch.backends.quantized.engine = 'fbgemm'
+        return torch.quantization.prepare(model)
+
+    @classmethod
+    def convert(cls, model: nn.Module) -> nn.Module:
+        return torch.quantization.convert(model.eval())
@@ -5,18 +5,33 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 backwarp_tenGrid = {}
 
 
+def traced_grid(tenFlow):
+    # sizes are tensors while tracing, so the grid follows the input shape
+    # of an exported graph instead of being baked in at the traced one
+    n, _, h, w = tenFlow.shape
+    tenHorizontal = (torch.arange(w, device=tenFlow.device, dtype=tenFlow.dtype) * (2.0 / (w - 1)) - 1.0).view(
+        1, 1, 1, w).expand(n, -1, h, -1)
+    tenVertical = (torch.arange(h, device=tenFlow.device, dtype=tenFlow.dtype) * (2.0 / (h - 1)) - 1.0).view(
+        1, 1, h, 1).expand(n, -1, -1, w)
+    return torch.cat([tenHorizontal, tenVertical], 1)
+
+
 def warp(tenInput, tenFlow):
-    k = (str(tenFlow.device), str(tenFlow.size()))
-    if k not in backwarp_tenGrid:
-        tenHorizontal = torch.linspace(-1.0, 1.0, tenFlow.shape[3], device=device).view(
-            1, 1, 1, tenFlow.shape[3]).expand(tenFlow.shape[0], -1, tenFlow.shape[2], -1)
-        tenVertical = torch.linspace(-1.0, 1.0, tenFlow.shape[2], device=device).view(
-            1, 1, tenFlow.shape[2], 1).expand(tenFlow.shape[0], -1, -1, tenFlow.shape[3])
-        backwarp_tenGrid[k] = torch.cat(
-            [tenHorizontal, tenVertical], 1).to(device)
+    if torch.jit.is_tracing():
+        grid = traced_grid(tenFlow)
+    else:
+        k = (str(tenFlow.device), str(tenFlow.size()))
+        if k not in backwarp_tenGrid:
+            tenHorizontal = torch.linspace(-1.0, 1.0, tenFlow.shape[3], device=device).view(
+                1, 1, 1, tenFlow.shape[3]).expand(tenFlow.shape[0], -1, tenFlow.shape[2], -1)
+            tenVertical = torch.linspace(-1.0, 1.0, tenFlow.shape[2], device=device).view(
+                1, 1, tenFlow.shape[2], 1).expand(tenFlow.shape[0], -1, -1, tenFlow.shape[3])
+            backwarp_tenGrid[k] = torch.cat(
+                [tenHorizontal, tenVertical], 1).to(device)
+        grid = backwarp_tenGrid[k]
 
     tenFlow = torch.cat([tenFlow[:, 0:1, :, :] / ((tenInput.shape[3] - 1.0) / 2.0),
                          tenFlow[:, 1:2, :, :] / ((tenInput.shape[2] - 1.0) / 2.0)], 1)
 
-    g = (backwarp_tenGrid[k] + tenFlow).permute(0, 2, 3, 1)
+    g = (grid + tenFlow).permute(0, 2, 3, 1)
     return torch.nn.functional.grid_sample(input=tenInput, grid=g, mode='bilinear', padding_mode='border', align_corners=True)
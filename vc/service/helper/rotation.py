@@ -113,6 +113,25 @@ class Rotate:
     def to_tuple(self):
         return self.tilt, self.pan, self.roll
 
+    def state(self) -> dict:
+        return {
+            'target': [self.tilt_target, self.pan_target, self.roll_target],
+            'position': list(self.to_tuple()),
+            'velocity': list(self.velocity.to_tuple()),
+            'transition': self.transition,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        rotate = cls(*state['target'], transition=state['transition'])
+        rotate.tilt, rotate.pan, rotate.roll = state['position']
+        (
+            rotate.velocity.tilt,
+            rotate.velocity.pan,
+            rotate.velocity.roll
+        ) = state['velocity']
+        return rotate
+
     def reset(self):
         self.tilt = 0.
         self.pan = 0.
@@ -1,8 +1,10 @@
 import os
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import datetime
-from shutil import copy
 from math import log2
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dacite import from_dict
 
 from vc.service import (
     VqganClipService,
@@ -12,11 +14,15 @@ from vc.service import (
 )
 from vc.service.helper import DiagnosisHelper as dh
 from vc.service.helper.acceleration import Translate
+from vc.service.helper.checkpoint import GenerationCheckpoint
 from vc.service.helper.dimensions import DimensionsHelper
+from vc.service.helper.encoder import EncoderSession
+from vc.service.helper.frame import Frame
+from vc.service.helper.pipeline import Pipeline
 from vc.service.helper.rotation import Rotate
 from vc.service.inpainting import InpaintingOptions
 from vc.service.esrgan import EsrganService, EsrganOptions
-from vc.service.rife import RifeService, RifeOptions
+from vc.service.rife import RifeService, RifeOptions, RifeSequence
 from vc.service.helper.random_word import RandomWord
 from vc.service.vqgan_clip import VqganClipOptions
 from vc.value_object import ImageSpec, VideoStepSpec, GenerationSpec
@@ -33,6 +39,8 @@ class ImageGenerationStep(GenerationStep):
     text: str
     style: str = None
     video_step: int = None
+    # whether any step of its video is upscaled, which sizes the video
+    video_upscaled: bool = False
 
 
 @dataclass
@@ -51,6 +59,23 @@ class CleanFilesStep(GenerationStep):
     pass
 
 
+@dataclass
+class ImageBatchStep(GenerationStep):
+    """Image steps optimised together, numbered after the last of them."""
+    steps: List[ImageGenerationStep]
+
+
+@dataclass
+class VideoFrame:
+    """A video frame on its way through upscaling, interpolation and output."""
+    spec: VideoStepSpec
+    video_step: int
+    frame: Frame
+    video_upscaled: bool = False
+    frame_to_use: Frame = None
+    frames: Dict[int, Frame] = None
+
+
 @dataclass
 class GenerationResult:
     preview: str = None
@@ -63,6 +88,8 @@ class GenerationResult:
 class GenerationRunner:
     INTERIM_STEPS = 60
     INTERPOLATE_MULTIPLE = 4
+    # raw frames loaded at once by post_process
+    POST_PROCESS_CHUNK = 32
 
     vqgan_clip: VqganClipService
     inpainting: InpaintingService
@@ -74,6 +101,13 @@ class GenerationRunner:
     output_filename: str
     steps_dir: str
 
+    # video frames that may be queued per stage behind the step generating
+    # the next one; 0 runs them inline
+    pipeline_depth: int
+    # only store raw frames while generating a video, and upscale and
+    # interpolate them all in batches once it is done
+    post_processing: bool
+
     generation_name: str
     now: datetime
     suffix: str
@@ -82,6 +116,31 @@ class GenerationRunner:
     translate: Translate = None
     rotate: Rotate = None
 
+    encoder: EncoderSession = None
+    encoder_fps_multiple: int = None
+    # the last video step the encoder was given or found missing; steps
+    # without a frame leave a gap, so frames_written can't stand in for it
+    encoder_step: int = 0
+
+    checkpoint: GenerationCheckpoint = None
+
+    # the current output, and the last frame put in the steps dir
+    frame: Frame = None
+    step_frame: Frame = None
+    pipeline: Pipeline = None
+
+    # raw frames waiting for post_process, as (video step, upscale,
+    # interpolate) in the order they were generated
+    deferred: List[Tuple[int, bool, bool]] = None
+
+    # carries the last interpolated frame on to the next one, on the device
+    rife_sequence: RifeSequence = None
+    interpolated: Dict[int, Frame] = None
+
+    # VQGAN iterations run, and skipped by converging early
+    iterations_run: int = 0
+    iterations_saved: int = 0
+
     last_text = None
     text_transition = 0.
     last_style = None
@@ -97,7 +156,8 @@ class GenerationRunner:
         file: FileService,
         output_filename: str,
         steps_dir: str,
-        name: str = None
+        name: str = None,
+        checkpoint: GenerationCheckpoint = None
     ):
         self.vqgan_clip = vqgan_clip
         self.inpainting = inpainting
@@ -110,8 +170,39 @@ class GenerationRunner:
         self.generation_name = name if name else RandomWord.get()
         self.now = datetime.now()
         self.suffix = self.video.generate_suffix()
+        self.checkpoint = checkpoint
+        self.deferred = []
+        self.interpolated = {}
+        self.pipeline_depth = int(os.getenv('GENERATION_PIPELINE_DEPTH', 0))
+        self.post_processing = bool(os.getenv('GENERATION_POST_PROCESS'))
+        if self.pipeline_depth:
+            self.pipeline = Pipeline(
+                self.video_frame_stages(),
+                depth=self.pipeline_depth
+            )
+
+    @property
+    def idle(self) -> bool:
+        """Whether all video frames so far are through their stages."""
+        return self.pipeline is None or self.pipeline.idle
+
+    def drain(self):
+        if self.pipeline is not None:
+            self.pipeline.drain()
+
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.pipeline = None
+        if self.rife_sequence is not None:
+            self.rife_sequence.close()
+            self.rife_sequence = None
 
     def handle(self, step: GenerationStep) -> GenerationResult:
+        if not (isinstance(step, ImageGenerationStep) and step.video_step):
+            # everything else works on the steps dir, encoder or output
+            self.drain()
+
         if isinstance(step, ImageGenerationStep):
             dh.debug('GenerationRunner', 'generate_image', step)
             result = self.generate_image(step)
@@ -146,6 +237,20 @@ class GenerationRunner:
             self.clean_files(step)
             return GenerationResult()
 
+    def handle_batch(
+        self,
+        step: ImageBatchStep
+    ) -> List[Tuple[ImageGenerationStep, GenerationResult]]:
+        dh.debug('GenerationRunner', 'generate_images', step)
+        self.drain()
+        return [
+            (image_step, GenerationResult(result=result))
+            for image_step, result in zip(
+                step.steps,
+                self.generate_images(step)
+            )
+        ]
+
     def generate_image(self, step: ImageGenerationStep):
         if step.spec != self.spec:
             self.spec = step.spec
@@ -229,31 +334,37 @@ class GenerationRunner:
             dh.debug('GenerationRunner', 'pan', pan)
             dh.debug('GenerationRunner', 'roll', roll)
 
-            if step.spec.init_iterations and not os.path.isfile(self.output_filename):
+            if step.spec.init_iterations and self.current_frame() is None:
                 dh.debug('GenerationRunner', 'init', step.spec.init_iterations)
-                self.vqgan_clip.handle(VqganClipOptions(**{
+                self.frame = self.vqgan_clip.handle(VqganClipOptions(**{
                     'prompts': prompt,
                     'max_iterations': step.spec.init_iterations,
                     'output_filename': self.output_filename,
-                    'init_image': None
+                    'save_output': False,
+                    'init_image': None,
+                    'checkpoint_file': self.latent_file('%s-init' % step.step),
+                    **self.convergence_options(step.spec),
                 }))
+                self.record_stats()
 
         dh.debug('GenerationRunner', 'vqgan_clip', 'handle')
-        self.vqgan_clip.handle(VqganClipOptions(**{
+        self.frame = self.vqgan_clip.handle(VqganClipOptions(**{
             'prompts': prompt,
             'max_iterations': step.spec.iterations,
-            'init_image': (
-                self.output_filename
-                if os.path.isfile(self.output_filename)
-                else None
-            ),
+            'init_image': None,
+            'init_frame': self.current_frame(),
             'output_filename': self.output_filename,
+            'save_output': False,
+            'checkpoint_file': self.latent_file(step.step),
+            **self.convergence_options(step.spec),
         }))
+        self.record_stats()
 
         if moving or rotating:
             dh.debug('GenerationRunner', 'inpainting', 'handle')
-            self.inpainting.handle(InpaintingOptions(**{
+            inpainted = self.inpainting.handle(InpaintingOptions(**{
                 'input_file': self.output_filename,
+                'input_frame': self.frame,
                 'x_shift': x_shift,
                 'y_shift': y_shift,
                 'z_shift': z_shift,
@@ -261,53 +372,368 @@ class GenerationRunner:
                 'pan': pan,
                 'roll': roll,
                 'output_filename': self.output_filename,
+                'save_output': False,
             }))
+            if inpainted is not None:
+                self.frame = inpainted
         else:
             dh.debug('GenerationRunner', 'inpainting', 'skipped (not moving)')
 
-        filename_to_use = self.output_filename
+        if not step.video_step:
+            # the next step starts from the frame in memory; the file is for
+            # the upload and the checkpoint
+            self.frame.save(self.output_filename)
+            return self.put_image(
+                step,
+                self.frame,
+                self.output_filename
+            )
+
+        video_step = step.video_step
+        if step.spec.interpolate and not self.post_processing:
+            video_step = self.interpolated_step(video_step)
+
+        # the next step only needs self.frame, so the rest can overlap it
+        video_frame = VideoFrame(
+            spec=step.spec,
+            video_step=video_step,
+            frame=self.frame,
+            video_upscaled=step.video_upscaled
+        )
+        if self.pipeline is None:
+            for stage in self.video_frame_stages():
+                video_frame = stage(video_frame)
+        else:
+            self.pipeline.put(video_frame)
+
+        return self.file.url(
+            '%s-preview.png' % self.generation_name,
+            self.now
+        )
+
+    def put_image(
+        self,
+        step: ImageGenerationStep,
+        frame: Frame,
+        output_filename: str
+    ):
+        """Uploads the result of an image step, upscaled if it asks to be."""
         if step.spec.upscale:
-            filename_to_use = filename_to_use.replace('.png', '-upscaled.png')
             dh.debug('GenerationRunner', 'esrgan', 'handle')
+            output_filename = output_filename.replace('.png', '-upscaled.png')
             self.esrgan.handle(EsrganOptions(**{
-                'input_file': self.output_filename,
-                'output_file': filename_to_use,
+                'input_frame': frame,
+                'output_file': output_filename,
             }))
 
-        if not step.video_step:
-            return self.file.put(
-                self.output_filename,
-                '%s-%s.png' % (self.generation_name, step.step)
-            )
+        return self.file.put(
+            output_filename,
+            '%s-%s.png' % (self.generation_name, step.step)
+        )
 
-        video_step = step.video_step
-        if step.spec.interpolate:
-            video_step = (video_step - 1) * self.INTERPOLATE_MULTIPLE + 1
+    def video_frame_stages(self):
+        if self.post_processing:
+            return [self.defer_frame, self.output_frame]
+        return [self.upscale_frame, self.interpolate_frame, self.output_frame]
+
+    def defer_frame(self, video_frame: VideoFrame) -> VideoFrame:
+        raw_filepath = self.raw_filepath(video_frame.video_step)
+        dh.debug('GenerationRunner', 'raw video_step', raw_filepath)
+        video_frame.frame.save(raw_filepath)
+        video_frame.frames = {video_frame.video_step: video_frame.frame}
+        self.deferred.append((
+            video_frame.video_step,
+            video_frame.spec.upscale,
+            video_frame.spec.interpolate
+        ))
+        return video_frame
+
+    def upscale_frame(self, video_frame: VideoFrame) -> VideoFrame:
+        video_frame.frame_to_use = video_frame.frame
+        if video_frame.spec.upscale:
+            dh.debug('GenerationRunner', 'esrgan', 'handle')
+            video_frame.frame_to_use = self.esrgan.handle(EsrganOptions(**{
+                'input_frame': video_frame.frame,
+                'output_file': self.output_filename.replace('.png', '-upscaled.png'),
+                'save_output': False,
+            }))
 
-        step_filepath = self.video_step_filepath(video_step)
+        step_filepath = self.video_step_filepath(video_frame.video_step)
         dh.debug('GenerationRunner', 'video_step', step_filepath)
-        copy(filename_to_use, step_filepath)
+        video_frame.frame_to_use.save(step_filepath)
+        video_frame.frames = {video_frame.video_step: video_frame.frame_to_use}
+        return video_frame
 
-        if step.spec.interpolate and video_step > 1:
-            second_file = step_filepath
+    def interpolate_frame(self, video_frame: VideoFrame) -> VideoFrame:
+        video_step = video_frame.video_step
+        if video_frame.spec.interpolate and video_step > 1:
             step_from = video_step - self.INTERPOLATE_MULTIPLE
-            first_file = self.video_step_filepath(step_from)
-            self.rife.handle(RifeOptions(
-                first_file=first_file,
-                second_file=second_file,
-                output_file=lambda i: self.video_step_filepath(i + step_from),
-                exp=int(log2(self.INTERPOLATE_MULTIPLE))
-            ))
+            if self.rife_sequence is None:
+                self.rife_sequence = self.rife.open_sequence(
+                    RifeOptions(
+                        exp=int(log2(self.INTERPOLATE_MULTIPLE)),
+                        # each frame's in betweens are wanted right away
+                        batch_size=1
+                    ),
+                    self.interpolated.__setitem__
+                )
 
-        return self.file.put(
+            if self.rife_sequence.index != step_from:
+                first_frame = self.step_frame
+                if first_frame is None and os.path.isfile(
+                    self.video_step_filepath(step_from)
+                ):
+                    first_frame = Frame.load(self.video_step_filepath(step_from))
+                if first_frame is not None:
+                    self.rife_sequence.seed(first_frame, step_from)
+
+            if self.rife_sequence.index == step_from:
+                self.rife_sequence.write(video_frame.frame_to_use)
+                for i, frame in self.interpolated.items():
+                    if i == video_step:
+                        continue
+                    frame.save(self.video_step_filepath(i))
+                    video_frame.frames[i] = frame
+                self.interpolated.clear()
+
+        self.step_frame = video_frame.frame_to_use
+        return video_frame
+
+    def output_frame(self, video_frame: VideoFrame) -> VideoFrame:
+        if self.post_processing:
+            # interim videos are made of the raw frames until post_process
+            self.feed_encoder(
+                video_frame.video_step,
+                1,
+                False,
+                video_frame.frames,
+                self.raw_filepath
+            )
+        else:
+            self.feed_encoder(
+                video_frame.video_step,
+                self.INTERPOLATE_MULTIPLE if video_frame.spec.interpolate else 1,
+                video_frame.video_upscaled,
+                video_frame.frames
+            )
+
+        # written here rather than by the step, so that whenever the pipeline
+        # is idle it matches the steps dir (checkpoints rely on that)
+        video_frame.frame.save(self.output_filename)
+        self.file.put(
             self.output_filename,
             '%s-preview.png' % self.generation_name,
             self.now
         )
+        return video_frame
+
+    def generate_images(self, step: ImageBatchStep):
+        # each image starts from scratch, as after its own clean files step
+        self.clean_files(None)
+
+        output_filenames = [
+            self.output_filename.replace('.png', '-%s.png' % i)
+            for i in range(len(step.steps))
+        ]
+
+        dh.debug('GenerationRunner', 'vqgan_clip', 'handle_batch')
+        frames = self.vqgan_clip.handle_batch([
+            VqganClipOptions(**{
+                'prompts': (
+                    image_step.text
+                    if image_step.style is None
+                    else '%s | %s' % (image_step.text, image_step.style)
+                ),
+                'max_iterations': image_step.spec.iterations,
+                'init_image': None,
+                'output_filename': output_filename,
+                'save_output': False,
+                **self.convergence_options(image_step.spec),
+            })
+            for image_step, output_filename
+            in zip(step.steps, output_filenames)
+        ])
+        self.record_stats()
+
+        results = []
+        for image_step, frame, output_filename in zip(
+            step.steps,
+            frames,
+            output_filenames
+        ):
+            frame.save(output_filename)
+            results.append(self.put_image(image_step, frame, output_filename))
+
+        # leave the files as the last of the steps run one by one would have
+        os.replace(output_filenames[-1], self.output_filename)
+        for output_filename in output_filenames[:-1]:
+            os.remove(output_filename)
+        self.frame = frames[-1]
+
+        return results
+
+    def current_frame(self) -> Optional[Frame]:
+        """The output so far: in memory, or on disk after a resume."""
+        if self.frame is None and os.path.isfile(self.output_filename):
+            self.frame = Frame.load(self.output_filename)
+        return self.frame
+
+    def convergence_options(self, spec: ImageSpec) -> dict:
+        return {
+            'convergence_window': spec.convergence_window,
+            'convergence_threshold': spec.convergence_threshold,
+            'min_iterations': spec.min_iterations,
+        }
+
+    def record_stats(self):
+        for stats in self.vqgan_clip.stats or []:
+            self.iterations_run += stats.iterations
+            self.iterations_saved += stats.saved
+
+    def latent_file(self, name):
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.latent_file(name)
+
+    def state(self) -> dict:
+        return {
+            'generation_name': self.generation_name,
+            'now': self.now.isoformat(),
+            'suffix': self.suffix,
+            'spec_type': type(self.spec).__name__ if self.spec else None,
+            'spec': asdict(self.spec) if self.spec else None,
+            'translate': self.translate.state() if self.translate else None,
+            'rotate': self.rotate.state() if self.rotate else None,
+            'last_text': self.last_text,
+            'text_transition': self.text_transition,
+            'last_style': self.last_style,
+            'style_transition': self.style_transition,
+            'deferred': self.deferred,
+        }
+
+    def restore(self, state: dict):
+        self.generation_name = state['generation_name']
+        self.now = datetime.fromisoformat(state['now'])
+        self.suffix = state['suffix']
+        if state['spec'] is not None:
+            spec_type = (
+                VideoStepSpec
+                if state['spec_type'] == VideoStepSpec.__name__
+                else ImageSpec
+            )
+            self.spec = from_dict(data_class=spec_type, data=state['spec'])
+        if state['translate'] is not None:
+            self.translate = Translate.from_state(state['translate'])
+        if state['rotate'] is not None:
+            self.rotate = Rotate.from_state(state['rotate'])
+        self.last_text = state['last_text']
+        self.text_transition = state['text_transition']
+        self.last_style = state['last_style']
+        self.style_transition = state['style_transition']
+        self.deferred = [tuple(entry) for entry in state.get('deferred', [])]
 
     def video_step_filepath(self, video_step):
         return os.path.join(self.steps_dir, f'{video_step:04}.png')
 
+    def raw_filepath(self, video_step):
+        # kept in the steps dir so checkpoints carry them, but named so that
+        # nothing encoding the steps dir picks them up
+        return os.path.join(self.steps_dir, f'raw-{video_step:04}.png')
+
+    def interpolated_step(self, video_step):
+        return (video_step - 1) * self.INTERPOLATE_MULTIPLE + 1
+
+    def feed_encoder(
+        self,
+        video_step,
+        fps_multiple,
+        upscaled: bool,
+        frames: Dict[int, Frame] = None,
+        filepath: Callable[[int], str] = None
+    ):
+        if self.encoder is None:
+            # sized as the whole video will be, so frames that are not
+            # upscaled are scaled up rather than the rest down
+            if upscaled:
+                width = DimensionsHelper.width_large()
+                height = DimensionsHelper.height_large()
+            else:
+                width = DimensionsHelper.width_small()
+                height = DimensionsHelper.height_small()
+            self.encoder = self.video.open_session(width, height, fps_multiple)
+            self.encoder_fps_multiple = fps_multiple
+            self.encoder_step = 0
+
+        # catches up on anything already in the steps dir, e.g. RIFE frames
+        # or frames rendered before a resumed job got here
+        if filepath is None:
+            filepath = self.video_step_filepath
+        for i in range(self.encoder_step + 1, video_step + 1):
+            if frames and i in frames:
+                self.encoder.write(frames[i].bgr())
+            elif os.path.isfile(filepath(i)):
+                self.encoder.write_file(filepath(i))
+            else:
+                dh.debug('GenerationRunner', 'no frame for video step', i)
+            self.encoder_step = i
+
+    def post_process(self) -> int:
+        """Upscales and interpolates the deferred raw frames into the steps dir.
+
+        Frames are loaded POST_PROCESS_CHUNK at a time; the ones to upscale
+        go through ESRGAN together, then every pair to interpolate goes
+        through RIFE together. Returns the last video step written.
+        """
+        if self.encoder is not None:
+            # it was fed the raw frames
+            self.encoder.close()
+            self.encoder = None
+
+        last_step = 0
+        previous = None
+        for start in range(0, len(self.deferred), self.POST_PROCESS_CHUNK):
+            chunk = self.deferred[start:start + self.POST_PROCESS_CHUNK]
+            frames = [
+                Frame.load(self.raw_filepath(raw_step))
+                for raw_step, _, _ in chunk
+            ]
+
+            upscale = [i for i, (_, upscale, _) in enumerate(chunk) if upscale]
+            if upscale:
+                dh.debug('GenerationRunner', 'esrgan', 'handle_frames', len(upscale))
+                upscaled = self.esrgan.handle_frames([frames[i] for i in upscale])
+                for i, frame in zip(upscale, upscaled):
+                    frames[i] = frame
+
+            pairs = []
+            steps_from = []
+            for (raw_step, _, interpolate), frame in zip(chunk, frames):
+                video_step = raw_step
+                if interpolate:
+                    video_step = self.interpolated_step(raw_step)
+                    if video_step > 1 and previous is not None:
+                        pairs.append((previous, frame))
+                        steps_from.append(video_step - self.INTERPOLATE_MULTIPLE)
+                frame.save(self.video_step_filepath(video_step))
+                last_step = max(last_step, video_step)
+                previous = frame
+
+            if pairs:
+                dh.debug('GenerationRunner', 'rife', 'handle_pairs', len(pairs))
+                interpolated = self.rife.handle_pairs(pairs, RifeOptions(
+                    exp=int(log2(self.INTERPOLATE_MULTIPLE))
+                ))
+                for step_from, frames_between in zip(steps_from, interpolated):
+                    for i, frame in enumerate(frames_between, start=step_from + 1):
+                        frame.save(self.video_step_filepath(i))
+
+        for raw_step, _, _ in self.deferred:
+            if os.path.isfile(self.raw_filepath(raw_step)):
+                os.remove(self.raw_filepath(raw_step))
+        self.deferred = []
+
+        return last_step
+
     def handle_interim(self, step: HandleInterimStep):
         return self.make_video(step)
 
@@ -318,29 +744,52 @@ class GenerationRunner:
             'interim' if is_interim else 'result'
         )
         interpolate = False and not step.interpolated
+        fps_multiple = self.INTERPOLATE_MULTIPLE if step.interpolated else 1
+
+        if self.post_processing:
+            if is_interim:
+                # the session holds the raw frames, one per video step
+                fps_multiple = 1
+            elif self.deferred:
+                last_step = self.post_process()
+                self.feed_encoder(last_step, fps_multiple, step.upscaled)
+
+        if (
+            self.encoder is not None
+            and self.encoder_fps_multiple == fps_multiple
+        ):
+            return self.video.make_session_videos(
+                self.encoder,
+                output_file=filename,
+                now=self.now if is_interim else None,
+                suffix=self.suffix if is_interim else None
+            )
+
         width = (
             DimensionsHelper.width_large()
             if step.upscaled
             else DimensionsHelper.width_small()
         )
-        unwatermarked = self.video.make_unwatermarked_video(
+        return self.video.make_videos(
+            width=width,
             output_file=filename,
             steps_dir=self.steps_dir,
             now=self.now if is_interim else None,
             suffix=self.suffix if is_interim else None,
             interpolate=interpolate,
-            fps_multiple=self.INTERPOLATE_MULTIPLE if step.interpolated else 1
-        )
-        watermarked = self.video.make_watermarked_video(
-            width=width,
-            output_file=filename,
-            steps_dir=self.steps_dir,
-            now=self.now if is_interim else None,
-            fps_multiple=self.INTERPOLATE_MULTIPLE if step.interpolated else 1
+            fps_multiple=fps_multiple
         )
-        return unwatermarked, watermarked
 
     def clean_files(self, step: CleanFilesStep):
+        if self.encoder is not None:
+            self.encoder.close()
+            self.encoder = None
+        self.frame = None
+        self.step_frame = None
+        self.deferred = []
+        if self.rife_sequence is not None:
+            self.rife_sequence.close()
+            self.rife_sequence = None
         if os.path.exists(self.output_filename):
             os.remove(self.output_filename)
         for filename in os.listdir(self.steps_dir):
@@ -350,6 +799,51 @@ class GenerationRunner:
 
         return None
 
+    @classmethod
+    def batch_steps(
+        cls,
+        steps: Iterable[GenerationStep],
+        batch_size: int
+    ):
+        """Groups runs of image spec steps into batches of up to batch_size.
+
+        Every image of an image spec is a clean files step followed by its
+        image step, so a run of such pairs with the same iterations can be
+        optimised in one go. Anything else is passed through as it is.
+        """
+        steps = list(steps)
+        i = 0
+        while i < len(steps):
+            batch = []
+            j = i
+            while (
+                len(batch) < batch_size
+                and j + 1 < len(steps)
+                and isinstance(steps[j], CleanFilesStep)
+                and cls.batchable(steps[j + 1])
+                and (
+                    not batch
+                    or batch[0].spec.iterations == steps[j + 1].spec.iterations
+                )
+            ):
+                batch.append(steps[j + 1])
+                j += 2
+
+            if len(batch) > 1:
+                yield ImageBatchStep(step=batch[-1].step, steps=batch)
+                i = j
+            else:
+                yield steps[i]
+                i += 1
+
+    @classmethod
+    def batchable(cls, step: GenerationStep):
+        return (
+            isinstance(step, ImageGenerationStep)
+            and not isinstance(step.spec, VideoStepSpec)
+            and not step.video_step
+        )
+
     @classmethod
     def iterate_steps(cls, spec: GenerationSpec):
         step = 0
@@ -383,6 +877,9 @@ class GenerationRunner:
             for video in spec.videos:
                 upscaled = False
                 interpolated = False
+                video_upscaled = any(
+                    step_spec.upscale for step_spec in video.steps or []
+                )
                 video_step = 0
                 step += 1
                 yield CleanFilesStep(step=step)
@@ -405,7 +902,8 @@ class GenerationRunner:
                                                 step=step,
                                                 text=text,
                                                 style=style,
-                                                video_step=video_step
+                                                video_step=video_step,
+                                                video_upscaled=video_upscaled
                                             )
 
                                             if step % cls.INTERIM_STEPS == 1:
@@ -423,7 +921,8 @@ class GenerationRunner:
                                             spec=step_spec,
                                             step=step,
                                             text=text,
-                                            video_step=video_step
+                                            video_step=video_step,
+                                            video_upscaled=video_upscaled
                                         )
 
                                         if step % cls.INTERIM_STEPS == 1:
@@ -0,0 +1,114 @@
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import torch
+
+from vc.r import r
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class TextEmbeddingCache:
+    """Process-wide cache of CLIP text embeddings, keyed by model and text.
+
+    Video specs encode the same few phrases for every frame, and transitions
+    only change the weights parse_prompt splits off, so after the first frame
+    every prompt is a hit. Entries are evicted least recently used first.
+    With TEXT_EMBEDDING_CACHE set to disk or redis, misses are looked up in
+    (and written back to) that store, so they are shared between workers and
+    survive restarts.
+    """
+    KEY = 'text-embedding:%s'
+    TTL = 60 * 60 * 24 * 30
+
+    entries: 'OrderedDict[Tuple[str, str], torch.Tensor]' = OrderedDict()
+    hits: int = 0
+    misses: int = 0
+
+    @classmethod
+    def get(
+        cls,
+        clip_model: str,
+        text: str,
+        encode: Callable[[], torch.Tensor],
+        device: torch.device
+    ) -> torch.Tensor:
+        key = clip_model, text
+
+        if key in cls.entries:
+            cls.entries.move_to_end(key)
+            cls.hits += 1
+            return cls.entries[key].to(device)
+
+        cls.misses += 1
+        embed = cls.load(key)
+        if embed is None:
+            embed = encode().detach().float()
+            cls.store(key, embed)
+        else:
+            dh.debug('TextEmbeddingCache', 'loaded', cls.backing(), text)
+        embed = embed.to(device)
+
+        cls.entries[key] = embed
+        while len(cls.entries) > cls.size():
+            cls.entries.popitem(last=False)
+        return embed
+
+    @classmethod
+    def size(cls) -> int:
+        # read when used, as .env is loaded after this is imported
+        return int(os.getenv('TEXT_EMBEDDING_CACHE_SIZE', 1024))
+
+    @classmethod
+    def backing(cls) -> str:
+        return os.getenv('TEXT_EMBEDDING_CACHE', '')
+
+    @classmethod
+    def directory(cls) -> str:
+        return os.getenv('TEXT_EMBEDDING_CACHE_DIR', 'text-embeddings')
+
+    @classmethod
+    def clear(cls):
+        cls.entries.clear()
+        cls.hits = cls.misses = 0
+
+    @classmethod
+    def digest(cls, key: Tuple[str, str]) -> str:
+        return hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def path(cls, key: Tuple[str, str]) -> str:
+        return os.path.join(cls.directory(), '%s.pt' % cls.digest(key))
+
+    @classmethod
+    def load(cls, key: Tuple[str, str]) -> Optional[torch.Tensor]:
+        try:
+            if cls.backing() == 'disk':
+                path = cls.path(key)
+                if os.path.isfile(path):
+                    return torch.load(path, map_location='cpu')
+            elif cls.backing() == 'redis':
+                data = r.get(cls.KEY % cls.digest(key))
+                if data is not None:
+                    return torch.load(io.BytesIO(data), map_location='cpu')
+        except Exception as e:
+            # a cache, so a broken entry only costs an encode
+            dh.log('TextEmbeddingCache', 'load failed', key, e)
+        return None
+
+    @classmethod
+    def store(cls, key: Tuple[str, str], embed: torch.Tensor):
+        try:
+            if cls.backing() == 'disk':
+                os.makedirs(cls.directory(), exist_ok=True)
+                path = cls.path(key)
+                torch.save(embed.cpu(), path + '.tmp')
+                os.replace(path + '.tmp', path)
+            elif cls.backing() == 'redis':
+                buffer = io.BytesIO()
+                torch.save(embed.cpu(), buffer)
+                r.set(cls.KEY % cls.digest(key), buffer.getvalue(), ex=cls.TTL)
+        except Exception as e:
+            dh.log('TextEmbeddingCache', 'store failed', key, e)
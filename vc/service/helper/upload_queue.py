@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from time import sleep
+from typing import Callable, Dict, List, Tuple
+
+from vc.service.helper.diagnosis import DiagnosisHelper as dh
+
+
+class UploadQueue:
+    """Write-behind uploads on a small thread pool.
+
+    Files are copied into a staging dir when queued, because the pipeline
+    keeps overwriting (output.png, interim videos) and deleting (steps) the
+    originals straight after handing them over. Queuing a key that is still
+    waiting to go up replaces the staged copy, so a preview that changes every
+    frame is only uploaded as often as the pool can keep up with.
+    """
+    upload: Callable[..., None]
+    retries: int
+    retry_delay: float
+    staging_dir: str
+    executor: ThreadPoolExecutor
+    lock: threading.Lock
+    pending: Dict[str, Tuple[str, dict]]
+    futures: List[Future]
+    failed: List[str]
+
+    def __init__(
+        self,
+        upload: Callable[..., None],
+        workers: int = 4,
+        retries: int = 3,
+        retry_delay: float = 1.,
+        staging_dir: str = None
+    ):
+        self.upload = upload
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.staging_dir = staging_dir or tempfile.mkdtemp(prefix='vc-uploads-')
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='upload'
+        )
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.futures = []
+        self.failed = []
+
+    def put(self, local_file: str, key: str, **kwargs):
+        fd, staged = tempfile.mkstemp(
+            suffix='-%s' % os.path.basename(local_file),
+            dir=self.staging_dir
+        )
+        os.close(fd)
+        shutil.copyfile(local_file, staged)
+
+        with self.lock:
+            superseded = self.pending.get(key)
+            self.pending[key] = staged, kwargs
+            if superseded is not None:
+                # the queued task will pick up the newer copy instead
+                dh.debug('UploadQueue', 'coalesced', key)
+                os.remove(superseded[0])
+                return
+
+            self.futures = [f for f in self.futures if not f.done()]
+            self.futures.append(self.executor.submit(self.run, key))
+
+    def run(self, key: str):
+        with self.lock:
+            staged, kwargs = self.pending.pop(key)
+
+        try:
+            for attempt in range(1, self.retries + 1):
+                try:
+                    self.upload(staged, key, **kwargs)
+                    return
+                except Exception as e:
+                    dh.log('UploadQueue', 'upload failed', key, attempt, e)
+                    if attempt < self.retries:
+                        sleep(self.retry_delay * 2 ** (attempt - 1))
+            self.failed.append(key)
+        finally:
+            os.remove(staged)
+
+    def flush(self, timeout: float = None) -> List[str]:
+        """Blocks until everything queued so far is uploaded.
+
+        Returns the keys that ran out of retries since the last flush.
+        """
+        while True:
+            with self.lock:
+                futures = [f for f in self.futures if not f.done()]
+            if not futures:
+                break
+            wait(futures, timeout=timeout)
+            if timeout is not None:
+                break
+
+        failed, self.failed = self.failed, []
+        return failed
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
@@ -1004,7 +1004,10 @@ def get_midas_sample(args, aft_certain=None):
             image_name + args.img_format
         )
     }
-    height, width = imageio.imread(sample['ref_img_fi']).shape[:2]
+    if getattr(args, 'input_frame', None) is not None:
+        height, width = args.input_frame.height, args.input_frame.width
+    else:
+        height, width = imageio.imread(sample['ref_img_fi']).shape[:2]
     sample['int_mtx'] = np.array(
         [
             [max(height, width), 0, width // 2],
@@ -1103,6 +1106,11 @@ def read_midas_depth(disp_fi, disp_rescale=10., h=None, w=None):
         disp, _ = read_pfm(disp_fi)
     else:
         disp = imageio.imread(disp_fi).astype(np.float32)
+    return midas_depth(disp, disp_rescale, h, w)
+
+
+def midas_depth(disp, disp_rescale=10., h=None, w=None):
+    """Depth from a MiDaS disparity map, as read_midas_depth but in memory."""
     disp = disp - disp.min()
     disp = cv2.blur(disp / disp.max(), ksize=(3, 3)) * disp.max()
     disp = (disp / disp.max()) * disp_rescale
@@ -41,3 +41,6 @@ class VqganHelper:
         torch.cuda.empty_cache()
 
         return model
+
+    def is_gumbel(self, model):
+        return isinstance(model, vqgan.GumbelVQ)
@@ -1,7 +1,7 @@
 import gc
 import os
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Optional
 
 import cv2
 import imageio
@@ -12,6 +12,7 @@ from injector import inject
 
 from vc.service.file import FileService
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
+from vc.service.helper.frame import Frame
 from vc.service.helper.inpainting.bilateral_filtering import \
     sparse_bilateral_filtering
 from vc.service.helper.inpainting.mesh import (
@@ -25,9 +26,10 @@ from vc.service.helper.inpainting.networks import (
     Inpaint_Edge_Net,
 )
 from .helper.dimensions import DimensionsHelper
-from .helper.midas import run_depth
-from .helper.midas.utils import read_pfm
-from .helper.utils import get_midas_sample, read_midas_depth
+from .helper.model_registry import ModelRegistry
+from .helper.quantization import Quantizer
+from .helper.midas import DepthEstimator
+from .helper.utils import get_midas_sample, midas_depth
 
 
 @dataclass
@@ -36,6 +38,14 @@ class InpaintingOptions:
     depth_feat_model_ckpt: str = 'checkpoints/depth-model.pth'
     rgb_feat_model_ckpt: str = 'checkpoints/color-model.pth'
     midas_model_type: str = 'dpt_hybrid'  # use 'midas_v21_small' for faster
+    # torch, or onnx for the graph written by the onnx_export command
+    midas_backend: str = field(
+        default_factory=lambda: os.getenv('INFERENCE_BACKEND', 'torch')
+    )
+    # use the int8 networks made by the quantize command, on CPU
+    quantize: bool = field(
+        default_factory=lambda: bool(os.getenv('INPAINTING_QUANTIZE'))
+    )
     fps: int = 40
     num_frames: int = 200
     x_shift: float = 0.00
@@ -49,16 +59,22 @@ class InpaintingOptions:
     specific: str = ''
     longer_side_len: int = DimensionsHelper.width_small()
     input_file: str = 'output.png'
+    # read instead of input_file, which then only names the depth files
+    input_frame: Optional[Frame] = None
     output_filename: str = 'output.png'
+    # the output frame is returned either way
+    save_output: bool = True
     depth_folder: str = 'depth'
     mesh_folder: str = 'mesh'
     video_folder: str = None
     load_ply: bool = False
-    save_ply: bool = True
+    save_ply: bool = False  # meshes are handed over in memory unless asked
     inference_video: bool = True
     offscreen_rendering: bool = False
     img_format: str = '.png'
     depth_format: str = '.pfm'
+    # depth maps are handed over in memory unless asked for in depth_folder
+    save_depth: bool = False
     require_midas: bool = True
     depth_threshold: float = 0.04
     ext_edge_threshold: float = 0.002
@@ -66,6 +82,7 @@ class InpaintingOptions:
     filter_size: List[int] = field(default_factory=lambda: [7, 7, 5, 5, 5])
     sigma_s: float = 4.0
     sigma_r: float = 0.5
+    bilateral_backend: str = 'numpy'  # or 'torch' to filter on the GPU
     redundant_number: int = 12
     background_thickness: int = 70
     context_thickness: int = 140
@@ -94,6 +111,9 @@ class InpaintingService:
         "dpt_hybrid": "checkpoints/dpt_hybrid-midas-501f0c75.pt",
     }
     file_service: FileService
+    # float networks recording activation ranges, used instead of the
+    # resident ones while the quantize command calibrates
+    calibration_models: tuple = None
 
     @inject
     def __init__(self, file_service: FileService):
@@ -121,52 +141,20 @@ class InpaintingService:
             sample['tgt_name'] + '.ply'
         )
 
-        image = imageio.imread(sample['ref_img_fi'], pilmode="RGB")
-
-        midas_model_ckpt = self.model_paths[args.midas_model_type]
-        dh.debug('InpaintingService', 'Running depth extraction')
-        run_depth(
-            sample['ref_img_fi'],
-            args.depth_folder,
-            midas_model_ckpt,
-            args.midas_model_type
-        )
-
-        if 'npy' in args.depth_format:
-            depth_file = np.load(sample['depth_fi'])
-        elif 'pfm' in args.depth_format:
-            depth_file, _ = read_pfm(sample['depth_fi'])
-        else:
-            depth_file = imageio.imread(sample['depth_fi'])
-
-        args.output_h, args.output_w = depth_file.shape[:2]
-
-        frac = args.longer_side_len / max(args.output_h, args.output_w)
-        args.original_h = args.output_h = int(args.output_h * frac)
-        args.original_w = args.output_w = int(args.output_w * frac)
-
-        if image.ndim == 2:
-            image = image[..., None].repeat(3, -1)
-        if (
-            np.sum(np.abs(image[..., 0] - image[..., 1])) == 0
-            and np.sum(np.abs(image[..., 1] - image[..., 2])) == 0
-        ):
-            args.gray_image = True
+        if args.input_frame is not None:
+            image = args.input_frame.rgb()
         else:
-            args.gray_image = False
+            image = imageio.imread(sample['ref_img_fi'], pilmode="RGB")
 
-        image = cv2.resize(
-            image,
-            (args.output_w, args.output_h),
-            interpolation=cv2.INTER_AREA
-        )
+        dh.debug('InpaintingService', 'Running depth extraction')
+        disp = self.depth_estimator(args).estimate([image])[0]
+        if args.save_depth or os.getenv('DEBUG_FILES'):
+            DepthEstimator.save(
+                os.path.join(args.depth_folder, sample['tgt_name']),
+                disp
+            )
 
-        depth = read_midas_depth(
-            sample['depth_fi'],
-            3.0,
-            args.output_h,
-            args.output_w
-        )
+        image, depth = self.mesh_inputs(args, image, disp)
 
         mean_loc_depth = depth[depth.shape[0] // 2, depth.shape[1] // 2]
 
@@ -182,40 +170,10 @@ class InpaintingService:
             torch.cuda.empty_cache()
 
             dh.debug('InpaintingService', 'Start Running 3D_Photo', device)
-            dh.debug('InpaintingService', 'Loading edge model')
-            depth_edge_model = Inpaint_Edge_Net(init_weights=True)
-            depth_edge_weight = torch.load(
-                args.depth_edge_model_ckpt,
-                map_location=torch.device(
-                    device
-                )
-            )
-            depth_edge_model.load_state_dict(depth_edge_weight)
-            depth_edge_model = depth_edge_model.to(device)
-            depth_edge_model.eval()
-
-            dh.debug('InpaintingService', 'Loading depth model')
-            depth_feat_model = Inpaint_Depth_Net()
-            depth_feat_weight = torch.load(
-                args.depth_feat_model_ckpt,
-                map_location=torch.device(
-                    device
-                )
-            )
-            depth_feat_model.load_state_dict(depth_feat_weight, strict=True)
-            depth_feat_model = depth_feat_model.to(device)
-            depth_feat_model.eval()
-            depth_feat_model = depth_feat_model.to(device)
-
-            dh.debug('InpaintingService', 'Loading rgb model')
-            rgb_model = Inpaint_Color_Net()
-            rgb_feat_weight = torch.load(
-                args.rgb_feat_model_ckpt,
-                map_location=torch.device(device)
+            depth_edge_model, depth_feat_model, rgb_model = self.load_models(
+                args,
+                device
             )
-            rgb_model.load_state_dict(rgb_feat_weight)
-            rgb_model.eval()
-            rgb_model = rgb_model.to(device)
 
             dh.debug(
                 'InpaintingService',
@@ -236,15 +194,13 @@ class InpaintingService:
                 dh.log('InpaintingService', 'Failed to write ply')
                 return
 
+            # the networks themselves stay resident in the ModelRegistry
             del depth
-            del rgb_model
-            del depth_edge_model
-            del depth_feat_model
 
-        if args.save_ply is True or args.load_ply is True:
-            verts, colors, faces, height, width, hfov, vfov = read_ply(mesh_fi)
-        elif rt_info is not False:
+        if rt_info is not False:
             verts, colors, faces, height, width, hfov, vfov = rt_info
+        elif args.load_ply is True:
+            verts, colors, faces, height, width, hfov, vfov = read_ply(mesh_fi)
         else:
             dh.log('InpaintingService', 'Could not determine ply')
             return
@@ -269,7 +225,7 @@ class InpaintingService:
         down, right = top + args.output_h, left + args.output_w
         border = [int(xx) for xx in [top, down, left, right]]
 
-        output_3d_photo(
+        output = Frame.from_rgb(output_3d_photo(
             verts,
             colors,
             faces,
@@ -285,11 +241,154 @@ class InpaintingService:
             args.original_w,
             border=border,
             mean_loc_depth=mean_loc_depth
-        )
+        ))
 
         if os.getenv('DEBUG_FILES'):
-            return self.file_service.put(
+            if not args.save_output:
+                output.save(args.output_filename)
+            self.file_service.put(
                 args.output_filename, 'inpainting-%s' % (
                     args.output_filename
                 )
             )
+
+        return output
+
+    def load_models(self, args: InpaintingOptions, device):
+        if self.calibration_models is not None:
+            return self.calibration_models
+        if args.quantize:
+            missing = [
+                Quantizer.path(checkpoint)
+                for _, checkpoint in self.checkpoints(args)
+                if not os.path.isfile(Quantizer.path(checkpoint))
+            ]
+            if device.type != 'cpu':
+                dh.debug('InpaintingService', 'int8 networks only run on CPU')
+            elif missing:
+                # calibrating needs frames, so a worker can't make them itself
+                dh.log(
+                    'InpaintingService',
+                    'int8 networks missing, run the quantize command; using float',
+                    missing
+                )
+            else:
+                return self.load_quantized_models(args)
+
+        depth_edge_model = ModelRegistry.get(
+            'inpaint_edge',
+            args.depth_edge_model_ckpt,
+            lambda: self.load_model(
+                Inpaint_Edge_Net(init_weights=True),
+                args.depth_edge_model_ckpt,
+                device
+            ),
+            device
+        )
+        depth_feat_model = ModelRegistry.get(
+            'inpaint_depth',
+            args.depth_feat_model_ckpt,
+            lambda: self.load_model(
+                Inpaint_Depth_Net(),
+                args.depth_feat_model_ckpt,
+                device
+            ),
+            device
+        )
+        rgb_model = ModelRegistry.get(
+            'inpaint_color',
+            args.rgb_feat_model_ckpt,
+            lambda: self.load_model(
+                Inpaint_Color_Net(),
+                args.rgb_feat_model_ckpt,
+                device
+            ),
+            device
+        )
+        return depth_edge_model, depth_feat_model, rgb_model
+
+    def mesh_inputs(
+        self,
+        args: InpaintingOptions,
+        image: np.ndarray,
+        disp: np.ndarray
+    ):
+        """The image and depth the mesh is built at, from a frame and its MiDaS depth."""
+        args.output_h, args.output_w = disp.shape[:2]
+
+        frac = args.longer_side_len / max(args.output_h, args.output_w)
+        args.original_h = args.output_h = int(args.output_h * frac)
+        args.original_w = args.output_w = int(args.output_w * frac)
+
+        if image.ndim == 2:
+            image = image[..., None].repeat(3, -1)
+        if (
+            np.sum(np.abs(image[..., 0] - image[..., 1])) == 0
+            and np.sum(np.abs(image[..., 1] - image[..., 2])) == 0
+        ):
+            args.gray_image = True
+        else:
+            args.gray_image = False
+
+        image = cv2.resize(
+            image,
+            (args.output_w, args.output_h),
+            interpolation=cv2.INTER_AREA
+        )
+
+        depth = midas_depth(
+            disp,
+            3.0,
+            args.output_h,
+            args.output_w
+        )
+
+        return image, depth
+
+    def depth_estimator(
+        self,
+        args: InpaintingOptions,
+        batch_size: int = None
+    ) -> DepthEstimator:
+        return DepthEstimator(
+            self.model_paths[args.midas_model_type],
+            args.midas_model_type,
+            backend=args.midas_backend,
+            batch_size=batch_size
+        )
+
+    def load_quantized_models(self, args: InpaintingOptions):
+        return tuple(
+            ModelRegistry.get(
+                '%s_int8' % key,
+                checkpoint,
+                lambda checkpoint=checkpoint: Quantizer.load(
+                    Quantizer.path(checkpoint)
+                ),
+                torch.device('cpu')
+            )
+            for key, checkpoint in self.checkpoints(args)
+        )
+
+    def checkpoints(self, args: InpaintingOptions):
+        """The registry key and checkpoint of each of the load_models networks."""
+        return [
+            ('inpaint_edge', args.depth_edge_model_ckpt),
+            ('inpaint_depth', args.depth_feat_model_ckpt),
+            ('inpaint_color', args.rgb_feat_model_ckpt),
+        ]
+
+    def load_model(self, model, checkpoint, device):
+        dh.debug('InpaintingService', 'Loading model', checkpoint)
+        weight = torch.load(checkpoint, map_location=torch.device(device))
+        model.load_state_dict(weight, strict=True)
+        model = model.to(device)
+        model.eval()
+        return model
+
+    def warm_up(self, args: InpaintingOptions = None):
+        if args is None:
+            args = InpaintingOptions()
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.load_models(args, device)
+        self.depth_estimator(args)
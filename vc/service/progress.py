@@ -0,0 +1,106 @@
+import json
+from dataclasses import asdict
+from typing import List, Optional
+
+from redis.client import PubSub
+
+from vc.r import r
+from vc.value_object.generation_progress import GenerationProgress
+
+
+class ProgressService:
+    """Latest progress of running generation requests, kept in Redis.
+
+    Jobs write here after every step and only persist to the database every
+    so often, so the API overlays whatever is in Redis on top of the row to
+    serve fresh progress without a commit per step. Every write is also
+    published as a delta for the event stream; changes that aren't progress
+    (completion, results, cancelling...) go out as a bare status event telling
+    clients to reload that request.
+    """
+    KEY = 'generation-progress:%s'
+    CHANNEL = 'generation-progress'
+    TTL = 60 * 60 * 24
+    FIELDS = [
+        'steps_completed',
+        'steps_total',
+        'name',
+        'preview',
+        'interim',
+        'interim_watermarked',
+    ]
+    INTEGER_FIELDS = ['steps_completed', 'steps_total']
+
+    def put(self, id_: int, progress: GenerationProgress):
+        mapping = {
+            key: value
+            for key, value in asdict(progress).items()
+            if key in self.FIELDS and value is not None
+        }
+        key = self.KEY % id_
+        pipeline = r.pipeline()
+        pipeline.hset(key, mapping=mapping)
+        pipeline.expire(key, self.TTL)
+        pipeline.publish(self.CHANNEL, json.dumps({
+            'event': 'progress',
+            'id': id_,
+            **mapping,
+        }))
+        pipeline.execute()
+
+    def publish_status(self, id_: int, status: str):
+        r.publish(self.CHANNEL, json.dumps({
+            'event': 'status',
+            'id': id_,
+            'status': status,
+        }))
+
+    def subscribe(self) -> PubSub:
+        pubsub = r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.CHANNEL)
+        return pubsub
+
+    def get(self, id_: int) -> Optional[dict]:
+        return self.decode(r.hgetall(self.KEY % id_))
+
+    def get_many(self, ids: List[int]) -> List[Optional[dict]]:
+        pipeline = r.pipeline()
+        for id_ in ids:
+            pipeline.hgetall(self.KEY % id_)
+        return [self.decode(raw) for raw in pipeline.execute()]
+
+    def clear(self, id_: int):
+        r.delete(self.KEY % id_)
+
+    def apply(self, data: dict) -> dict:
+        """Overlays the buffered progress on one marshalled request."""
+        return self.overlay(data, self.get(data['id']))
+
+    def apply_many(self, data: List[dict]) -> List[dict]:
+        return [
+            self.overlay(item, progress)
+            for item, progress in zip(
+                data,
+                self.get_many([item['id'] for item in data])
+            )
+        ]
+
+    def overlay(self, data: dict, progress: Optional[dict]) -> dict:
+        if progress:
+            for key, value in progress.items():
+                # only overlay what the schema exposes
+                if key in data:
+                    data[key] = value
+        return data
+
+    def decode(self, raw: dict) -> Optional[dict]:
+        if not raw:
+            return None
+        progress = {
+            key.decode('utf-8'): value.decode('utf-8')
+            for key, value in raw.items()
+        }
+        for key in self.INTEGER_FIELDS:
+            if key in progress:
+                progress[key] = int(progress[key])
+        return progress
@@ -1,7 +1,7 @@
 import os
 import warnings
-from dataclasses import dataclass
-from typing import Callable
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
 
 import cv2
 import torch
@@ -10,20 +10,166 @@ from torch.nn import functional as F
 
 from vc.service.file import FileService
 from .helper.diagnosis import DiagnosisHelper as dh
+from .helper.frame import Frame
+from .helper.model_registry import ModelRegistry
+from .helper.onnx_backend import OnnxBackend, OnnxModule
 from .helper.rife.model.RIFE_HDv3 import Model
 
 warnings.filterwarnings("ignore")
 
 @dataclass
 class RifeOptions:
-    first_file: str
-    second_file: str
-    output_file: Callable[[int], str]
+    first_file: str = None
+    second_file: str = None
+    # None only returns the frames in between
+    output_file: Optional[Callable[[int], str]] = None
+    # used instead of the files when given
+    first_frame: Optional[Frame] = None
+    second_frame: Optional[Frame] = None
     model_dir: str = 'checkpoints'
     exp: int = 2
     ratio: float = 0
     rthreshold: float = 0.02
     rmaxcycles: int = 8
+    # pairs per forward pass, for sequences and handle_pairs
+    batch_size: int = field(
+        default_factory=lambda: int(os.getenv('RIFE_BATCH_SIZE', 8))
+    )
+    # torch, or onnx for the graph written by the onnx_export command
+    backend: str = field(
+        default_factory=lambda: os.getenv('INFERENCE_BACKEND', 'torch')
+    )
+
+
+class RifeInference(torch.nn.Module):
+    """Model.inference as a module, to export the flownet with."""
+
+    def __init__(self, flownet: torch.nn.Module):
+        super().__init__()
+        self.flownet = flownet
+
+    def forward(self, img0, img1):
+        flow, mask, merged = self.flownet(torch.cat((img0, img1), 1), [4, 2, 1])
+        return merged[2]
+
+
+class OnnxRifeModel:
+    """Runs Model.inference (at scale 1) on the exported graph.
+
+    Graphs exported at a fixed size, before it was exported with dynamic
+    axes, only take frames of that size; others go through the torch model.
+    """
+    module: OnnxModule
+    fallback: Callable[[], Model]
+
+    def __init__(self, module: OnnxModule, fallback: Callable[[], Model]):
+        self.module = module
+        self.fallback = fallback
+
+    def inference(self, img0, img1, scale=1.0):
+        if not self.module.accepts(img0, img1):
+            dh.debug('OnnxRifeModel', 'falling back to torch for', tuple(img0.shape))
+            return self.fallback().inference(img0, img1, scale)
+        return self.module(img0, img1)
+
+
+class RifeSequence:
+    """Interpolates a stream of same sized frames, pair by adjacent pair.
+
+    Every frame is uploaded and padded once; written frames wait until
+    batch_size pairs are ready, and then each level of every pair goes
+    through the model as one batch. Output is passed to on_frame in order
+    as (index, frame): the frames written, 2 ** exp apart starting at
+    start, with the interpolated ones in between. The last frame stays on
+    the device, so the next write carries on from it.
+    """
+    service: 'RifeService'
+    model: Model
+    args: RifeOptions
+    on_frame: Callable[[int, Frame], None]
+
+    index: int
+    last: Optional[torch.Tensor] = None
+    pending: List[Tuple[Frame, torch.Tensor]]
+    size: tuple = None
+
+    def __init__(
+        self,
+        service: 'RifeService',
+        model: Model,
+        args: RifeOptions,
+        on_frame: Callable[[int, Frame], None],
+        start: int = 1
+    ):
+        self.service = service
+        self.model = model
+        self.args = args
+        self.on_frame = on_frame
+        self.index = start - self.multiple
+        self.pending = []
+
+    @property
+    def multiple(self) -> int:
+        return 2 ** self.args.exp
+
+    def write(self, frame: Frame):
+        img = self.upload(frame)
+        if self.last is None:
+            self.index += self.multiple
+            self.last = img
+            self.on_frame(self.index, frame)
+            return
+
+        self.pending.append((frame, img))
+        if len(self.pending) >= self.args.batch_size:
+            self.flush()
+
+    def seed(self, frame: Frame, index: int):
+        """Carries on from a frame already output elsewhere, at index."""
+        self.flush()
+        self.size = None
+        self.last = self.upload(frame)
+        self.index = index
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        frames = [frame for frame, _ in self.pending]
+        imgs = [self.last] + [img for _, img in self.pending]
+        dh.debug('RifeSequence', 'interpolating batch of', len(frames))
+        with torch.no_grad():
+            mids = self.service.interpolate(
+                self.model,
+                torch.cat(imgs[:-1]),
+                torch.cat(imgs[1:]),
+                self.args.exp
+            )
+        outputs = [self.service.to_bgr(mid, *self.size) for mid in mids]
+
+        for k, frame in enumerate(frames):
+            for output in outputs:
+                self.index += 1
+                self.on_frame(self.index, Frame.from_bgr(output[k]))
+            self.index += 1
+            self.on_frame(self.index, frame)
+
+        self.last = imgs[-1]
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.last = None
+
+    def upload(self, frame: Frame) -> torch.Tensor:
+        if self.size is None:
+            self.size = frame.width, frame.height
+        elif (frame.width, frame.height) != self.size:
+            raise RuntimeError('RIFE sequence frames must all be %sx%s, got %s' % (
+                *self.size,
+                frame
+            ))
+        return self.service.pad(self.service.to_batch([frame]))
 
 
 class RifeService:
@@ -34,47 +180,32 @@ class RifeService:
     def __init__(self, file_service: FileService):
         self.file_service = file_service
 
-    def handle(self, args: RifeOptions):
-        with torch.no_grad():
-            model = Model()
-            model.load_model(args.model_dir, -1)
-            dh.debug('RifeService', 'loaded v3.x HD model.')
-
-            model.eval()
-            model.device()
+    def handle(self, args: RifeOptions) -> List[Frame]:
+        if args.first_frame is not None:
+            first = args.first_frame
+        else:
+            first = Frame.from_bgr(cv2.imread(args.first_file, cv2.IMREAD_UNCHANGED))
+        if args.second_frame is not None:
+            second = args.second_frame
+        else:
+            second = Frame.from_bgr(cv2.imread(args.second_file, cv2.IMREAD_UNCHANGED))
 
-            img0 = cv2.imread(args.first_file, cv2.IMREAD_UNCHANGED)
-            img1 = cv2.imread(args.second_file, cv2.IMREAD_UNCHANGED)
-            img0 = (torch.tensor(img0.transpose(2, 0, 1)).to(self.device) / 255.).unsqueeze(0)
-            img1 = (torch.tensor(img1.transpose(2, 0, 1)).to(self.device) / 255.).unsqueeze(0)
-
-            n, c, h, w = img0.shape
-            ph = ((h - 1) // 32 + 1) * 32
-            pw = ((w - 1) // 32 + 1) * 32
-            padding = (0, pw - w, 0, ph - h)
-            img0 = F.pad(img0, padding)
-            img1 = F.pad(img1, padding)
-
-            img_list = [img0, img1]
-            for i in range(args.exp):
-                tmp = []
-                for j in range(len(img_list) - 1):
-                    mid = model.inference(img_list[j], img_list[j + 1])
-                    tmp.append(img_list[j])
-                    tmp.append(mid)
-                tmp.append(img1)
-                img_list = tmp
-
-            for i, img in enumerate(img_list):
-                if i == 0 or i == len(img_list) - 1:
-                    continue
+        frames = []
+        sequence = self.open_sequence(
+            args,
+            lambda i, frame: frames.append(frame),
+            start=0
+        )
+        sequence.write(first)
+        sequence.write(second)
+        sequence.close()
+        frames = frames[1:-1]
 
+        if args.output_file is not None:
+            for i, frame in enumerate(frames, start=1):
                 output_file = args.output_file(i)
                 dh.debug('RifeService', 'writing RIFE image', output_file)
-                cv2.imwrite(
-                    output_file,
-                    (img[0] * 255).byte().cpu().numpy().transpose(1, 2, 0)[:h, :w]
-                )
+                frame.save(output_file)
 
                 if os.getenv('DEBUG_FILES'):
                     self.file_service.put(
@@ -84,4 +215,150 @@ class RifeService:
                         )
                     )
 
-        torch.cuda.empty_cache()
+        return frames
+
+    def handle_dir(self, steps_dir: str, output_dir: str, args: RifeOptions) -> int:
+        """Interpolates the numbered frames of steps_dir into output_dir.
+
+        Returns the number of frames written.
+        """
+        filenames = sorted(
+            filename
+            for filename in os.listdir(steps_dir)
+            if os.path.splitext(filename)[0].isdigit()
+        )
+        os.makedirs(output_dir, exist_ok=True)
+
+        def write(i: int, frame: Frame):
+            frame.save(os.path.join(output_dir, f'{i:04}.png'))
+
+        sequence = self.open_sequence(args, write)
+        for filename in filenames:
+            sequence.write(Frame.load(os.path.join(steps_dir, filename)))
+        sequence.close()
+
+        return sequence.index if filenames else 0
+
+    def open_sequence(
+        self,
+        args: RifeOptions,
+        on_frame: Callable[[int, Frame], None],
+        start: int = 1
+    ) -> RifeSequence:
+        return RifeSequence(
+            self,
+            self.load_model(args.model_dir, args.backend),
+            args,
+            on_frame,
+            start=start
+        )
+
+    def handle_pairs(
+        self,
+        pairs: List[Tuple[Frame, Frame]],
+        args: RifeOptions = None
+    ) -> List[List[Frame]]:
+        """Interpolates many pairs, batch_size same sized pairs at a time.
+
+        Returns the frames in between for each pair, as handle does. Pairs
+        that do not follow on from each other go here; a run of frames is
+        better written to a sequence, which uploads every frame only once.
+        """
+        if args is None:
+            args = RifeOptions()
+        results = [None] * len(pairs)
+        by_size = {}
+        for i, (first, _) in enumerate(pairs):
+            by_size.setdefault((first.width, first.height), []).append(i)
+        batches = [
+            indexes[start:start + args.batch_size]
+            for indexes in by_size.values()
+            for start in range(0, len(indexes), args.batch_size)
+        ]
+
+        with torch.no_grad():
+            model = self.load_model(args.model_dir, args.backend)
+            for indexes in batches:
+                dh.debug('RifeService', 'interpolating batch of', len(indexes))
+                first, second = pairs[indexes[0]]
+                mids = self.interpolate(
+                    model,
+                    self.pad(self.to_batch([pairs[i][0] for i in indexes])),
+                    self.pad(self.to_batch([pairs[i][1] for i in indexes])),
+                    args.exp
+                )
+                outputs = [
+                    self.to_bgr(mid, first.width, first.height)
+                    for mid in mids
+                ]
+                for k, i in enumerate(indexes):
+                    results[i] = [
+                        Frame.from_bgr(output[k]) for output in outputs
+                    ]
+
+        return results
+
+    def interpolate(
+        self,
+        model: Model,
+        img0: torch.Tensor,
+        img1: torch.Tensor,
+        exp: int
+    ) -> List[torch.Tensor]:
+        """The 2 ** exp - 1 frames between each pair of the batches, in order.
+
+        At every level all the gaps of all the pairs go through the model in
+        one inference call.
+        """
+        n = img0.shape[0]
+        img_list = [img0, img1]
+        for i in range(exp):
+            mids = model.inference(
+                torch.cat(img_list[:-1]),
+                torch.cat(img_list[1:])
+            ).split(n)
+            tmp = []
+            for j, mid in enumerate(mids):
+                tmp.append(img_list[j])
+                tmp.append(mid)
+            tmp.append(img_list[-1])
+            img_list = tmp
+        return img_list[1:-1]
+
+    def load_model(self, model_dir: str, backend: str = 'torch') -> Model:
+        if backend == OnnxBackend.NAME:
+            return ModelRegistry.get(
+                'rife_onnx',
+                model_dir,
+                lambda: OnnxRifeModel(
+                    OnnxModule('rife'),
+                    lambda: self.load_model(model_dir)
+                ),
+                torch.device('cpu')
+            )
+
+        def load():
+            model = Model()
+            model.load_model(model_dir, -1)
+            dh.debug('RifeService', 'loaded v3.x HD model.')
+            model.eval()
+            model.device()
+            return model
+
+        return ModelRegistry.get('rife', model_dir, load)
+
+    def to_batch(self, frames: List[Frame]) -> torch.Tensor:
+        return torch.stack([
+            torch.from_numpy(frame.bgr().transpose(2, 0, 1))
+            for frame in frames
+        ]).to(self.device).float() / 255.
+
+    def pad(self, img: torch.Tensor) -> torch.Tensor:
+        n, c, h, w = img.shape
+        ph = ((h - 1) // 32 + 1) * 32
+        pw = ((w - 1) // 32 + 1) * 32
+        return F.pad(img, (0, pw - w, 0, ph - h))
+
+    def to_bgr(self, img: torch.Tensor, width: int, height: int):
+        """uint8 BGR arrays, cropped back from a padded batch."""
+        return (img * 255).byte().cpu().numpy().transpose(0, 2, 3, 1)[:, :height, :width]
@@ -2,17 +2,25 @@ import os
 import random
 import shutil
 import string
+import subprocess
 from datetime import datetime
+from typing import List
 
 from injector import inject
 
 from vc.service import FileService
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
+from vc.service.helper.encoder import EncoderSession
 
 
 class VideoService:
     DEFAULT_FRAMERATE = 25
     STEPS_DIR = 'steps'
+    SEGMENTS_DIR = 'segments'
+    WATERMARK_FILE = 'app/assets/watermark-%s.png'
+    NVENC_ARGS = ['-b:v', '8M', '-c:v', 'h264_nvenc']
+    X264_ARGS = ['-b:v', '8M', '-c:v', 'libx264', '-preset', 'fast']
+    OUTPUT_ARGS = ['-pix_fmt', 'yuv420p', '-strict', '-2']
     OUTPUT_FILENAME = 'output.mp4'
     MINTERPOLATE_CONFIG = {
         'mi_mode': 'mci',
@@ -23,10 +31,127 @@ class VideoService:
     }
     file_service: FileService
 
+    nvenc_available: bool = None
+
     @inject
     def __init__(self, file_service: FileService):
         self.file_service = file_service
 
+    @classmethod
+    def has_nvenc(cls) -> bool:
+        # h264_nvenc shows up in `ffmpeg -encoders` whenever ffmpeg was built
+        # with it, GPU or not, so actually try to encode a frame
+        if cls.nvenc_available is None:
+            result = subprocess.run(
+                [
+                    'ffmpeg', '-hide_banner',
+                    '-f', 'lavfi',
+                    '-i', 'color=black:s=256x256',
+                    '-frames:v', '1',
+                    '-c:v', 'h264_nvenc',
+                    '-f', 'null', '-',
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            cls.nvenc_available = result.returncode == 0
+            if not cls.nvenc_available:
+                dh.log('VideoService', 'h264_nvenc unavailable, using libx264')
+        return cls.nvenc_available
+
+    def encode_args(self) -> List[str]:
+        return (
+            self.NVENC_ARGS if self.has_nvenc() else self.X264_ARGS
+        ) + self.OUTPUT_ARGS
+
+    def minterpolate_filter(self) -> str:
+        return 'minterpolate=%s' % ':'.join([
+            '='.join([key, value])
+            for key, value
+            in self.MINTERPOLATE_CONFIG.items()
+        ])
+
+    def input_args(self, steps_dir: str, fps_multiple: int) -> List[str]:
+        return [
+            '-framerate', str(self.DEFAULT_FRAMERATE * fps_multiple),
+            '-i', '%s/%%04d.png' % steps_dir,
+        ]
+
+    def run(self, cmd: List[str]):
+        dh.debug('VideoService', 'running', ' '.join(cmd))
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        if result.returncode != 0:
+            dh.log('VideoService', 'ffmpeg failed', ' '.join(cmd))
+
+    def encode_unwatermarked(
+        self,
+        output_file: str,
+        steps_dir: str = STEPS_DIR,
+        interpolate: bool = False,
+        fps_multiple: int = 1
+    ):
+        cmd = ['ffmpeg', '-y'] + self.input_args(steps_dir, fps_multiple)
+        if interpolate:
+            cmd += ['-filter:v', self.minterpolate_filter()]
+        self.run(cmd + self.encode_args() + [output_file])
+
+    def encode_watermarked(
+        self,
+        output_file: str,
+        steps_dir: str = STEPS_DIR,
+        width: int = int(os.getenv('SIZE_WIDTH_SM', 400)),
+        fps_multiple: int = 1
+    ):
+        self.run(
+            ['ffmpeg', '-y']
+            + self.input_args(steps_dir, fps_multiple)
+            + [
+                '-i', self.WATERMARK_FILE % width,
+                '-filter_complex', 'overlay=0:0',
+            ]
+            + self.encode_args()
+            + [output_file]
+        )
+
+    def encode_videos(
+        self,
+        unwatermarked_file: str,
+        watermarked_file: str,
+        steps_dir: str = STEPS_DIR,
+        width: int = int(os.getenv('SIZE_WIDTH_SM', 400)),
+        interpolate: bool = False,
+        fps_multiple: int = 1
+    ):
+        """Decodes the steps once and encodes both outputs in one process."""
+        unwatermarked_filter = (
+            '[plain]%s[unwatermarked]' % self.minterpolate_filter()
+            if interpolate
+            else '[plain]null[unwatermarked]'
+        )
+        filter_graph = ';'.join([
+            '[0:v]split=2[plain][overlaid]',
+            unwatermarked_filter,
+            '[overlaid][1:v]overlay=0:0[watermarked]',
+        ])
+        encode_args = self.encode_args()
+        self.run(
+            ['ffmpeg', '-y']
+            + self.input_args(steps_dir, fps_multiple)
+            + [
+                '-i', self.WATERMARK_FILE % width,
+                '-filter_complex', filter_graph,
+                '-map', '[unwatermarked]',
+            ]
+            + encode_args
+            + [unwatermarked_file, '-map', '[watermarked]']
+            + encode_args
+            + [watermarked_file]
+        )
+
     def make_unwatermarked_video(
         self,
         output_file=OUTPUT_FILENAME,
@@ -39,24 +164,12 @@ class VideoService:
         if suffix is None:
             suffix = self.generate_suffix()
         output_file = output_file.replace('.mp4', '-%s.mp4' % suffix)
-
-        # @todo might be worth breaking this into a couple of steps for clarity
-        minterpolate_string = '-filter:v "minterpolate=\'%s\'"' % ':'.join([
-            '='.join([key, value])
-            for key, value
-            in self.MINTERPOLATE_CONFIG.items()
-        ]) if interpolate else ''
-
-        cmd = ' '.join([
-            'ffmpeg -y ',
-            '-framerate %s' % (self.DEFAULT_FRAMERATE * fps_multiple),
-            '-i "%s/%%04d.png"' % steps_dir,
-            '-b:v 8M -c:v h264_nvenc -pix_fmt yuv420p -strict -2',
-            minterpolate_string,
-            output_file
-        ])
-        dh.debug('VideoService', 'running', cmd)
-        os.system(cmd)
+        self.encode_unwatermarked(
+            output_file,
+            steps_dir,
+            interpolate,
+            fps_multiple
+        )
 
         return self.file_service.put(output_file, output_file, now)
 
@@ -70,18 +183,73 @@ class VideoService:
     ):
         suffix = 'watermarked'
         output_file = output_file.replace('.mp4', '-%s.mp4' % suffix)
-        watermark_file = 'app/assets/watermark-%s.png' % width
-        os.system(' '.join([
-            'ffmpeg -y',
-            '-framerate %s' % (self.DEFAULT_FRAMERATE * fps_multiple),
-            '-i "%s/%%04d.png"' % steps_dir,
-            '-i %s -filter_complex "overlay=0:0"' % watermark_file,
-            '-b:v 8M -c:v h264_nvenc -pix_fmt yuv420p -strict -2',
-            output_file
-        ]))
+        self.encode_watermarked(output_file, steps_dir, width, fps_multiple)
 
         return self.file_service.put(output_file, output_file, now)
 
+    def make_videos(
+        self,
+        width: int = int(os.getenv('SIZE_WIDTH_SM', 400)),
+        output_file=OUTPUT_FILENAME,
+        steps_dir=STEPS_DIR,
+        now: datetime = None,
+        suffix: str = None,
+        interpolate: bool = False,
+        fps_multiple: int = 1
+    ):
+        if suffix is None:
+            suffix = self.generate_suffix()
+        unwatermarked_file = output_file.replace('.mp4', '-%s.mp4' % suffix)
+        watermarked_file = output_file.replace('.mp4', '-watermarked.mp4')
+        self.encode_videos(
+            unwatermarked_file,
+            watermarked_file,
+            steps_dir,
+            width,
+            interpolate,
+            fps_multiple
+        )
+
+        return (
+            self.file_service.put(unwatermarked_file, unwatermarked_file, now),
+            self.file_service.put(watermarked_file, watermarked_file, now),
+        )
+
+    def open_session(
+        self,
+        width: int,
+        height: int,
+        fps_multiple: int = 1,
+        work_dir: str = SEGMENTS_DIR
+    ) -> EncoderSession:
+        return EncoderSession(
+            work_dir,
+            self.DEFAULT_FRAMERATE * fps_multiple,
+            self.encode_args(),
+            width,
+            height
+        )
+
+    def make_session_videos(
+        self,
+        session: EncoderSession,
+        output_file=OUTPUT_FILENAME,
+        now: datetime = None,
+        suffix: str = None
+    ):
+        if suffix is None:
+            suffix = self.generate_suffix()
+        unwatermarked_file = output_file.replace('.mp4', '-%s.mp4' % suffix)
+        watermarked_file = output_file.replace('.mp4', '-watermarked.mp4')
+
+        session.concat('unwatermarked', unwatermarked_file)
+        session.concat('watermarked', watermarked_file)
+
+        return (
+            self.file_service.put(unwatermarked_file, unwatermarked_file, now),
+            self.file_service.put(watermarked_file, watermarked_file, now),
+        )
+
     # unused as this doesn't give us as much return as we might like @todo VC-29
     def optimize(self, filepath):
         optimized = 'optimized-%s' % filepath
@@ -1,7 +1,8 @@
 import json
 import math
 import os
-from dataclasses import dataclass, field, asdict
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from typing import List, Optional
 from urllib.request import urlopen
 
@@ -20,8 +21,13 @@ from tqdm import tqdm
 from CLIP import clip
 from vc.service import FileService
 from vc.service.helper.dimensions import DimensionsHelper
-from vc.service.helper.clip import ClipHelper
+from vc.service.helper.clip import ClipHelper, TextEncoder
+from vc.service.helper.convergence import ConvergencePolicy, IterationStats
+from vc.service.helper.frame import Frame
 from vc.service.helper.vqgan import VqganHelper
+from vc.service.helper.model_registry import ModelRegistry
+from vc.service.helper.quantization import Quantizer
+from vc.service.helper.text_embedding_cache import TextEmbeddingCache
 from vc.service.helper.diagnosis import DiagnosisHelper as dh
 
 
@@ -33,7 +39,11 @@ class VqganClipOptions:
     display_freq: int = None
     size: List[int] = None
     init_image: Optional[str] = 'output.png'
+    # used instead of init_image when given
+    init_frame: Optional[Frame] = None
     output_filename: str = 'output.png'
+    # the output frame is returned either way
+    save_output: bool = True
     init_noise: str = 'gradient'
     init_weight: float = 0.
     clip_model: str = 'ViT-B/32'
@@ -48,6 +58,40 @@ class VqganClipOptions:
     optimiser: str = 'Adam'
     cudnn_determinism: bool = False
     augments: str = None
+    checkpoint_file: str = None
+    checkpoint_every: int = 25
+    # autocast the VQGAN decode and CLIP encode: float16 with loss scaling on
+    # CUDA, bfloat16 on CPU unless amp_dtype says otherwise
+    # the defaults are read per instance, as .env is only loaded by create_app
+    amp: bool = field(default_factory=lambda: bool(os.getenv('VQGAN_AMP')))
+    amp_dtype: str = field(
+        default_factory=lambda: os.getenv('VQGAN_AMP_DTYPE') or None
+    )
+    channels_last: bool = field(
+        default_factory=lambda: bool(os.getenv('VQGAN_CHANNELS_LAST'))
+    )
+    # stop before max_iterations once the mean loss of the last
+    # convergence_window iterations improves on the window before by less
+    # than convergence_threshold (relative), after at least min_iterations
+    convergence_window: int = None
+    convergence_threshold: float = 0.005
+    min_iterations: int = 0
+    # encode prompts with the int8 text encoder, on the CPU
+    quantize_text: bool = field(
+        default_factory=lambda: bool(os.getenv('VQGAN_QUANTIZE_TEXT'))
+    )
+
+
+@dataclass
+class LatentSpace:
+    toksX: int
+    toksY: int
+    sideX: int
+    sideY: int
+    e_dim: int
+    n_toks: int
+    z_min: torch.Tensor
+    z_max: torch.Tensor
 
 
 class VqganClipService:
@@ -55,6 +99,11 @@ class VqganClipService:
     vqgan_helper: VqganHelper
     clip_helper: ClipHelper
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    amp_dtype: torch.dtype = None
+    channels_last: bool = False
+    # how the latents of the last handle/handle_batch call went
+    stats: List[IterationStats] = None
+    frames: List[Frame] = None
 
     @inject
     def __init__(self, file_service: FileService):
@@ -65,8 +114,246 @@ class VqganClipService:
         self.file_service = file_service
 
     def handle(self, args: VqganClipOptions):
-        dh.debug('VqganClipService', json.dumps(asdict(args), indent=4))
+        dh.debug('VqganClipService', json.dumps(vars(args), indent=4, default=repr))
+
+        self.prepare(args)
+        self.frames = None
+        model, perceptor = self.load_models(args)
+        latent = self.latent_space(args, model)
+
+        z = self.init_latent(args, model, latent)
+        z_orig = z.clone()
+        z.requires_grad_(True)
+
+        prompts = self.encode_prompts(args, perceptor, latent)
+        opt = self.make_optimiser(args, z)
+        scaler = self.make_scaler()
+
+        # Output for the user
+        dh.debug('VqganClipService', 'Using device:', self.device)
+        dh.debug('VqganClipService', 'Optimising using:', args.optimiser)
+
+        if args.prompts:
+            dh.debug('VqganClipService', 'Using text prompts:', args.prompts)
+        if args.image_prompts:
+            dh.debug('VqganClipService', 'Using image prompts:', args.image_prompts)
+        if args.init_image:
+            dh.debug('VqganClipService', 'Using initial image:', args.init_image)
+        if args.noise_prompt_weights:
+            dh.debug('VqganClipService', 'Noise prompt weights:', args.noise_prompt_weights)
+
+        self.seed_rng(args)
+
+        i = 0
+        if args.checkpoint_file:
+            i = self.load_latent(args, z, opt)
+
+        policy = self.convergence_policy(args)
+        stats = IterationStats(iterations=i, max_iterations=args.max_iterations)
+        losses = None
+
+        # DO IT @todo put training in a separate Trainer class
+        try:
+            with tqdm(initial=i) as pbar:
+                while i < args.max_iterations:
+                    if args.checkpoint_file and (
+                        i % args.checkpoint_every == 0
+                        or i == args.max_iterations - 1
+                    ):
+                        self.save_latent(args, z, opt, i)
+                    losses = self.train(
+                        model,
+                        perceptor,
+                        [args],
+                        [prompts],
+                        [opt],
+                        [z],
+                        [z_orig],
+                        latent,
+                        i,
+                        scaler
+                    )
+                    i += 1
+                    pbar.update()
+                    if policy is not None and policy.converged(
+                        i - 1,
+                        losses[0].item()
+                    ):
+                        stats.converged = True
+                        break
+        except KeyboardInterrupt:
+            pass
+
+        if stats.converged:
+            # the output is only written on display iterations otherwise
+            self.checkin(
+                model,
+                [z],
+                [args.prompts],
+                [args.output_filename if args.save_output else None],
+                i,
+                [[losses[0]]]
+            )
+
+        # model and perceptor stay resident in the ModelRegistry
+        del opt
+        torch.cuda.empty_cache()
+
+        frame = self.frames[0] if self.frames else None
+        self.debug_files(args, frame)
+
+        stats.iterations = i
+        stats.loss = None if losses is None else losses[0].item()
+        self.stats = [stats]
+        dh.debug('VqganClipService', 'stats', stats)
+
+        # the last loss is in stats
+        return frame
+
+    def handle_batch(self, args_list: List[VqganClipOptions]):
+        """Optimises one latent per options through a shared forward/backward.
+
+        The decoder, the cutouts and CLIP each run once per iteration on the
+        whole batch, while every latent keeps its own prompts, optimiser state
+        and output file. The options have to agree on everything that shapes
+        that shared pass (see batch_key); latent checkpoints aren't kept.
+        Returns the output frame of each latent.
+        """
+        if len(args_list) == 1:
+            return [self.handle(args_list[0])]
+
+        self.frames = None
+
+        for args in args_list:
+            dh.debug('VqganClipService', json.dumps(vars(args), indent=4, default=repr))
+            self.prepare(args)
+        if len({self.batch_key(args) for args in args_list}) > 1:
+            raise RuntimeError('Options differ in what the batch shares')
+
+        args = args_list[0]
+        model, perceptor = self.load_models(args)
+        latent = self.latent_space(args, model)
+
+        zs = [self.init_latent(args, model, latent) for args in args_list]
+        z_origs = [z.clone() for z in zs]
+        for z in zs:
+            z.requires_grad_(True)
+
+        prompts = [
+            self.encode_prompts(args, perceptor, latent)
+            for args in args_list
+        ]
+        opts = [
+            self.make_optimiser(args, z)
+            for args, z in zip(args_list, zs)
+        ]
+        scaler = self.make_scaler()
+
+        dh.debug('VqganClipService', 'Using device:', self.device)
+        dh.debug('VqganClipService', 'Batch of', len(args_list), 'latents')
+        for args in args_list:
+            dh.debug('VqganClipService', 'Using text prompts:', args.prompts)
+
+        self.seed_rng(args_list[0])
+
+        policies = [self.convergence_policy(args) for args in args_list]
+        stats = [
+            IterationStats(iterations=0, max_iterations=args.max_iterations)
+            for args in args_list
+        ]
+        losses = None
+        # each latent's loss as of its last iteration, read once at the end;
+        # reading them every iteration would sync with the device, which is
+        # only worth it to check convergence
+        last_losses = [None] * len(args_list)
+        check = any(policy is not None for policy in policies)
+
+        try:
+            with tqdm() as pbar:
+                for i in range(args_list[0].max_iterations):
+                    losses = self.train(
+                        model,
+                        perceptor,
+                        args_list,
+                        prompts,
+                        # converged latents stay put while the rest carry on
+                        [
+                            None if latent_stats.converged else opt
+                            for opt, latent_stats in zip(opts, stats)
+                        ],
+                        zs,
+                        z_origs,
+                        latent,
+                        i,
+                        scaler
+                    )
+                    pbar.update()
+                    values = (
+                        torch.stack([loss.detach() for loss in losses]).tolist()
+                        if check
+                        else None
+                    )
+                    for k, (policy, latent_stats, loss) in enumerate(
+                        zip(policies, stats, losses)
+                    ):
+                        if latent_stats.converged:
+                            continue
+                        latent_stats.iterations = i + 1
+                        last_losses[k] = loss.detach()
+                        if policy is not None and policy.converged(i, values[k]):
+                            latent_stats.converged = True
+                    if all(latent_stats.converged for latent_stats in stats):
+                        break
+        except KeyboardInterrupt:
+            pass
+
+        if any(latent_stats.converged for latent_stats in stats):
+            # stopped before the display iteration, or some latents did
+            self.checkin(
+                model,
+                zs,
+                [args.prompts for args in args_list],
+                [
+                    args.output_filename if args.save_output else None
+                    for args in args_list
+                ],
+                stats[0].iterations,
+                [[loss] for loss in losses]
+            )
+
+        for latent_stats, loss in zip(stats, last_losses):
+            latent_stats.loss = None if loss is None else loss.item()
+
+        del opts
+        torch.cuda.empty_cache()
 
+        frames = self.frames or [None] * len(args_list)
+        for args, frame in zip(args_list, frames):
+            self.debug_files(args, frame)
+
+        self.stats = stats
+        dh.debug('VqganClipService', 'stats', stats)
+
+        return frames
+
+    def batch_key(self, args: VqganClipOptions):
+        """What options optimised in one batch have to have in common."""
+        return (
+            tuple(args.size),
+            args.max_iterations,
+            args.display_freq,
+            args.clip_model,
+            args.vqgan_config,
+            args.vqgan_checkpoint,
+            args.cutn,
+            args.cut_pow,
+            tuple(tuple(augments) for augments in args.augments),
+            args.amp,
+            args.amp_dtype,
+            args.channels_last,
+        )
+
+    def prepare(self, args: VqganClipOptions):
         if args.cudnn_determinism:
             torch.backends.cudnn.deterministic = True
 
@@ -103,19 +390,22 @@ class VqganClipService:
 
         dh.debug('VqganClipService', 'size', args.size)
 
+    def load_models(self, args: VqganClipOptions):
+        self.amp_dtype = self.resolve_amp_dtype(args)
+        self.channels_last = args.channels_last
+        dh.debug('VqganClipService', 'amp', self.amp_dtype, 'channels_last', self.channels_last)
+
         # VQGAN
-        model = self.vqgan_helper.load_vqgan_model(
-            args.vqgan_config,
-            args.vqgan_checkpoint
-        ).to(self.device)
+        model = self.load_vqgan(args.vqgan_config, args.vqgan_checkpoint)
+        if self.channels_last:
+            model.decoder.to(memory_format=torch.channels_last)
 
         # CLIP
-        jit = True if float(torch.__version__[:3]) < 1.8 else False
-        perceptor = clip.load(
-            args.clip_model,
-            jit=jit
-        )[0].eval().requires_grad_(False).to(self.device)
+        perceptor = self.load_clip(args.clip_model)
 
+        return model, perceptor
+
+    def latent_space(self, args: VqganClipOptions, model) -> LatentSpace:
         f = 2 ** (model.decoder.num_resolutions - 1)
 
         toksX, toksY = args.size[0] // f, args.size[1] // f
@@ -132,8 +422,30 @@ class VqganClipService:
             z_min = model.quantize.embedding.weight.min(dim=0).values[None, :, None, None]
             z_max = model.quantize.embedding.weight.max(dim=0).values[None, :, None, None]
 
+        return LatentSpace(
+            toksX=toksX,
+            toksY=toksY,
+            sideX=sideX,
+            sideY=sideY,
+            e_dim=e_dim,
+            n_toks=n_toks,
+            z_min=z_min,
+            z_max=z_max
+        )
+
+    def init_latent(self, args: VqganClipOptions, model, latent: LatentSpace):
+        sideX, sideY = latent.sideX, latent.sideY
+
         # Image initialisation
-        if args.init_image:
+        if args.init_frame is not None:
+            frame = args.init_frame
+            if (frame.width, frame.height) == (sideX, sideY):
+                pil_tensor = frame.tensor(self.device)
+            else:
+                pil_image = frame.pil().resize((sideX, sideY), Image.LANCZOS)
+                pil_tensor = TF.to_tensor(pil_image).to(self.device)
+            z, *_ = model.encode(pil_tensor.unsqueeze(0) * 2 - 1)
+        elif args.init_image:
             if 'http' in args.init_image:
                 img = Image.open(urlopen(args.init_image))
             else:
@@ -162,19 +474,25 @@ class VqganClipService:
             )
         else:
             one_hot = F.one_hot(
-                torch.randint(n_toks, [toksY * toksX], device=self.device),
-                n_toks
+                torch.randint(
+                    latent.n_toks,
+                    [latent.toksY * latent.toksX],
+                    device=self.device
+                ),
+                latent.n_toks
             ).float()
             if self.vqgan_helper.gumbel:
                 z = one_hot @ model.quantize.embed.weight
             else:
                 z = one_hot @ model.quantize.embedding.weight
 
-            z = z.view([-1, toksY, toksX, e_dim]).permute(0, 3, 1, 2)
+            z = z.view(
+                [-1, latent.toksY, latent.toksX, latent.e_dim]
+            ).permute(0, 3, 1, 2)
 
-        z_orig = z.clone()
-        z.requires_grad_(True)
+        return z
 
+    def encode_prompts(self, args: VqganClipOptions, perceptor, latent: LatentSpace):
         prompts = []
 
         # CLIP tokenize/encode
@@ -184,9 +502,12 @@ class VqganClipService:
             if ground:
                 txt = txt[:-1]
             txt = txt.strip()
-            embed = perceptor.encode_text(
-                clip.tokenize(txt).to(self.device)
-            ).float()
+            embed = self.encode_text(
+                perceptor,
+                args.clip_model,
+                txt,
+                quantized=args.quantize_text
+            )
             dh.debug('VqganClipService', 'prompt', txt, 'ground', ground)
             prompts.append(self.clip_helper.prompt(
                 embed,
@@ -200,7 +521,7 @@ class VqganClipService:
             path, weight, stop = self.parse_prompt(prompt)
             img = Image.open(path)
             pil_image = img.convert('RGB')
-            img = self.resize_image(pil_image, (sideX, sideY))
+            img = self.resize_image(pil_image, (latent.sideX, latent.sideY))
             batch = self.make_cutouts(
                 args,
                 perceptor,
@@ -226,37 +547,86 @@ class VqganClipService:
                 weight
             ).to(self.device))
 
-        # Set the optimiser
+        return prompts
+
+    def encode_text(
+        self,
+        perceptor,
+        clip_model: str,
+        text: str,
+        quantized: bool = False
+    ):
+        if quantized:
+            encoder = self.load_quantized_text_encoder(perceptor, clip_model)
+            return TextEmbeddingCache.get(
+                '%s:int8' % clip_model,
+                text,
+                lambda: encoder(clip.tokenize(text)),
+                self.device
+            )
+
+        return TextEmbeddingCache.get(
+            clip_model,
+            text,
+            lambda: perceptor.encode_text(
+                clip.tokenize(text).to(self.device)
+            ).float(),
+            self.device
+        )
+
+    def load_quantized_text_encoder(self, perceptor, clip_model: str) -> TextEncoder:
+        """The int8 text encoder, quantised and saved on first use."""
+        path = self.quantized_text_encoder_path(clip_model)
+
+        def load():
+            if os.path.isfile(path):
+                return Quantizer.load(path)
+            dh.debug('VqganClipService', 'quantising text encoder', clip_model)
+            encoder = Quantizer.quantize_linear(TextEncoder(perceptor))
+            Quantizer.save(encoder, path)
+            return encoder
+
+        return ModelRegistry.get('clip_text_int8', clip_model, load, torch.device('cpu'))
+
+    def quantized_text_encoder_path(self, clip_model: str) -> str:
+        return Quantizer.path(os.path.join(
+            'checkpoints',
+            'clip-%s-text' % clip_model.replace('/', '-')
+        ))
+
+    def make_optimiser(self, args: VqganClipOptions, z):
         if args.optimiser == "Adam":
-            opt = optim.Adam([z], lr=args.step_size)  # LR=0.1 (Default)
+            return optim.Adam([z], lr=args.step_size)  # LR=0.1 (Default)
         elif args.optimiser == "AdamW":
-            opt = optim.AdamW([z], lr=args.step_size)  # LR=0.2
+            return optim.AdamW([z], lr=args.step_size)  # LR=0.2
         elif args.optimiser == "Adagrad":
-            opt = optim.Adagrad([z], lr=args.step_size)  # LR=0.5+
+            return optim.Adagrad([z], lr=args.step_size)  # LR=0.5+
         elif args.optimiser == "Adamax":
-            opt = optim.Adamax([z], lr=args.step_size)  # LR=0.5+?
+            return optim.Adamax([z], lr=args.step_size)  # LR=0.5+?
         elif args.optimiser == "DiffGrad":
-            opt = DiffGrad([z], lr=args.step_size)  # LR=2+?
+            return DiffGrad([z], lr=args.step_size)  # LR=2+?
         elif args.optimiser == "AdamP":
-            opt = AdamP([z], lr=args.step_size)  # LR=2+?
+            return AdamP([z], lr=args.step_size)  # LR=2+?
         elif args.optimiser == "RAdam":
-            opt = RAdam([z], lr=args.step_size)  # LR=2+?
+            return RAdam([z], lr=args.step_size)  # LR=2+?
         else:
             raise RuntimeError("Unknown optimiser. Are choices broken?")
 
-        # Output for the user
-        dh.debug('VqganClipService', 'Using device:', self.device)
-        dh.debug('VqganClipService', 'Optimising using:', args.optimiser)
+    def convergence_policy(self, args: VqganClipOptions) -> Optional[ConvergencePolicy]:
+        if not args.convergence_window:
+            return None
+        return ConvergencePolicy(
+            args.convergence_window,
+            args.convergence_threshold,
+            args.min_iterations
+        )
 
-        if args.prompts:
-            dh.debug('VqganClipService', 'Using text prompts:', args.prompts)
-        if args.image_prompts:
-            dh.debug('VqganClipService', 'Using image prompts:', args.image_prompts)
-        if args.init_image:
-            dh.debug('VqganClipService', 'Using initial image:', args.init_image)
-        if args.noise_prompt_weights:
-            dh.debug('VqganClipService', 'Noise prompt weights:', args.noise_prompt_weights)
+    def make_scaler(self):
+        if self.amp_dtype == torch.float16 and self.device.type == 'cuda':
+            return torch.cuda.amp.GradScaler()
+        return None
 
+    def seed_rng(self, args: VqganClipOptions):
         if args.seed is None:
             seed = torch.seed()
         else:
@@ -264,32 +634,10 @@ class VqganClipService:
         torch.manual_seed(seed)
         dh.debug('VqganClipService', 'Using seed:', seed)
 
-        # DO IT @todo put training in a separate Trainer class
-        i = 0
-        try:
-            with tqdm() as pbar:
-                while i < args.max_iterations:
-                    self.train(
-                        model,
-                        perceptor,
-                        args,
-                        prompts,
-                        opt,
-                        z,
-                        z_min,
-                        z_max,
-                        z_orig,
-                        i
-                    )
-                    i += 1
-                    pbar.update()
-        except KeyboardInterrupt:
-            pass
-
-        del model, perceptor, opt
-        torch.cuda.empty_cache()
-
-        if os.getenv('DEBUG_FILES'):
+    def debug_files(self, args: VqganClipOptions, frame: Frame):
+        if os.getenv('DEBUG_FILES') and frame is not None:
+            if not args.save_output:
+                frame.save(args.output_filename)
             self.file_service.put(
                 args.output_filename,
                 'vqgan_clip-%s' % (
@@ -297,6 +645,118 @@ class VqganClipService:
                 )
             )
 
+    def load_vqgan(self, config_path, checkpoint_path):
+        model = ModelRegistry.get(
+            'vqgan',
+            checkpoint_path,
+            lambda: self.vqgan_helper.load_vqgan_model(
+                config_path,
+                checkpoint_path
+            ).to(self.device),
+            self.device
+        )
+        self.vqgan_helper.gumbel = self.vqgan_helper.is_gumbel(model)
+        return model
+
+    def load_clip(self, clip_model):
+        jit = True if float(torch.__version__[:3]) < 1.8 else False
+        return ModelRegistry.get(
+            'clip',
+            clip_model,
+            lambda: clip.load(
+                clip_model,
+                jit=jit
+            )[0].eval().requires_grad_(False).to(self.device),
+            self.device
+        )
+
+    def latent_fingerprint(self, args: VqganClipOptions, z) -> dict:
+        return {
+            'prompts': args.prompts,
+            'image_prompts': args.image_prompts,
+            'size': list(args.size),
+            'max_iterations': args.max_iterations,
+            'optimiser': args.optimiser,
+            'step_size': args.step_size,
+            'z_shape': list(z.shape),
+        }
+
+    def save_latent(self, args: VqganClipOptions, z, opt, i):
+        # saved before iteration i runs, so that the final checkpoint (taken
+        # before the last iteration) can still reproduce the output image
+        state = {
+            'fingerprint': self.latent_fingerprint(args, z),
+            'iteration': i,
+            'z': z.detach().cpu(),
+            'optimizer': opt.state_dict(),
+            'rng': torch.get_rng_state(),
+            'cuda_rng': (
+                torch.cuda.get_rng_state_all()
+                if torch.cuda.is_available()
+                else None
+            ),
+        }
+        torch.save(state, args.checkpoint_file + '.tmp')
+        os.replace(args.checkpoint_file + '.tmp', args.checkpoint_file)
+
+    def load_latent(self, args: VqganClipOptions, z, opt) -> int:
+        if not os.path.isfile(args.checkpoint_file):
+            return 0
+
+        state = torch.load(args.checkpoint_file, map_location='cpu')
+        if state['fingerprint'] != self.latent_fingerprint(args, z):
+            dh.debug('VqganClipService', 'ignoring stale latent', args.checkpoint_file)
+            return 0
+
+        with torch.no_grad():
+            z.copy_(state['z'].to(self.device))
+        opt.load_state_dict(state['optimizer'])
+        torch.set_rng_state(state['rng'])
+        if state['cuda_rng'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['cuda_rng'])
+
+        dh.debug('VqganClipService', 'resuming from iteration', state['iteration'])
+        return state['iteration']
+
+    def resolve_amp_dtype(self, args: VqganClipOptions):
+        if not args.amp:
+            return None
+        if args.amp_dtype:
+            return getattr(torch, args.amp_dtype)
+        return torch.float16 if self.device.type == 'cuda' else torch.bfloat16
+
+    def autocast(self):
+        if self.amp_dtype is None:
+            return nullcontext()
+        return torch.autocast(self.device.type, dtype=self.amp_dtype)
+
+    @torch.no_grad()
+    def clip_score(self, image_file: str, text: str, clip_model: str = 'ViT-B/32'):
+        """Spherical distance between an image and a text in fp32 CLIP space.
+
+        Uses the whole image, without cutouts or augmentation, so the same
+        image always scores the same.
+        """
+        perceptor = self.load_clip(clip_model)
+        size = perceptor.visual.input_resolution
+        image = Image.open(image_file).convert('RGB').resize(
+            (size, size),
+            Image.LANCZOS
+        )
+        image_embed = perceptor.encode_image(
+            self.normalize(TF.to_tensor(image).unsqueeze(0).to(self.device))
+        ).float()
+        text_embed = self.encode_text(perceptor, clip_model, text)
+        return F.normalize(image_embed, dim=-1).sub(
+            F.normalize(text_embed, dim=-1)
+        ).norm(dim=-1).div(2).arcsin().pow(2).mul(2).item()
+
+    def warm_up(self, args: VqganClipOptions = None):
+        if args is None:
+            args = VqganClipOptions()
+        self.load_vqgan(args.vqgan_config, args.vqgan_checkpoint)
+        self.load_clip(args.clip_model)
+
     def sinc(self, x):
         return torch.where(
             x != 0,
@@ -410,83 +870,123 @@ class VqganClipService:
                 z.movedim(1, 3),
                 model.quantize.embedding.weight
             ).movedim(3, 1)
+        if self.channels_last:
+            z_q = z_q.contiguous(memory_format=torch.channels_last)
+        with self.autocast():
+            out = model.decode(z_q)
         return self.clip_helper.clamp_with_grad(
-            model.decode(z_q).add(1).div(2),
+            out.float().add(1).div(2),
             0,
             1
         )
 
     @torch.no_grad()
-    def checkin(self, model, z, prompts, output, i, losses):
-        losses_str = ', '.join(f'{loss.item():g}' for loss in losses)
-        tqdm.write(
-            f'i: {i}, loss: {sum(losses).item():g}, losses: {losses_str}'
-        )
-        out = self.synth(model, z)
-        info = PngImagePlugin.PngInfo()
-        info.add_text('comment', f'{prompts}')
-        dh.debug('VqganClipService', "vqgan_clip.py:", "Writing VQGAN/CLIP output frame:", os.path.abspath(output))
-        TF.to_pil_image(out[0].cpu()).save(output, pnginfo=info)
-
-    def ascend_txt(self, model, perceptor, args, prompts, z_orig, z, i):
-        out = self.synth(model, z)
-        cutouts, offsets, sizes = self.make_cutouts(args, perceptor, out)
-        inputs = perceptor.encode_image(self.normalize(cutouts)).float()
-
-        result = []
-
-        if args.init_weight:
-            result.append(
-                F.mse_loss(
-                    z,
-                    torch.zeros_like(z_orig)
-                ) * (
-                    (1 / torch.tensor(i * 2 + 1)) * args.init_weight
-                ) / 2
+    def checkin(self, model, zs, prompts, outputs, i, losses):
+        for losses_latent in losses:
+            losses_str = ', '.join(f'{loss.item():g}' for loss in losses_latent)
+            tqdm.write(
+                f'i: {i}, loss: {sum(losses_latent).item():g}, losses: {losses_str}'
             )
+        out = self.synth(model, self.stack(zs))
+        self.frames = [Frame.from_tensor(image) for image in out]
+        for frame, prompts_latent, output in zip(self.frames, prompts, outputs):
+            if output is None:
+                continue
+            info = PngImagePlugin.PngInfo()
+            info.add_text('comment', f'{prompts_latent}')
+            dh.debug('VqganClipService', "vqgan_clip.py:", "Writing VQGAN/CLIP output frame:", os.path.abspath(output))
+            frame.save(output, pnginfo=info)
+
+    def stack(self, zs):
+        return zs[0] if len(zs) == 1 else torch.cat(zs)
+
+    def ascend_txt(self, model, perceptor, args_list, prompts, z_origs, zs, i):
+        out = self.synth(model, self.stack(zs))
+        cutouts, offsets, sizes = self.make_cutouts(args_list[0], perceptor, out)
+        with self.autocast():
+            inputs = perceptor.encode_image(self.normalize(cutouts)).float()
+        # cutouts come out cutout-major: row n * len(zs) + k is latent k's
+        inputs = inputs.view(-1, len(zs), inputs.shape[-1])
+
+        results = []
+        for k, (args, prompts_latent, z_orig, z) in enumerate(
+            zip(args_list, prompts, z_origs, zs)
+        ):
+            result = []
 
-        for prompt in prompts:
-            result.append(prompt(inputs, offsets, sizes))
+            if args.init_weight:
+                result.append(
+                    F.mse_loss(
+                        z,
+                        torch.zeros_like(z_orig)
+                    ) * (
+                        (1 / torch.tensor(i * 2 + 1)) * args.init_weight
+                    ) / 2
+                )
 
-        return result
+            for prompt in prompts_latent:
+                result.append(prompt(inputs[:, k], offsets, sizes))
+
+            results.append(result)
+
+        return results
 
     def train(
         self,
         model,
         perceptor,
-        args,
+        args_list,
         prompts,
-        opt,
-        z,
-        z_min,
-        z_max,
-        z_orig,
-        i
+        opts,
+        zs,
+        z_origs,
+        latent,
+        i,
+        scaler=None
     ):
-        opt.zero_grad(set_to_none=True)
+        for z in zs:
+            z.grad = None
         loss_all = self.ascend_txt(
             model,
             perceptor,
-            args,
+            args_list,
             prompts,
-            z_orig,
-            z,
+            z_origs,
+            zs,
             i
         )
 
-        if i % args.display_freq == 0:
+        if i % args_list[0].display_freq == 0:
             self.checkin(
                 model,
-                z,
-                args.prompts,
-                args.output_filename,
+                zs,
+                [args.prompts for args in args_list],
+                [
+                    args.output_filename if args.save_output else None
+                    for args in args_list
+                ],
                 i,
                 loss_all
             )
 
-        loss = sum(loss_all)
-        loss.backward()
-        opt.step()
+        # latents don't interact, so one backward over the summed losses
+        # gives every latent the gradient of its own loss
+        losses = [sum(loss_latent) for loss_latent in loss_all]
+        loss = sum(losses)
+        if scaler is None:
+            loss.backward()
+            for opt in opts:
+                if opt is not None:
+                    opt.step()
+        else:
+            scaler.scale(loss).backward()
+            for opt in opts:
+                if opt is not None:
+                    scaler.step(opt)
+            scaler.update()
 
         with torch.no_grad():
-            z.copy_(z.maximum(z_min).minimum(z_max))
+            for z in zs:
+                z.copy_(z.maximum(latent.z_min).minimum(latent.z_max))
+
+        return [loss.detach() for loss in losses]
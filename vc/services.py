@@ -22,6 +22,7 @@ def services(binder: Binder):
     bind_singleton(binder, service.JobService)
     bind_singleton(binder, service.JobSerializer)
     bind_singleton(binder, service.FileService)
+    bind_singleton(binder, service.ProgressService)
 
 
 def bind_event_listener(
@@ -13,6 +13,11 @@ class ImageSpec:
     ground: Optional[str] = None
     iterations: int = 200
     upscale: bool = False
+    # early stopping, off unless a window is given; iterations is the most
+    # that will run
+    convergence_window: Optional[int] = None
+    convergence_threshold: float = 0.005
+    min_iterations: int = 0
 
     schema = api.model('Image Spec', {
         'texts': fields.List(fields.String, default_factory=list),
@@ -20,6 +25,9 @@ class ImageSpec:
         'ground': fields.String,
         'iterations': fields.Integer(default=200),
         'upscale': fields.Boolean(default=False),
+        'convergence_window': fields.Integer,
+        'convergence_threshold': fields.Float(default=0.005),
+        'min_iterations': fields.Integer(default=0),
     })
 
 
@@ -43,6 +51,9 @@ class VideoStepSpec(ImageSpec):
         'ground': fields.String,
         'iterations': fields.Integer(default=75),
         'upscale': fields.Boolean(default=False),
+        'convergence_window': fields.Integer,
+        'convergence_threshold': fields.Float(default=0.005),
+        'min_iterations': fields.Integer(default=0),
         'interpolate': fields.Boolean(default=False),
         'init_iterations': fields.Integer(default=200),
         'epochs': fields.Integer(default=42),
@@ -1,3 +1,6 @@
+import os
+
+from vc.service.generation import GenerationService
 from vc.service.queue import QueueService
 
 from . import create_app
@@ -5,5 +8,10 @@ from .injector import injector
 
 if __name__ == '__main__':
     app = create_app()
+
+    # load the networks once, up front, so the first job doesn't pay for it
+    if not os.getenv('SKIP_WARM_UP'):
+        injector.get(GenerationService).warm_up()
+
     queue_service = injector.get(QueueService)
     queue_service.get_worker().work()